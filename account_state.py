@@ -0,0 +1,208 @@
+import copy
+from collections import deque
+
+from transaction import CompactTransaction, register_address
+
+
+DEFAULT_STAKE = 10
+
+
+def transaction_fields(transaction):
+    """
+    Return a transaction whose fields can be read like a dict's, whether it
+    is stored as a dict, a CompactTransaction or a Transaction instance.
+    """
+    if isinstance(transaction, (dict, CompactTransaction)):
+        return transaction
+    return transaction.to_dict()
+
+
+class Account:
+    def __init__(self):
+        self.balance = 0
+        self.stake = None  # Amount of the latest stake transaction, if any
+        self.nonce = 0  # Highest nonce sent by this address
+
+    def copy(self):
+        account = Account()
+        account.balance = self.balance
+        account.stake = self.stake
+        account.nonce = self.nonce
+        return account
+
+    def to_dict(self):
+        return {'balance': self.balance, 'stake': self.stake, 'nonce': self.nonce}
+
+    @classmethod
+    def from_dict(cls, data):
+        account = cls()
+        account.balance = data['balance']
+        account.stake = data['stake']
+        account.nonce = data['nonce']
+        return account
+
+
+class AccountState:
+    """
+    Per-address balance, stake and nonce index.
+
+    `confirmed` holds the state after every block of the chain has been
+    applied in order, `pending` holds copies of the accounts touched by the
+    transaction pool with the pool applied on top of the confirmed state.
+    Folding transactions one at a time gives exactly the same results as
+    walking the chain and the pool on every lookup.
+
+    Lookups take no lock. Rebuilds fill a new dict and swap it in, so a
+    concurrent reader never sees a partly rebuilt state. Updates are
+    serialized by the Blockchain's locks.
+    """
+
+    def __init__(self, undo_depth=0):
+        self.confirmed = {}
+        self.pending = {}
+        # For the last `undo_depth` blocks applied, the confirmed accounts each one changed as they were
+        # before it (None for an account it created), so a branch switch can roll them back
+        self.undo_depth = undo_depth
+        self.undo = deque()  # (block index, {address: Account or None})
+        # Bumped whenever a stake may have changed, invalidates the cached weights
+        self.stake_version = 0
+        # (key, weights), replaced as a whole so readers never pair a key with other weights
+        self._weights = (None, None)
+
+    def rebuild(self, chain, transaction_pool):
+        confirmed = {}
+        for block in chain:
+            for transaction in block.transactions:
+                self._apply(confirmed, transaction_fields(transaction))
+        self.confirmed = confirmed
+        self.undo = deque()
+        self.reset_pending(transaction_pool)
+
+    def confirmed_to_dict(self):
+        """
+        The confirmed state as a list of [address, account] pairs, since
+        addresses are not always strings (stakes are sent to address 0).
+        """
+        return [[address, account.to_dict()] for address, account in self.confirmed.items()]
+
+    def load_confirmed(self, accounts, transaction_pool):
+        self.confirmed = {register_address(address): Account.from_dict(account) for address, account in accounts}
+        self.undo = deque()
+        self.reset_pending(transaction_pool)
+
+    def apply_block(self, block):
+        changed = {} if self.undo_depth else None
+        for transaction in block.transactions:
+            self._apply(self.confirmed, transaction_fields(transaction), changed=changed)
+        if changed is not None:
+            self.undo.append((block.index, changed))
+            if len(self.undo) > self.undo_depth:
+                self.undo.popleft()
+
+    def rollback(self, height):
+        """
+        Undo the blocks from index `height` onwards on the confirmed state.
+        Returns False, changing nothing, if the undo log does not reach back
+        that far. The pending state has to be reset afterwards.
+        """
+        if not self.undo or self.undo[0][0] > height:
+            return False
+        while self.undo and self.undo[-1][0] >= height:
+            _, changed = self.undo.pop()
+            for address, account in changed.items():
+                if account is None:
+                    self.confirmed.pop(address, None)
+                else:
+                    self.confirmed[address] = account
+        self.stake_version += 1
+        return True
+
+    def reset_pending(self, transaction_pool):
+        pending = {}
+        for transaction in transaction_pool:
+            self._apply(pending, transaction_fields(transaction), pending=True)
+        self.pending = pending
+        self.stake_version += 1
+
+    def apply_pending(self, transaction):
+        self._apply(self.pending, transaction_fields(transaction), pending=True)
+
+    def _account(self, accounts, address, pending, changed=None):
+        account = accounts.get(address)
+        if changed is not None and address not in changed:
+            changed[address] = account.copy() if account is not None else None
+        if account is None:
+            if pending:
+                base = self.confirmed.get(address)
+                account = copy.copy(base) if base is not None else Account()
+                # Pool stakes are tracked apart from the confirmed stake
+                account.stake = None
+            else:
+                account = Account()
+                address = register_address(address)
+            accounts[address] = account
+        return account
+
+    def _apply(self, accounts, transaction, pending=False, changed=None):
+        sender_address = transaction['sender_address']
+        receiver_address = transaction['receiver_address']
+
+        receiver = self._account(accounts, receiver_address, pending, changed)
+        receiver.balance += transaction['amount']
+
+        sender = self._account(accounts, sender_address, pending, changed)
+        if receiver_address != 0 and sender.balance > 0:
+            if transaction['type_of_transaction'] == "Welcome!":
+                sender.balance -= transaction['amount']
+            elif transaction['type_of_transaction'] == "coin":
+                sender.balance -= 1.03*transaction['amount']
+            elif transaction['type_of_transaction'] == "message":
+                sender.balance -= len(transaction['message'])
+
+        if transaction['type_of_transaction'] == "stake":
+            sender.stake = transaction['amount']
+            self.stake_version += 1
+        sender.nonce = max(sender.nonce, transaction['nonce'])
+
+    def balance(self, public_key):
+        account = self.pending.get(public_key) or self.confirmed.get(public_key)
+        if account is None or account.balance <= 0:
+            return 0
+        return account.balance
+
+    def stake(self, public_key):
+        pending = self.pending.get(public_key)
+        confirmed = self.confirmed.get(public_key)
+        totstake = DEFAULT_STAKE
+        if pending is not None and pending.stake is not None:
+            totstake = pending.stake
+        # A pool stake equal to the default falls back to the chain, as the scan did
+        if totstake == DEFAULT_STAKE and confirmed is not None and confirmed.stake is not None:
+            return confirmed.stake
+        return totstake
+
+    def nonce(self, public_key):
+        account = self.pending.get(public_key) or self.confirmed.get(public_key)
+        return account.nonce if account is not None else 0
+
+    def cumulative_stakes(self, public_keys):
+        """
+        Running totals of the stakes of `public_keys`, in the given order, and
+        whether they are non-decreasing (so they can be binary searched).
+        Cached until a stake or the list of keys changes.
+        """
+        key = (tuple(public_keys), self.stake_version)
+        cached_key, weights = self._weights
+        if cached_key != key:
+            cumulative = []
+            current = 0
+            monotonic = True
+            for public_key in public_keys:
+                stake = self.stake(public_key)
+                if stake < 0:
+                    monotonic = False
+                current += stake
+                cumulative.append(current)
+            weights = (cumulative, monotonic)
+            self._weights = (key, weights)
+        return weights
@@ -0,0 +1,419 @@
+import json
+import logging
+
+import loadgen
+import profiling
+from block import Block
+from sealing import MAX_BLOCK_SIZE
+from transaction import Transaction
+
+
+# Route handlers shared by the Flask app in rest.py and the async server in
+# async_server.py. Each takes the node and the decoded request, and returns
+# (body, status) where body is a dict to encode or already encoded JSON bytes.
+
+logger = logging.getLogger(__name__)
+
+
+def register(node, values):
+    if not isinstance(values, dict):
+        return {'message': 'Missing public key or node address'}, 400
+    try:
+        # Extract the public key and node address from the incoming JSON
+        public_key = values.get('public_key')
+        node_address = values.get('node_address')
+
+        # Validate the incoming data
+        if not public_key or not node_address:
+            return {'message': 'Missing public key or node address'}, 400
+
+
+        # A node restarted with its stored wallet keeps its id and is not funded again
+        assigned_node_id = node.get_node_id_by_public_key(public_key)
+        if assigned_node_id is not None:
+            node.nodes[assigned_node_id]['address'] = node_address
+            print(f"Node {assigned_node_id} registered again.")
+        else:
+            assigned_node_id = node.next_node_id
+            print(f"Current node: {assigned_node_id}")
+
+            node.nodes[assigned_node_id] = {'public_key': public_key, 'address': node_address}
+            node.next_node_id += 1
+
+            print(f"Node {assigned_node_id} registered.")
+
+            node.transfer_bcc_to_new_node(public_key, 1000)
+
+        print(f"Total nodes: {node.total_nodes}")
+
+        # A node that can bootstrap from a snapshot downloads it and the blocks after it, instead of the whole chain here
+        snapshot = node.blockchain.snapshots.latest if values.get('snapshot') and node.blockchain.snapshots is not None else None
+        if snapshot is None:
+            blockchain_data = [block.to_dict() for block in node.blockchain.blocks()]
+
+        broadcast_blockchain(node)
+
+        if node.next_node_id == node.total_nodes:
+            node.broadcast_all()
+
+        nodes_data = {
+            node_id: {
+                'address': node_info['address'],
+                'public_key': node_info['public_key']
+            }
+            for node_id, node_info in node.nodes.items()
+        }
+
+        response = {
+            'message': 'New node registered successfully',
+            'node_id': assigned_node_id,  # Include the node ID in the response
+            'node_address': node_address,
+            'total_nodes': [node_info['address'] for node_info in node.nodes.values()],
+            'transaction_pool': node.blockchain.pending_transactions(),
+            'nodes': nodes_data
+        }
+        if snapshot is None:
+            response['blockchain'] = blockchain_data
+        else:
+            response['snapshot'] = snapshot
+        return response, 200
+    except Exception as e:
+        logger.exception("Failed to register node: %s", e)
+        return {'error': 'Internal server error'}, 500
+
+
+def new_transaction(node, values):
+    # The sender signed the transaction, only its signature is checked here
+    if not isinstance(values, dict):
+        return {'error': 'Malformed transaction'}, 400
+    try:
+        new_transaction = Transaction.from_dict(values)
+    except (KeyError, TypeError, ValueError):
+        return {'error': 'Malformed transaction'}, 400
+    if values.get('transaction_id') != new_transaction.transaction_id.hexdigest():
+        return {'error': 'Transaction id does not match its contents'}, 400
+    if node.blockchain.knows_transaction(values['transaction_id']):
+        return {'error': 'Transaction already received'}, 409
+
+    if node.verifier is not None:
+        node.verifier.submit(values)
+        return {'message': 'Transaction queued for verification'}, 202
+
+    if node.admit_transaction(new_transaction):
+        return {'error': 'Transaction broadcasted'}, 200
+    else:
+        return {'error': 'Invalid transaction'}, 400
+
+
+def new_transactions(node, values):
+    """
+    Admit a batch of transactions, {'transactions': [...]}. Answers with the
+    status each one would have had on its own.
+    """
+    transactions = values.get('transactions') if isinstance(values, dict) else None
+    if not isinstance(transactions, list):
+        return {'error': 'Missing transactions list'}, 400
+    statuses = [new_transaction(node, transaction)[1] if isinstance(transaction, dict) else 400 for transaction in transactions]
+    return {'message': f'{statuses.count(200) + statuses.count(202)} of {len(statuses)} transactions accepted', 'statuses': statuses}, 200
+
+
+def receive_block(node, values):
+    # Log the received values for debugging purposes
+    print("Received data for new block:", values)
+    if not isinstance(values, dict) or not isinstance(values.get('transactions'), list):
+        return {'error': 'Invalid block', 'message': 'Expected a block object'}, 400
+
+    # Blocks are as large as their validator's sealing policy made them, they are not cut to the local capacity
+    if len(values['transactions']) > MAX_BLOCK_SIZE:
+        return {'error': 'Invalid block', 'message': f"Blocks hold at most {MAX_BLOCK_SIZE} transactions"}, 400
+
+    # Instantiate the Block here
+    new_block = Block(
+        index=values['index'],
+        transactions=values['transactions'],
+        validator=values['validator'],
+        previous_hash=values['previous_hash'],
+        capacity=len(values['transactions']),
+        timestamp=values.get('timestamp')
+    )
+    node.metrics.block_received(new_block)
+
+    # Out of order and competing blocks are kept in the block tree, not rejected
+    status, message = node.blockchain.receive_block(new_block, node.validate_validator)
+    if status == 'invalid':
+        return {'error': 'Invalid block', 'message': message}, 400
+    if status == 'added':
+        # The pool may still hold a full batch for the next validator
+        node.mint_worker.request_mint()
+    if status == 'orphan':
+        return {'message': message}, 202
+    return {'message': message}, 200
+
+
+def blocks_json(blocks):
+    """
+    JSON array of blocks, joined from each block's cached encoding.
+    """
+    return b'[' + b','.join(block.to_json() for block in blocks) + b']'
+
+
+def full_chain(node):
+    # Copied under the read lock, encoded after releasing it. A chain bootstrapped
+    # from a snapshot only holds the blocks from its tip, length counts them all
+    chain = node.blockchain.blocks()
+    length = len(chain) + (chain[0].index if chain else 0)
+    return b'{"chain":' + blocks_json(chain) + b',"length":' + str(length).encode() + b'}', 200
+
+
+def update_blockchain(node, data):
+    if not isinstance(data, dict):
+        return {'error': 'Invalid data received'}, 400
+    try:
+        incoming_chain = data['blockchain_data']
+
+        if not incoming_chain:
+            return {'error': 'Invalid data received'}, 400
+
+        incoming_blocks = [Block(**block_data) for block_data in incoming_chain]
+        node.blockchain.set_transaction_pool(data['transaction_pool'])
+        # Validate the candidate on its own, readers keep seeing the current chain meanwhile
+        if not node.blockchain.validate_chain(incoming_blocks):
+            return {'error': 'Received chain is invalid'}, 400
+        if node.blockchain.replace_if_longer(incoming_blocks):
+            updated_chain = [block.to_dict() for block in node.blockchain.blocks()]
+            return {'message': 'Blockchain updated successfully', 'new_chain': updated_chain}, 200
+        return {'message': 'Received chain is not longer than the current chain'}, 200
+    except Exception as e:
+        logger.exception("Failed to update blockchain: %s", str(e))
+        return {'error': 'Internal server error'}, 500
+
+
+def receive_data(node, received_data):
+    if not isinstance(received_data, dict):
+        return {'error': 'Invalid data received'}, 400
+    try:
+        node.update_nodes(received_data)
+        return {'message': 'Node updated successfully'}, 200
+    except Exception as e:
+        logger.exception("Failed to receive node: %s", e)
+        return {'error': 'Internal server error'}, 500
+
+
+def blocks(node, args, binary=False):
+    """
+    Blocks from index `from` onwards. When the caller sends its tip `hash`,
+    the range is only served if it extends that tip. With binary=True the
+    body is returned as a dict, for the binary wire format to pack.
+    """
+    try:
+        start = int(args.get('from', 0))
+    except ValueError:
+        return {'error': 'Invalid from index'}, 400
+
+    tip_hash = args.get('hash')
+    with node.blockchain.lock.read():
+        chain = node.blockchain.chain
+        length = len(chain)
+        base_index = node.blockchain.base_index()
+        if start < 0 or start > length:
+            return {'error': 'Block index out of range', 'length': length}, 409
+        if start < base_index:
+            # Bootstrapped from a snapshot, the blocks before it are not held here
+            return {'error': 'Blocks before the snapshot are not available', 'length': length, 'base_index': base_index}, 409
+        if tip_hash is not None and (start - 1 < base_index or chain[start - 1].current_hash != tip_hash):
+            return {'error': 'Chain does not extend the given tip', 'length': length}, 409
+        blocks = list(chain[start:])
+
+    transaction_pool = node.blockchain.pending_transactions()
+    if binary:
+        return {'blocks': [block.to_dict() for block in blocks], 'transaction_pool': transaction_pool, 'length': length}, 200
+    body = (b'{"blocks":' + blocks_json(blocks)
+            + b',"transaction_pool":' + json.dumps(transaction_pool).encode()
+            + b',"length":' + str(length).encode() + b'}')
+    return body, 200
+
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+
+
+def transaction(node, transaction_id):
+    """
+    A transaction by id, with where it was committed, or from the pool if it is still pending.
+    """
+    found = node.blockchain.find_transaction(transaction_id)
+    if found is not None:
+        block, position = found
+        return {
+            'status': 'committed',
+            'block_index': block.index,
+            'block_hash': block.current_hash,
+            'position': position,
+            'transaction': block.transaction_dicts()[position],
+        }, 200
+    pending = node.blockchain.pending_transaction(transaction_id)
+    if pending is not None:
+        return {'status': 'pending', 'transaction': pending.to_dict()}, 200
+    return {'error': 'Transaction not found'}, 404
+
+
+def address_history(node, address, args):
+    """
+    A page of the committed transactions sent or received by an address, newest first.
+    """
+    try:
+        offset = int(args.get('offset', 0))
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        return {'error': 'Invalid offset or limit'}, 400
+    if offset < 0 or not 0 < limit <= MAX_PAGE_SIZE:
+        return {'error': f'offset must not be negative and limit must be between 1 and {MAX_PAGE_SIZE}'}, 400
+
+    total, page = node.blockchain.address_history(address, offset, limit)
+    transactions = [{
+        'block_index': block.index,
+        'position': position,
+        'transaction': block.transaction_dicts()[position],
+    } for block, position in page]
+    return {
+        'address': address,
+        'total': total,
+        'offset': offset,
+        'limit': limit,
+        'next_offset': offset + len(transactions) if offset + len(transactions) < total else None,
+        'transactions': transactions,
+    }, 200
+
+
+def transaction_proof(node, transaction_id):
+    """
+    Merkle proof that a committed transaction is in its block, with the
+    block's header, so a light client can check it without the whole block.
+    """
+    found = node.blockchain.find_transaction(transaction_id)
+    if found is None:
+        return {'error': 'Transaction not found in the chain'}, 404
+    block, position = found
+    return {
+        'transaction': block.transaction_dicts()[position],
+        'position': position,
+        'block': block.header(),
+        'proof': block.merkle_proof(position),
+    }, 200
+
+
+def open_snapshot(node):
+    """
+    (open file, headers) of the latest snapshot, or (None, None) if this node has none.
+    """
+    if node.blockchain.snapshots is None:
+        return None, None
+    file, metadata = node.blockchain.snapshots.open()
+    if file is None:
+        return None, None
+    headers = {
+        'Content-Length': str(metadata['size']),
+        'X-Snapshot-Height': str(metadata['height']),
+        'X-Snapshot-Tip-Hash': metadata['tip_hash'],
+        'X-Snapshot-Digest': metadata['digest'],
+    }
+    return file, headers
+
+
+def sync(node, values):
+    peer_address = values.get('address') if isinstance(values, dict) else None
+    if not peer_address:
+        return {'error': 'Missing peer address'}, 400
+    try:
+        if node.sync_with(peer_address):
+            return {'message': 'Blockchain synchronized', 'length': len(node.blockchain.chain)}, 200
+        return {'message': 'Blockchain unchanged', 'length': len(node.blockchain.chain)}, 200
+    except Exception as e:
+        logger.exception("Failed to sync blockchain: %s", e)
+        return {'error': 'Internal server error'}, 500
+
+
+def broadcast_blockchain(node):
+    """
+    Ask every registered peer to pull the blocks it is missing from this node.
+    """
+    node_addresses = [node_info["address"] for node_id, node_info in node.nodes.items()]
+
+    # The newest node is still registering and receives the chain in the /register response
+    node_urls = [f"{node_address}/sync" for node_address in node_addresses[:-1] if node_address != node.api_url]
+    for node_url, response, error in node.transport.post_all(node_urls, json={'address': node.api_url}):
+        if error is not None:
+            print(f"Error broadcasting blockchain to {node_url}: {error}")
+        elif response.status_code == 200:
+            print(f"Successfully broadcasted blockchain to {node_url}.")
+        else:
+            print(f"Failed to broadcast blockchain to {node_url}. Status Code: {response.status_code}")
+    return {'message': 'Blockchain broadcasted'}, 200
+
+
+def load_options(data):
+    """
+    LoadGenerator options given with /start_test.
+    """
+    options = {}
+    for name, convert in (('mode', str), ('rate', float), ('concurrency', int), ('batch_size', int), ('commit_timeout', float)):
+        if data.get(name) is not None:
+            options[name] = convert(data[name])
+    if options.get('mode', 'open') not in loadgen.MODES:
+        raise ValueError(f"Unknown load generator mode '{options['mode']}'")
+    return options
+
+
+def metrics(node):
+    """
+    The node's metrics in the Prometheus text format, as bytes.
+    """
+    body = node.metrics.exposition(node.mint_worker, len(node.blockchain.transaction_pool))
+    if profiling.timers.stats:
+        body += ('\n'.join(profiling.timers.exposition()) + '\n').encode()
+    return body
+
+
+def profile(node):
+    return {'enabled': profiling.timers.enabled, 'timers': profiling.timers.snapshot()}, 200
+
+
+def set_profile(node, values):
+    """
+    Turn the function timers on or off, {'enabled': bool}, and clear them with {'reset': true}.
+    """
+    values = values or {}
+    if not isinstance(values, dict):
+        return {'error': 'Expected a JSON object'}, 400
+    if 'enabled' in values:
+        profiling.timers.enabled = bool(values['enabled'])
+    if values.get('reset'):
+        profiling.timers.reset()
+    return profile(node)
+
+
+def profile_sample(node, args):
+    """
+    Sample every thread of the node for ?seconds= and return the report as text bytes.
+    """
+    try:
+        seconds = float(args.get('seconds', profiling.DEFAULT_SAMPLE_SECONDS))
+    except ValueError:
+        return {'error': 'seconds must be a number'}, 400
+    return profiling.sample_threads(seconds).encode(), 200
+
+
+def start_test(node, data):
+    if not isinstance(data, dict):
+        return {'error': 'Missing transactions_folder in JSON data'}, 400
+    transactions_folder = data.get('transactions_folder')
+    node_id = node.get_node_id_by_public_key(node.wallet.public_key)
+    try:
+        options = load_options(data)
+    except (TypeError, ValueError) as e:
+        return {'error': str(e)}, 400
+    if transactions_folder:
+        results = node.start_transaction_test(transactions_folder, node_id, **options)
+        return {'message': f'Transaction tests started for all nodes using folder {transactions_folder}', 'results': results}, 200
+    else:
+        return {'error': 'Missing transactions_folder in JSON data'}, 400
@@ -0,0 +1,262 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+from aiohttp import web
+
+import api
+import metrics
+import wire
+from snapshot import CHUNK_SIZE
+from transport import DEFAULT_TIMEOUT, CONFIGURED_TIMEOUT
+
+
+DEFAULT_HANDLER_THREADS = 64
+# Whole chains are posted to /update_blockchain, so allow large bodies
+MAX_REQUEST_SIZE = 256 * 1024 * 1024
+
+
+class PeerResponse:
+    """
+    The parts of a `requests.Response` the node reads, for a response
+    received by AsyncPeerTransport.
+    """
+
+    def __init__(self, status_code, content, headers):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class AsyncPeerTransport:
+    """
+    Outgoing HTTP to the other nodes on an aiohttp client session.
+
+    Same interface as PeerTransport. The session lives on the server's
+    event loop: the node's blocking code (request handlers on worker
+    threads, the mint worker) hands each request to the loop and waits for
+    the result, so `post_all` runs one coroutine per peer on a single loop
+    instead of holding a thread per peer.
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, codec=None):
+        self.timeout = timeout
+        self.codec = codec
+        self.loop = None
+        self.session = None
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0))
+
+    async def request(self, method, url, timeout=CONFIGURED_TIMEOUT, encoded=None, **kwargs):
+        if timeout is CONFIGURED_TIMEOUT:
+            timeout = self.timeout
+        timeout = aiohttp.ClientTimeout(total=timeout)
+        if method == 'GET':
+            kwargs = wire.accept_kwargs(kwargs, self.codec)
+        elif encoded is None:
+            encoded = wire.encode_payload(self.codec, kwargs)
+        if encoded is not None:
+            async with self.session.request(method, url, timeout=timeout, **wire.binary_kwargs(kwargs, encoded)) as response:
+                if response.status != 415:
+                    return PeerResponse(response.status, await response.read(), response.headers)
+        async with self.session.request(method, url, timeout=timeout, **kwargs) as response:
+            return PeerResponse(response.status, await response.read(), response.headers)
+
+    async def request_all(self, method, urls, timeout, **kwargs):
+        # Encoded once for all peers
+        encoded = wire.encode_payload(self.codec, kwargs)
+        return await asyncio.gather(*(self.request(method, url, timeout, encoded, **kwargs) for url in urls), return_exceptions=True)
+
+    def run(self, coroutine):
+        """
+        Run a coroutine on the event loop from a blocking thread and wait for its result.
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def post(self, url, timeout=CONFIGURED_TIMEOUT, **kwargs):
+        return self.run(self.request('POST', url, timeout, **kwargs))
+
+    def get(self, url, timeout=CONFIGURED_TIMEOUT, **kwargs):
+        return self.run(self.request('GET', url, timeout, **kwargs))
+
+    def post_all(self, urls, timeout=CONFIGURED_TIMEOUT, **kwargs):
+        """
+        POST the same payload to every url concurrently.
+
+        Returns a list of (url, response, error) tuples in the order of `urls`,
+        where exactly one of response and error is None. Pass timeout=None to
+        wait for slow endpoints indefinitely.
+        """
+        results = []
+        for url, outcome in zip(urls, self.run(self.request_all('POST', urls, timeout, **kwargs))):
+            if isinstance(outcome, (aiohttp.ClientError, asyncio.TimeoutError)):
+                results.append((url, None, outcome))
+            elif isinstance(outcome, BaseException):
+                raise outcome
+            else:
+                results.append((url, outcome, None))
+        return results
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+
+def create_app(node, handler_threads=DEFAULT_HANDLER_THREADS):
+    """
+    aiohttp application serving the same routes as the Flask app in rest.py.
+
+    The node's state is not async aware, so the api handlers still run on a
+    thread pool; the event loop only parses requests, writes responses and
+    carries the node's outgoing requests to its peers.
+    """
+    app = web.Application(client_max_size=MAX_REQUEST_SIZE)
+    executor = ThreadPoolExecutor(max_workers=handler_threads, thread_name_prefix='async-handler')
+    transport = AsyncPeerTransport(timeout=node.transport.timeout, codec=node.transport.codec)
+
+    def wants_binary(request):
+        return node.wire is not None and wire.accepts(request.headers.get('Accept'))
+
+    async def call(request, handler, *args):
+        body, status = await asyncio.get_running_loop().run_in_executor(executor, handler, node, *args)
+        if isinstance(body, bytes):
+            return web.Response(body=body, status=status, content_type='application/json')
+        if wants_binary(request):
+            return web.Response(body=node.wire.encode(body, shared=False), status=status, content_type=wire.CONTENT_TYPE)
+        return web.json_response(body, status=status)
+
+    async def json_body(request):
+        """
+        The request body, decoded from JSON or from the binary wire format.
+        """
+        if request.content_type == wire.CONTENT_TYPE:
+            if node.wire is None:
+                raise web.HTTPUnsupportedMediaType()
+            try:
+                return node.wire.decode(await request.read())
+            except wire.WireError:
+                raise web.HTTPUnsupportedMediaType()
+        try:
+            return await request.json()
+        except ValueError:
+            return None
+
+    async def register(request):
+        return await call(request, api.register, await json_body(request))
+
+    async def new_transaction(request):
+        return await call(request, api.new_transaction, await json_body(request))
+
+    async def get_transaction(request):
+        return await call(request, api.transaction, request.match_info['transaction_id'])
+
+    async def address_history(request):
+        return await call(request, api.address_history, request.match_info['address'], request.query)
+
+    async def transaction_proof(request):
+        return await call(request, api.transaction_proof, request.match_info['transaction_id'])
+
+    async def new_transactions(request):
+        return await call(request, api.new_transactions, await json_body(request))
+
+    async def new_block(request):
+        return await call(request, api.receive_block, await json_body(request))
+
+    async def get_full_chain(request):
+        return await call(request, api.full_chain)
+
+    async def update_blockchain(request):
+        return await call(request, api.update_blockchain, await json_body(request))
+
+    async def receive_nodes(request):
+        return await call(request, api.receive_data, await json_body(request))
+
+    async def get_blocks(request):
+        return await call(request, api.blocks, request.query, wants_binary(request))
+
+    async def get_snapshot(request):
+        loop = asyncio.get_running_loop()
+        file, headers = await loop.run_in_executor(executor, api.open_snapshot, node)
+        if file is None:
+            return web.json_response({'error': 'No snapshot available'}, status=404)
+        response = web.StreamResponse(headers=headers)
+        response.content_type = 'application/gzip'
+        await response.prepare(request)
+        with file:
+            while True:
+                chunk = await loop.run_in_executor(executor, file.read, CHUNK_SIZE)
+                if not chunk:
+                    break
+                await response.write(chunk)
+        await response.write_eof()
+        return response
+
+    async def sync(request):
+        return await call(request, api.sync, await json_body(request))
+
+    async def broadcast_blockchain(request):
+        return await call(request, api.broadcast_blockchain)
+
+    async def get_metrics(request):
+        body = await asyncio.get_running_loop().run_in_executor(executor, api.metrics, node)
+        return web.Response(body=body, headers={'Content-Type': metrics.CONTENT_TYPE})
+
+    async def get_profile(request):
+        return await call(request, api.profile)
+
+    async def set_profile(request):
+        return await call(request, api.set_profile, await json_body(request))
+
+    async def profile_sample(request):
+        body, status = await asyncio.get_running_loop().run_in_executor(executor, api.profile_sample, node, request.query)
+        if status != 200:
+            return web.json_response(body, status=status)
+        return web.Response(body=body, headers={'Content-Type': 'text/plain; charset=utf-8'})
+
+    async def start_test(request):
+        return await call(request, api.start_test, await json_body(request))
+
+    app.router.add_post('/register', register)
+    app.router.add_post('/transactions/new', new_transaction)
+    app.router.add_post('/transactions/batch', new_transactions)
+    app.router.add_get('/transactions/{transaction_id}', get_transaction)
+    # Addresses are base64 public keys, which may contain slashes
+    app.router.add_get('/address/{address:.+}/history', address_history)
+    app.router.add_get('/transactions/{transaction_id}/proof', transaction_proof)
+    app.router.add_post('/receive_block', new_block)
+    app.router.add_get('/blockchain', get_full_chain)
+    app.router.add_post('/update_blockchain', update_blockchain)
+    app.router.add_post('/receive_data', receive_nodes)
+    app.router.add_get('/blocks', get_blocks)
+    app.router.add_get('/snapshot', get_snapshot)
+    app.router.add_post('/sync', sync)
+    app.router.add_post('/broadcast_blockchain', broadcast_blockchain)
+    app.router.add_get('/metrics', get_metrics)
+    app.router.add_get('/profile', get_profile)
+    app.router.add_post('/profile', set_profile)
+    app.router.add_get('/profile/sample', profile_sample)
+    app.router.add_post('/start_test', start_test)
+
+    async def on_startup(app):
+        await transport.start()
+        # Peer requests made from now on go through the event loop
+        previous_transport, node.transport = node.transport, transport
+        previous_transport.close()
+
+    async def on_cleanup(app):
+        await transport.close()
+        executor.shutdown(wait=False)
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+def run(node, host, port, handler_threads=DEFAULT_HANDLER_THREADS):
+    web.run_app(create_app(node, handler_threads), host=host, port=port)
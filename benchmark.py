@@ -0,0 +1,1132 @@
+"""
+Micro-benchmarks for the node internals.
+
+Each subcommand runs on its own, without a running network:
+
+    python benchmark.py broadcast --nodes 5 10 20
+    python benchmark.py verify --transactions 2000 --workers 4
+    python benchmark.py signing --nodes 5 10
+    python benchmark.py store --blocks 10000 100000
+
+`server` starts a bootstrap node with rest.py in each server mode and
+measures how many requests it answers under concurrent load.
+
+    python benchmark.py server --concurrency 8 32 --duration 10
+
+`network` starts N local nodes with rest.py for each block capacity,
+replays the {N}_nodes trace folder from all of them and writes the metrics
+in the layout of the *nodes_capacity* folders, with a results.csv table of
+throughput, block time and p50/p99 submit to commit latency.
+
+    python benchmark.py network --nodes 5 10 --capacity 5 10 20
+    python benchmark.py network --max_wait 0 --output network_results_full_blocks
+    python benchmark.py network --adaptive_capacity --output network_results_adaptive
+
+`stress` submits transactions to one node from many threads while blocks
+are committed and the chain is read, then checks the node's state.
+
+    python benchmark.py stress --submitters 32 --senders 8
+
+`wire` replays the transaction test folders and counts the bytes peers
+would exchange as JSON and in the binary wire format.
+
+    python benchmark.py wire --folders 5_nodes 10_nodes
+
+`merkle` compares confirming one transaction from its whole block against
+checking a Merkle inclusion proof.
+
+    python benchmark.py merkle --transactions 5 100 1000
+
+`validate` receives a chain a few blocks longer than the local one and
+compares validating it in full against resuming from the last checkpoint.
+
+    python benchmark.py validate --blocks 1000 10000 100000
+
+`index` looks transactions up by id and pages through an address's
+history, scanning the chain against the transaction index.
+
+    python benchmark.py index --blocks 1000 10000 100000
+
+`memory` decodes a chain of 100k transactions in a fresh process and
+compares the resident memory of transaction dicts and compact transactions.
+
+    python benchmark.py memory --transactions 100000
+
+`forks` delivers blocks out of order, as concurrent broadcasts do, and
+counts the blocks a reject-or-append node loses against the block tree,
+then times switching to a longer competing branch.
+
+    python benchmark.py forks --blocks 1000 --window 2 4 8
+
+`profiling` measures what the hot-path timers cost per call, off and on.
+
+    python benchmark.py profiling --calls 1000000
+
+`snapshot` compares bootstrapping a new node from the whole chain in the
+/register response against a snapshot followed by the blocks after it.
+
+    python benchmark.py snapshot --blocks 1000 10000 100000
+"""
+import argparse
+import base64
+import contextlib
+import csv
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import random
+import statistics
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+import requests
+from Crypto.PublicKey import RSA
+from Crypto.Signature import PKCS1_v1_5
+
+import api
+import merkle
+from account_state import AccountState, DEFAULT_STAKE
+from block import Block
+from block_store import BlockStore, StoredChain
+from blockchain import Blockchain
+from node import Node
+from transaction import Transaction, verify_transaction_dict
+from transport import PeerTransport
+from verifier import BatchVerifier
+from wallet import Wallet
+from wire import WireCodec
+from snapshot import read_snapshot, CHUNK_SIZE
+from loadgen import percentile
+from sealing import DEFAULT_MAX_WAIT
+import profiling
+
+
+REPOSITORY = os.path.dirname(os.path.abspath(__file__))
+
+
+class FakePeerHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    delay = 0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(self.delay)
+        body = b'{"message": "ok"}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fake_peers(count, delay):
+    """
+    Start `count` local HTTP servers that answer every POST after `delay` seconds.
+    """
+    handler = type('DelayedPeerHandler', (FakePeerHandler,), {'delay': delay})
+    servers = []
+    for _ in range(count):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        server.daemon_threads = True
+        Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+    return servers
+
+
+def bench_broadcast(args):
+    payload = {
+        'sender_address': 'x' * 300,
+        'receiver_address': 'y' * 300,
+        'type_of_transaction': 'message',
+        'amount': 0.0,
+        'message': 'benchmark',
+        'nonce': 1,
+    }
+    print(f"{'nodes':>5} {'serial ms':>10} {'pooled ms':>10} {'speedup':>8}")
+    for count in args.nodes:
+        servers = start_fake_peers(count, args.delay / 1000)
+        urls = [f"http://127.0.0.1:{server.server_address[1]}/transactions/new" for server in servers]
+        transport = PeerTransport()
+
+        serial = []
+        for _ in range(args.rounds):
+            start = time.perf_counter()
+            for url in urls:
+                requests.post(url, json=payload)
+            serial.append(time.perf_counter() - start)
+
+        pooled = []
+        for _ in range(args.rounds):
+            start = time.perf_counter()
+            transport.post_all(urls, json=payload)
+            pooled.append(time.perf_counter() - start)
+
+        serial_ms = statistics.mean(serial) * 1000
+        pooled_ms = statistics.mean(pooled) * 1000
+        print(f"{count:>5} {serial_ms:>10.2f} {pooled_ms:>10.2f} {serial_ms / pooled_ms:>7.1f}x")
+
+        transport.close()
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+
+
+def signed_transactions(count, senders=5):
+    """
+    `count` signed message transactions in dict form, spread over a few wallets.
+    """
+    wallets = [Wallet() for _ in range(senders)]
+    transactions = []
+    for i in range(count):
+        sender = wallets[i % senders]
+        receiver = wallets[(i + 1) % senders]
+        transaction = Transaction(sender.public_key, receiver.public_key, "message", 0.0, f"benchmark {i}", i // senders + 1)
+        transaction.sign_transaction(sender.private_key)
+        transactions.append(transaction.to_dict())
+    return transactions
+
+
+def verify_inline_uncached(transaction_data):
+    # The original path: parse the sender's key on every verification
+    transaction = Transaction.from_dict(transaction_data)
+    pk = RSA.import_key(base64.b64decode(transaction.sender_address))
+    return PKCS1_v1_5.new(pk).verify(transaction.transaction_id, transaction.signature)
+
+
+def bench_verify(args):
+    transactions = signed_transactions(args.transactions)
+
+    def throughput(verify_all):
+        start = time.perf_counter()
+        results = verify_all()
+        elapsed = time.perf_counter() - start
+        assert all(results)
+        return len(transactions) / elapsed
+
+    print(f"{'path':<28} {'tx/s':>10}")
+    uncached = throughput(lambda: [verify_inline_uncached(tx) for tx in transactions])
+    print(f"{'inline, key parsed per tx':<28} {uncached:>10.0f}")
+    cached = throughput(lambda: [verify_transaction_dict(tx) for tx in transactions])
+    print(f"{'inline, cached keys':<28} {cached:>10.0f}")
+
+    verifier = BatchVerifier(args.workers)
+    verifier.verify(transactions[:args.workers])  # Start the worker processes before timing
+
+    def verify_in_batches():
+        results = []
+        for i in range(0, len(transactions), args.batch_size):
+            results.extend(verifier.verify(transactions[i:i + args.batch_size]))
+        return results
+
+    pooled = throughput(verify_in_batches)
+    print(f"{f'{args.workers} processes, batch {args.batch_size}':<28} {pooled:>10.0f}")
+    verifier.shutdown()
+
+
+def bench_signing(args):
+    """
+    CPU spent on RSA per broadcast transaction when every receiver re-signs it,
+    against signing once at the sender and only verifying at the receivers.
+    """
+    wallet = Wallet()
+    transactions = []
+    start = time.process_time()
+    for i in range(args.transactions):
+        transaction = Transaction(wallet.public_key, wallet.public_key, "message", 0.0, f"benchmark {i}", i)
+        transaction.sign_transaction(wallet.private_key)
+        transactions.append(transaction.to_dict())
+    sign_ms = (time.process_time() - start) * 1000 / args.transactions
+
+    start = time.process_time()
+    for transaction in transactions:
+        verify_transaction_dict(transaction)
+    verify_ms = (time.process_time() - start) * 1000 / args.transactions
+
+    print(f"sign {sign_ms:.3f} ms, verify {verify_ms:.3f} ms per transaction")
+    print(f"{'nodes':>5} {'re-sign ms':>11} {'sign once ms':>13} {'saved ms':>9}")
+    for count in args.nodes:
+        # Before, the sender signed nothing and each of the receivers signed and verified
+        resign = count * (sign_ms + verify_ms)
+        sign_once = sign_ms + count * verify_ms
+        print(f"{count:>5} {resign:>11.3f} {sign_once:>13.3f} {resign - sign_once:>9.3f}")
+
+
+def synthetic_chain(count, transactions_per_block=1):
+    """
+    Yield `count` linked blocks carrying small message transactions.
+    """
+    previous_hash = "1"
+    for index in range(count):
+        transactions = [{
+            'sender_address': f"sender{index % 10}",
+            'receiver_address': f"receiver{index % 7}",
+            'type_of_transaction': "message",
+            'amount': 0,
+            'message': f"block {index} transaction {i}",
+            'nonce': index,
+            'transaction_id': f"{index:032x}{i:032x}",
+            'signature': None,
+        } for i in range(transactions_per_block)]
+        block = Block(index, transactions, "validator", previous_hash, capacity=transactions_per_block, timestamp=index)
+        previous_hash = block.current_hash
+        yield block
+
+
+def bench_store(args):
+    print(f"{'blocks':>7} {'write s':>8} {'open ms':>8} {'tip ms':>7} {'eager load s':>13}")
+    for count in args.blocks:
+        directory = tempfile.mkdtemp(prefix='blockstore-')
+        try:
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                blockchain = Blockchain(store=BlockStore(directory))
+                for block in synthetic_chain(count):
+                    blockchain.add_block(block)
+            write = time.perf_counter() - start
+            blockchain.store.close()
+
+            # Restart: map the files, restore the account state, read the tip
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                restarted = Blockchain(store=BlockStore(directory))
+            opened = time.perf_counter() - start
+            start = time.perf_counter()
+            restarted.chain[-1]
+            tip = time.perf_counter() - start
+
+            # What a restart would cost if every block were decoded up front
+            start = time.perf_counter()
+            list(StoredChain(restarted.store, cache_size=0))
+            eager = time.perf_counter() - start
+            restarted.store.close()
+
+            print(f"{count:>7} {write:>8.2f} {opened * 1000:>8.2f} {tip * 1000:>7.3f} {eager:>13.2f}")
+        finally:
+            shutil.rmtree(directory)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_node(server, options=('--is_bootstrap',), cwd=None):
+    """
+    Run a node with rest.py in the given server mode and wait until it
+    answers, a bootstrap node unless other options are given. A peer only
+    starts serving once it has registered with the bootstrap node.
+    """
+    port = free_port()
+    # The CLI thread reads stdin, keep it open for the lifetime of the node
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(REPOSITORY, 'rest.py'), '--host', '127.0.0.1', '--port', str(port), '--server', server, *options],
+        cwd=cwd or REPOSITORY,
+        stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while True:
+        try:
+            requests.get(url + '/blockchain', timeout=1)
+            return process, url
+        except requests.exceptions.ConnectionError:
+            if process.poll() is not None or time.time() > deadline:
+                process.kill()
+                raise Exception(f"{server} node did not start")
+            time.sleep(0.2)
+
+
+def load_node(url, transactions, concurrency, duration):
+    """
+    `concurrency` clients alternate GET /blockchain and POST /transactions/new
+    for `duration` seconds. Returns the latency of every answered request and
+    the number of failed ones.
+    """
+    latencies = []
+    errors = []
+    stop_at = time.perf_counter() + duration
+
+    def client(offset):
+        session = requests.Session()
+        i = offset
+        while time.perf_counter() < stop_at:
+            start = time.perf_counter()
+            try:
+                if i % 2:
+                    session.get(url + '/blockchain', timeout=10)
+                else:
+                    session.post(url + '/transactions/new', json=transactions[i % len(transactions)], timeout=10)
+                latencies.append(time.perf_counter() - start)
+            except requests.exceptions.RequestException:
+                errors.append(i)
+            i += 1
+        session.close()
+
+    clients = [Thread(target=client, args=(offset,)) for offset in range(concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    return latencies, len(errors)
+
+
+def bench_server(args):
+    """
+    Request throughput of the Flask server against the async server. The
+    posted transactions are signed by wallets without funds, so each one is
+    parsed and verified and then rejected, leaving the node's state as it was.
+    """
+    transactions = signed_transactions(50)
+    print(f"{'server':<7} {'clients':>7} {'requests':>9} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for server in args.servers:
+        process, url = start_node(server)
+        try:
+            for concurrency in args.concurrency:
+                latencies, errors = load_node(url, transactions, concurrency, args.duration)
+                latencies.sort()
+                p50 = latencies[len(latencies) // 2] * 1000 if latencies else 0
+                p99 = latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0
+                print(f"{server:<7} {concurrency:>7} {len(latencies):>9} {len(latencies) / args.duration:>8.0f} {p50:>8.2f} {p99:>8.2f} {errors:>7}")
+        finally:
+            stop_nodes([process])
+
+
+def stop_nodes(processes):
+    for process in processes:
+        # Closing stdin ends the CLI thread, which the async server waits for on shutdown
+        process.stdin.close()
+        process.terminate()
+    for process in processes:
+        process.wait()
+
+
+def start_network(count, capacity, server, directory, extra_options=()):
+    """
+    A bootstrap node and `count` - 1 peers on localhost ports, started one
+    after the other as each registers. They share `directory` as working
+    directory, so their metrics files end up in one test_results folder.
+    """
+    options = ['--total_nodes', str(count), '--block_capacity', str(capacity), *extra_options]
+    processes = []
+    urls = []
+    try:
+        process, bootstrap_url = start_node(server, options + ['--is_bootstrap'], cwd=directory)
+        processes.append(process)
+        urls.append(bootstrap_url)
+        for _ in range(count - 1):
+            process, url = start_node(server, options + ['--bootstrap_url', bootstrap_url], cwd=directory)
+            processes.append(process)
+            urls.append(url)
+        wait_for_agreement(urls)
+    except Exception:
+        stop_nodes(processes)
+        raise
+    return processes, urls
+
+
+def wait_for_agreement(urls, timeout=60):
+    """
+    Wait until every node has the same tip. Returns the chain length.
+    """
+    deadline = time.time() + timeout
+    while True:
+        tips = set()
+        for url in urls:
+            chain = requests.get(url + '/blockchain', timeout=10).json()
+            tips.add((chain['length'], chain['chain'][-1]['current_hash']))
+        if len(tips) == 1:
+            return tips.pop()[0]
+        if time.time() > deadline:
+            raise Exception(f"The nodes did not agree on a tip within {timeout} seconds")
+        time.sleep(0.5)
+
+
+def run_trace(urls, transactions_folder, options):
+    """
+    POST /start_test to every node at once and collect the load generators' results.
+    """
+    results = [None] * len(urls)
+
+    def start(position):
+        response = requests.post(urls[position] + '/start_test', json=dict(options, transactions_folder=transactions_folder), timeout=None)
+        response.raise_for_status()
+        results[position] = response.json()['results']
+
+    threads = [Thread(target=start, args=(position,)) for position in range(len(urls))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if any(result is None for result in results):
+        raise Exception("A node did not run its transaction test")
+    return results
+
+
+def write_run(directory, run, count, capacity, row):
+    """
+    The run's folder in the layout of the checked-in *nodes_capacity* ones:
+    the per-node metrics files and the aggregate written over the nodes' own.
+    """
+    os.makedirs(directory, exist_ok=True)
+    test_results = os.path.join(run, 'test_results')
+    for name in os.listdir(test_results):
+        shutil.copy(os.path.join(test_results, name), directory)
+    with open(os.path.join(directory, f'metrics_{count}_nodes_capacity{capacity}.txt'), 'w') as file:
+        file.write(f"Total Transactions: {row['transactions']}\n")
+        file.write(f"Total Throughput: {row['throughput']} transactions/second\n")
+        file.write(f"Total Block Count: {row['blocks']}\n")
+        file.write(f"Average Block Time: {row['block_time']} seconds/block\n")
+        file.write(f"Commit Latency p50: {row['latency_p50']} seconds\n")
+        file.write(f"Commit Latency p99: {row['latency_p99']} seconds\n")
+
+
+def bench_network(args):
+    """
+    End to end: for every network size and block capacity, start the nodes
+    with rest.py, replay the {N}_nodes trace folder from all of them at once
+    and measure committed throughput, block time and submit to commit latency.
+
+    Each run's metrics go to <output>/{N}nodes_capacity{C}, and the table is
+    written to <output>/results.csv.
+    """
+    options = {'mode': args.mode, 'rate': args.rate, 'concurrency': args.concurrency, 'batch_size': args.batch_size}
+    sealing = ['--max_wait', str(args.max_wait)] + (['--adaptive_capacity'] if args.adaptive_capacity else [])
+    columns = ['run', 'nodes', 'capacity', 'max_wait', 'adaptive', 'transactions', 'submitted', 'throughput', 'blocks', 'block_time', 'latency_p50', 'latency_p99']
+    rows = []
+    print(f"{'run':<20} {'committed':>9} {'tx/s':>7} {'blocks':>7} {'block s':>8} {'p50 s':>7} {'p99 s':>7}")
+    for count in args.nodes:
+        transactions_folder = os.path.join(REPOSITORY, f'{count}_nodes')
+        if not os.path.isdir(transactions_folder):
+            print(f"No trace folder for {count} nodes, skipping")
+            continue
+        for capacity in args.capacity:
+            run = tempfile.mkdtemp(prefix='blockchat-network-')
+            try:
+                processes, urls = start_network(count, capacity, args.server, run, sealing)
+                try:
+                    height = wait_for_agreement(urls)
+                    results = run_trace(urls, transactions_folder, options)
+                    blocks = wait_for_agreement(urls) - height
+                finally:
+                    stop_nodes(processes)
+
+                committed = sum(result['committed'] for result in results)
+                elapsed = max(result['elapsed'] for result in results)
+                latencies = sorted(latency for result in results for latency in result['latencies'])
+                name = f'{count}nodes_capacity{capacity}'
+                row = {
+                    'run': name,
+                    'nodes': count,
+                    'capacity': capacity,
+                    'max_wait': args.max_wait,
+                    'adaptive': args.adaptive_capacity,
+                    'transactions': committed,
+                    'submitted': sum(result['submitted'] for result in results),
+                    'throughput': committed / elapsed if elapsed > 0 else 0,
+                    'blocks': blocks,
+                    'block_time': elapsed / blocks if blocks else 0,
+                    'latency_p50': percentile(latencies, 0.50),
+                    'latency_p99': percentile(latencies, 0.99),
+                }
+                rows.append(row)
+                write_run(os.path.join(args.output, name), run, count, capacity, row)
+            finally:
+                shutil.rmtree(run, ignore_errors=True)
+            print(f"{name:<20} {committed:>9} {row['throughput']:>7.2f} {blocks:>7} {row['block_time']:>8.3f} {row['latency_p50']:>7.3f} {row['latency_p99']:>7.3f}")
+
+    os.makedirs(args.output, exist_ok=True)
+    with open(os.path.join(args.output, 'results.csv'), 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"Results written to {os.path.join(args.output, 'results.csv')}")
+
+
+def bench_stress(args):
+    """
+    Many threads submit signed transactions to one node while a minter
+    commits blocks and readers fetch the chain and balances. Each sender is
+    funded for fewer messages than it sends, so admission has to reject the
+    rest. Afterwards the node must not have let any sender overspend, every
+    admitted transaction must be committed exactly once or still pooled, the
+    chain must be valid and the account state must match a full rebuild.
+    """
+    funding = 100
+    message = 'x' * 10
+    wallets = [Wallet() for _ in range(args.senders)]
+    transactions = []
+    for wallet in wallets:
+        for nonce in range(1, args.per_sender + 1):
+            transaction = Transaction(wallet.public_key, wallets[0].public_key, "message", 0, message, nonce)
+            transaction.sign_transaction(wallet.private_key)
+            transactions.append(transaction)
+    random.shuffle(transactions)
+
+    blockchain = Blockchain(block_capacity=args.capacity)
+    genesis = [Transaction("0", wallet.public_key, "genesis", funding, "", 0).to_dict() for wallet in wallets]
+    admitted = []
+    read_latencies = []
+    submitting = [True]
+
+    def submitter(batch):
+        for transaction in batch:
+            if node.admit_transaction(transaction):
+                admitted.append(transaction.transaction_id.hexdigest())
+
+    def minter():
+        while submitting[0] or len(blockchain.transaction_pool) >= args.capacity:
+            if len(blockchain.transaction_pool) < args.capacity:
+                time.sleep(0.001)
+                continue
+            tip = blockchain.tip()
+            block = Block(tip.index + 1, blockchain.next_transactions(args.capacity), "stress", tip.current_hash, capacity=args.capacity)
+            blockchain.add_block(block)
+
+    def reader():
+        while submitting[0]:
+            start = time.perf_counter()
+            blockchain.blocks()
+            node.calculate_balance(random.choice(wallets).public_key)
+            read_latencies.append(time.perf_counter() - start)
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        node = Node(host='127.0.0.1', port=0, blockchain=blockchain)
+        blockchain.add_block(Block(0, genesis, "genesis", "1", capacity=len(genesis)))
+
+        workers = [Thread(target=submitter, args=(transactions[i::args.submitters],)) for i in range(args.submitters)]
+        background = [Thread(target=minter)] + [Thread(target=reader) for _ in range(args.readers)]
+        start = time.perf_counter()
+        for thread in background + workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        submitting[0] = False
+        for thread in background:
+            thread.join()
+        chain_valid = blockchain.validate_chain(full=True)
+
+    chain = blockchain.blocks()
+    committed = [transaction['transaction_id'] for block in chain[1:] for transaction in block.transactions]
+    pooled = [transaction['transaction_id'] for transaction in blockchain.pending_transactions()]
+    spent = {}
+    for transaction in transactions:
+        if transaction.transaction_id.hexdigest() in admitted:
+            spent[transaction.sender_address] = spent.get(transaction.sender_address, 0) + len(transaction.message)
+    rebuilt = AccountState()
+    rebuilt.rebuild(chain, blockchain.transaction_pool)
+
+    checks = [
+        ('no sender overspent', all(total <= funding - DEFAULT_STAKE for total in spent.values())),
+        ('committed at most once', len(committed) == len(set(committed))),
+        ('admitted = committed + pooled', sorted(admitted) == sorted(committed + pooled)),
+        ('chain valid', chain_valid),
+        ('state matches rebuild', all(blockchain.state.balance(wallet.public_key) == rebuilt.balance(wallet.public_key) for wallet in wallets)),
+    ]
+
+    read_latencies.sort()
+    print(f"{len(transactions)} submitted by {args.submitters} threads, {len(admitted)} admitted in {elapsed:.2f}s "
+          f"({len(transactions) / elapsed:.0f} tx/s), {len(chain)} blocks")
+    if read_latencies:
+        print(f"{len(read_latencies)} reads, p50 {read_latencies[len(read_latencies) // 2] * 1000:.2f} ms, "
+              f"p99 {read_latencies[int(len(read_latencies) * 0.99)] * 1000:.2f} ms, max {read_latencies[-1] * 1000:.2f} ms")
+    for name, passed in checks:
+        print(f"{name:<30} {'ok' if passed else 'FAILED'}")
+    if not all(passed for _, passed in checks):
+        raise SystemExit(1)
+
+
+def bench_wire(args):
+    """
+    Bytes sent between nodes while replaying a test folder: every transaction
+    and block broadcast to all nodes, and the whole chain sent to every node
+    once (what /register, /update_blockchain and /blocks carry).
+    """
+    print(f"{'folder':<9} {'payload':<13} {'json bytes':>12} {'binary bytes':>13} {'saved':>6}")
+    for folder in args.folders:
+        # The test folders live in the repository, whatever the working directory
+        path = os.path.join(REPOSITORY, folder)
+        files = sorted(name for name in os.listdir(path) if name.startswith('trans'))
+        wallets = [Wallet() for _ in files]
+        keys = [wallet.public_key for wallet in wallets]
+        codec = WireCodec(lambda: keys)
+
+        # Interleave the nodes' files, as the nodes send them concurrently
+        queues = []
+        for sender, name in enumerate(files):
+            with open(os.path.join(path, name)) as file:
+                lines = [line.strip().split(' ', 1) for line in file if line.strip()]
+            queues.append([(sender, int(''.join(filter(str.isdigit, target))), message) for target, message in lines])
+        transactions = []
+        for round_ in zip(*queues):
+            for sender, receiver, message in round_:
+                transaction = Transaction(keys[sender], keys[receiver % len(keys)], "message", 0.0, message, len(transactions) + 1)
+                transaction.sign_transaction(wallets[sender].private_key)
+                transactions.append(transaction.to_dict())
+
+        chain = [Block(0, [], keys[0], "1", capacity=args.capacity)]
+        for i in range(0, len(transactions), args.capacity):
+            previous = chain[-1]
+            chain.append(Block(previous.index + 1, transactions[i:i + args.capacity], keys[i % len(keys)], previous.current_hash, capacity=args.capacity))
+        blocks = [{'index': block.index, 'transactions': block.transaction_dicts(), 'validator': block.validator,
+                   'previous_hash': block.previous_hash} for block in chain[1:]]
+        chain_payload = {'blocks': [block.to_dict() for block in chain], 'length': len(chain)}
+
+        nodes = len(files)
+        rows = [
+            ('transactions', [(transaction, True) for transaction in transactions], nodes),
+            ('blocks', [(block, True) for block in blocks], nodes),
+            ('chain', [(chain_payload, False)], nodes - 1),
+        ]
+        for name, payloads, copies in rows:
+            # requests encodes json= payloads with the default separators
+            json_bytes = sum(len(json.dumps(payload).encode()) for payload, _ in payloads) * copies
+            binary_bytes = sum(len(codec.encode(payload, shared=shared)) for payload, shared in payloads) * copies
+            print(f"{folder:<9} {name:<13} {json_bytes:>12} {binary_bytes:>13} {1 - binary_bytes / json_bytes:>6.0%}")
+
+
+def bench_snapshot(args):
+    """
+    Bootstrap cost on both sides: the bootstrap node encoding what it sends,
+    and the new node decoding, verifying and installing it. The snapshot is
+    taken `--tail` blocks before the tip, those blocks follow as /blocks would
+    send them.
+    """
+    print(f"{'blocks':>7} {'mode':<9} {'bytes':>11} {'send ms':>9} {'receive ms':>11}")
+    for count in args.blocks:
+        directory = tempfile.mkdtemp(prefix='snapshot-')
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                blockchain = Blockchain(block_capacity=1)
+                blockchain.enable_snapshots(directory, 0)
+                chain = list(synthetic_chain(count))
+                blockchain.replace_chain(chain[:count - args.tail])
+                blockchain.snapshots.write()
+                blockchain.append_blocks(chain[count - args.tail:])
+
+            # The whole chain in the /register response
+            start = time.perf_counter()
+            body = json.dumps({'blockchain': [block.to_dict() for block in blockchain.blocks()]}).encode()
+            send = time.perf_counter() - start
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                receiver = Blockchain(block_capacity=1)
+                receiver.adopt_chain([Block(**block_data) for block_data in json.loads(body)['blockchain']])
+            receive = time.perf_counter() - start
+            assert receiver.tip().current_hash == blockchain.tip().current_hash
+            print(f"{count:>7} {'chain':<9} {len(body):>11} {send * 1000:>9.1f} {receive * 1000:>11.1f}")
+
+            # The snapshot file, streamed in chunks, then the blocks after it
+            start = time.perf_counter()
+            file, metadata = blockchain.snapshots.open()
+            with file:
+                data = file.read()
+            tail = api.blocks_json(blockchain.blocks(metadata['height']))
+            send = time.perf_counter() - start
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                receiver = Blockchain(block_capacity=1)
+                tip, accounts = read_snapshot((data[i:i + CHUNK_SIZE] for i in range(0, len(data), CHUNK_SIZE)), metadata)
+                receiver.install_snapshot(tip, accounts)
+                receiver.append_blocks([Block(**block_data) for block_data in json.loads(tail)])
+            receive = time.perf_counter() - start
+            assert receiver.tip().current_hash == blockchain.tip().current_hash
+            assert receiver.state.confirmed_to_dict() == blockchain.state.confirmed_to_dict()
+            print(f"{count:>7} {'snapshot':<9} {len(data) + len(tail):>11} {send * 1000:>9.1f} {receive * 1000:>11.1f}")
+        finally:
+            shutil.rmtree(directory)
+
+
+def bench_merkle(args):
+    """
+    What a light client downloads and hashes to confirm one transaction:
+    the whole block, against its header and a Merkle proof.
+    """
+    print(f"{'txs':>5} {'block bytes':>12} {'proof bytes':>12} {'rehash block us':>16} {'verify proof us':>16}")
+    for size in args.transactions:
+        block = next(synthetic_chain(1, transactions_per_block=size))
+        block_json = json.dumps(block.to_dict())
+        proofs = [(block.transaction_dicts()[position], block.merkle_proof(position)) for position in range(size)]
+        proof_bytes = statistics.mean(len(json.dumps({'transaction': transaction, 'block': block.header(), 'proof': proof}))
+                                      for transaction, proof in proofs)
+
+        start = time.perf_counter()
+        for _ in range(args.rounds):
+            Block(**json.loads(block_json)).calculate_hash()
+        rehash = (time.perf_counter() - start) / args.rounds
+
+        start = time.perf_counter()
+        for round_ in range(args.rounds):
+            transaction, proof = proofs[round_ % size]
+            header = block.header()
+            assert merkle.verify_proof(transaction, proof, header['merkle_root'])
+            assert Block.hash_header(header['index'], header['merkle_root'], header['validator'], header['previous_hash']) == header['current_hash']
+        verify = (time.perf_counter() - start) / args.rounds
+
+        print(f"{size:>5} {len(block_json):>12} {proof_bytes:>12.0f} {rehash * 1e6:>16.1f} {verify * 1e6:>16.1f}")
+
+
+def bench_validate(args):
+    """
+    Receiving a whole chain that is `--tail` blocks longer than the local one,
+    as /update_blockchain does: validating every block against resuming from
+    the verified prefix, and then adopting the chain.
+    """
+    print(f"{'blocks':>7} {'full validate ms':>17} {'resumed validate ms':>20} {'adopt ms':>9}")
+    for count in args.blocks:
+        chain = list(synthetic_chain(count, transactions_per_block=args.transactions))
+        incoming = [block.to_dict() for block in chain]
+        with contextlib.redirect_stdout(io.StringIO()):
+            blockchain = Blockchain(block_capacity=args.transactions)
+            blockchain.replace_chain(chain[:count - args.tail])
+
+            # Fresh blocks every time, so no hash is cached from an earlier run
+            received = [Block(**block_data) for block_data in incoming]
+            start = time.perf_counter()
+            assert blockchain.validate_chain(received, full=True)
+            full = time.perf_counter() - start
+
+            received = [Block(**block_data) for block_data in incoming]
+            start = time.perf_counter()
+            assert blockchain.validate_chain(received)
+            resumed = time.perf_counter() - start
+
+            start = time.perf_counter()
+            assert blockchain.replace_if_longer(received)
+            adopt = time.perf_counter() - start
+        assert blockchain.tip().current_hash == chain[-1].current_hash
+        print(f"{count:>7} {full * 1000:>17.1f} {resumed * 1000:>20.1f} {adopt * 1000:>9.1f}")
+
+
+def accept_validator(block):
+    return True, "Block validator is valid"
+
+
+def bench_forks(args):
+    """
+    Blocks shuffled within a window of `--window` positions are fed to
+    /receive_block's previous reject-or-append handling and to
+    Blockchain.receive_block. Then a branch `--depth` blocks deep, one block
+    longer than the chain, is received at once.
+    """
+    chain = list(synthetic_chain(args.blocks + 1, transactions_per_block=args.transactions))
+    rng = random.Random(7)
+    print(f"{args.blocks} blocks of {args.transactions} transactions")
+    print(f"{'window':>6} {'appended':>9} {'lost':>5} {'tree height':>12} {'tree ms':>8}")
+    for window in args.window:
+        delivered = chain[1:]
+        for start in range(0, len(delivered), window):
+            delivered[start:start + window] = rng.sample(delivered[start:start + window], len(delivered[start:start + window]))
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            blockchain = Blockchain(block_capacity=args.transactions)
+            blockchain.replace_chain(chain[:1])
+            lost = 0
+            for block in delivered:
+                try:
+                    blockchain.add_block(block)
+                except Exception:
+                    lost += 1
+            appended = len(blockchain.chain) - 1
+
+            blockchain = Blockchain(block_capacity=args.transactions)
+            blockchain.replace_chain(chain[:1])
+            start = time.perf_counter()
+            for block in delivered:
+                blockchain.receive_block(block, accept_validator)
+            elapsed = time.perf_counter() - start
+        assert blockchain.tip().current_hash == chain[-1].current_hash
+        print(f"{window:>6} {appended:>9} {lost:>5} {len(blockchain.chain):>12} {elapsed * 1000:>8.1f}")
+
+    fork = len(chain) - args.depth
+    previous_hash = chain[fork - 1].current_hash
+    branch = []
+    for index in range(fork, len(chain) + 1):
+        block = Block(index, [], "competitor", previous_hash, capacity=args.transactions, timestamp=index)
+        previous_hash = block.current_hash
+        branch.append(block)
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for block in branch:
+            blockchain.receive_block(block, accept_validator)
+        elapsed = time.perf_counter() - start
+        pooled = len(blockchain.transaction_pool)
+    assert blockchain.tip().current_hash == branch[-1].current_hash
+    print(f"switched to a branch {len(branch)} blocks deep in {elapsed * 1000:.1f} ms, {pooled} transactions back in the pool")
+
+
+def bench_profiling(args):
+    """
+    Cost per call of the profiling timers on a node's balance lookup, the
+    cheapest of the timed functions: undecorated, with the timers off and
+    with them on.
+    """
+    state = AccountState()
+    lookup = lambda address: state.balance(address)
+    variants = [('plain', lookup, False), ('timers off', profiling.timed(lookup), False), ('timers on', profiling.timed(lookup), True)]
+    print(f"{'variant':<11} {'ns/call':>8}")
+    try:
+        for name, function, enabled in variants:
+            profiling.timers.enabled = enabled
+            start = time.perf_counter()
+            for _ in range(args.calls):
+                function('address')
+            elapsed = time.perf_counter() - start
+            print(f"{name:<11} {elapsed / args.calls * 1e9:>8.0f}")
+    finally:
+        profiling.timers.enabled = False
+        profiling.timers.reset()
+
+
+def bench_index(args):
+    """
+    Explorer queries against a chain: a transaction by id and a page of an
+    address's history, scanning the chain against the transaction index.
+    """
+    print(f"{'blocks':>7} {'query':<9} {'scan ms':>9} {'index ms':>9}")
+    for count in args.blocks:
+        chain = list(synthetic_chain(count, transactions_per_block=5))
+        with contextlib.redirect_stdout(io.StringIO()):
+            blockchain = Blockchain(block_capacity=5)
+            blockchain.replace_chain(chain)
+        targets = [chain[random.randrange(count)].transactions[random.randrange(5)]['transaction_id'] for _ in range(args.lookups)]
+        # The first lookup indexes the replaced chain
+        start = time.perf_counter()
+        blockchain.find_transaction(targets[0])
+        build = time.perf_counter() - start
+
+        def scan_for(transaction_id):
+            for block in reversed(chain):
+                for position, transaction in enumerate(block.transactions):
+                    if transaction['transaction_id'] == transaction_id:
+                        return block, position
+
+        def scan_history(address, limit):
+            page = []
+            for block in reversed(chain):
+                for position in reversed(range(len(block.transactions))):
+                    transaction = block.transactions[position]
+                    if address in (transaction['sender_address'], transaction['receiver_address']):
+                        page.append((block, position))
+                        if len(page) == limit:
+                            return page
+            return page
+
+        start = time.perf_counter()
+        for transaction_id in targets:
+            scan_for(transaction_id)
+        scan = (time.perf_counter() - start) / len(targets)
+        start = time.perf_counter()
+        for transaction_id in targets:
+            assert blockchain.find_transaction(transaction_id) is not None
+        indexed = (time.perf_counter() - start) / len(targets)
+        print(f"{count:>7} {'by id':<9} {scan * 1000:>9.3f} {indexed * 1000:>9.3f}")
+
+        # A page deep into a rare address's history, where a scan has to walk far back
+        address = "receiver3"
+        total, _ = blockchain.address_history(address, 0, 1)
+        offset = max(total - 2 * args.page, 0)
+        start = time.perf_counter()
+        scan_history(address, offset + args.page)
+        scan = time.perf_counter() - start
+        start = time.perf_counter()
+        _, page = blockchain.address_history(address, offset, args.page)
+        indexed = time.perf_counter() - start
+        assert len(page) == min(args.page, total - offset)
+        print(f"{count:>7} {'history':<9} {scan * 1000:>9.3f} {indexed * 1000:>9.3f}   (index built in {build * 1000:.0f} ms)")
+
+
+def resident_bytes():
+    """
+    Current resident set size of this process, read from /proc (Linux).
+    """
+    with open('/proc/self/statm') as file:
+        return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def load_chain_lines(path, compact, result):
+    """
+    Child process of bench_memory: decode a chain of JSON lines and report
+    how much resident memory holding it takes, before and after serving it.
+    """
+    import gc
+    gc.collect()
+    before = resident_bytes()
+    chain = []
+    # Committing the blocks fills the address table, the blocks after them share its copies
+    state = AccountState()
+    with open(path, 'rb') as file:
+        for line in file:
+            block_data = json.loads(line)
+            if compact:
+                block = Block(**block_data)
+                state.apply_block(block)
+                chain.append(block)
+            else:
+                chain.append(block_data)
+    gc.collect()
+    loaded = resident_bytes() - before
+    # Served once, compact blocks keep their encoding up to the JSON cache's bound
+    for block in chain:
+        if compact:
+            block.to_json()
+        else:
+            json.dumps(block).encode()
+    gc.collect()
+    result.put((loaded, resident_bytes() - before))
+
+
+def bench_memory(args):
+    """
+    Resident memory of a chain of `--transactions` signed transactions
+    between `--nodes` wallets, decoded from JSON as a node receives it: kept
+    as the decoded dicts, as blocks held them before, against Blocks of
+    CompactTransactions. Measured again once every block has been served,
+    which fills the blocks' JSON cache.
+    """
+    wallets = [Wallet() for _ in range(args.nodes)]
+    signatures = [base64.b64encode(os.urandom(128)).decode() for _ in range(64)]
+    directory = tempfile.mkdtemp(prefix='memory-')
+    path = os.path.join(directory, 'chain.jsonl')
+    try:
+        previous_hash = "1"
+        with open(path, 'wb') as file:
+            for index in range(args.transactions // args.capacity):
+                transactions = []
+                for i in range(args.capacity):
+                    number = index * args.capacity + i
+                    sender, receiver = wallets[number % args.nodes], wallets[(number * 7 + 1) % args.nodes]
+                    transaction = Transaction(sender.public_key, receiver.public_key, "message", 0, f"message {number}", number).to_dict()
+                    # Signing 100k transactions would dominate the run, any valid-looking signature has the same size
+                    transaction['signature'] = signatures[number % len(signatures)]
+                    transactions.append(transaction)
+                block = Block(index, transactions, wallets[index % args.nodes].public_key, previous_hash, capacity=args.capacity)
+                previous_hash = block.current_hash
+                file.write(block.to_json() + b'\n')
+
+        context = multiprocessing.get_context('spawn')
+        results = {}
+        for name, compact in (('dicts', False), ('compact', True)):
+            result = context.Queue()
+            process = context.Process(target=load_chain_lines, args=(path, compact, result))
+            process.start()
+            results[name], results[name + ' served'] = result.get()
+            process.join()
+
+        print(f"{args.transactions} transactions in blocks of {args.capacity}, {args.nodes} addresses")
+        for name, size in results.items():
+            print(f"{name:<14} {size / 2 ** 20:>8.1f} MiB  {size / args.transactions:>6.0f} bytes/transaction")
+        print(f"reduction {1 - results['compact'] / results['dicts']:>6.0%}")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='BlockChat micro-benchmarks.')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    broadcast = subparsers.add_parser('broadcast', help='Serial requests.post loop against the pooled parallel transport')
+    broadcast.add_argument('--nodes', type=int, nargs='+', default=[5, 10, 20], help='Network sizes to broadcast to')
+    broadcast.add_argument('--rounds', type=int, default=50, help='Broadcasts per network size')
+    broadcast.add_argument('--delay', type=float, default=2, help='Simulated handling time per peer in milliseconds')
+    broadcast.set_defaults(run=bench_broadcast)
+
+    verify = subparsers.add_parser('verify', help='Signature verification throughput, inline against batched worker processes')
+    verify.add_argument('--transactions', type=int, default=2000, help='Number of signed transactions to verify')
+    verify.add_argument('--workers', type=int, default=multiprocessing.cpu_count(), help='Worker processes for the batched path')
+    verify.add_argument('--batch_size', type=int, default=256, help='Transactions per batch')
+    verify.set_defaults(run=bench_verify)
+
+    signing = subparsers.add_parser('signing', help='RSA CPU time per transaction, re-signing at every receiver against signing once')
+    signing.add_argument('--nodes', type=int, nargs='+', default=[5, 10], help='Network sizes')
+    signing.add_argument('--transactions', type=int, default=500, help='Transactions to sign and verify')
+    signing.set_defaults(run=bench_signing)
+
+    store = subparsers.add_parser('store', help='Restart time of a node with a persistent block store')
+    store.add_argument('--blocks', type=int, nargs='+', default=[10000, 100000], help='Chain lengths to store')
+    store.set_defaults(run=bench_store)
+
+    server = subparsers.add_parser('server', help='Request throughput of a node with the Flask server against the async server')
+    server.add_argument('--servers', nargs='+', choices=['flask', 'async'], default=['flask', 'async'], help='Server modes to compare')
+    server.add_argument('--concurrency', type=int, nargs='+', default=[8, 32], help='Concurrent clients')
+    server.add_argument('--duration', type=float, default=10, help='Seconds of load per run')
+    server.set_defaults(run=bench_server)
+
+    network = subparsers.add_parser('network', help='End to end: N local rest.py nodes replaying the trace folders for each block capacity')
+    network.add_argument('--nodes', type=int, nargs='+', default=[5, 10], help='Network sizes, each needs an {N}_nodes trace folder')
+    network.add_argument('--capacity', type=int, nargs='+', default=[5, 10, 20], help='Block capacities')
+    network.add_argument('--server', choices=['flask', 'async'], default='flask', help='Server mode of the nodes')
+    network.add_argument('--mode', choices=['open', 'closed'], default='open', help='Load generator loop')
+    network.add_argument('--rate', type=float, default=0, help='Open loop transactions per second per node (0 is unthrottled)')
+    network.add_argument('--concurrency', type=int, default=4, help='Open loop submit threads, or closed loop transactions awaiting commit, per node')
+    network.add_argument('--batch_size', type=int, default=10, help='Transactions per broadcast')
+    network.add_argument('--max_wait', type=float, default=DEFAULT_MAX_WAIT, help='Seconds before the nodes seal a block below capacity (0 waits for full blocks)')
+    network.add_argument('--adaptive_capacity', action='store_true', help='Let the nodes grow blocks with the backlog')
+    network.add_argument('--output', type=str, default='network_results', help='Directory for the per-run metrics and results.csv')
+    network.set_defaults(run=bench_network)
+
+    stress = subparsers.add_parser('stress', help='Concurrent submitters, minting and readers against one node, with consistency checks')
+    stress.add_argument('--submitters', type=int, default=32, help='Threads submitting transactions')
+    stress.add_argument('--readers', type=int, default=4, help='Threads reading the chain and balances')
+    stress.add_argument('--senders', type=int, default=8, help='Funded wallets sending transactions')
+    stress.add_argument('--per_sender', type=int, default=20, help='Transactions signed by each sender')
+    stress.add_argument('--capacity', type=int, default=5, help='Block capacity')
+    stress.set_defaults(run=bench_stress)
+
+    wire_format = subparsers.add_parser('wire', help='Bytes on the wire for the test folders, JSON against the binary format')
+    wire_format.add_argument('--folders', nargs='+', default=['5_nodes', '10_nodes'], help='Transaction test folders to replay')
+    wire_format.add_argument('--capacity', type=int, default=5, help='Block capacity')
+    wire_format.set_defaults(run=bench_wire)
+
+    snapshot = subparsers.add_parser('snapshot', help='Bootstrapping a new node from the whole chain against a snapshot')
+    snapshot.add_argument('--blocks', type=int, nargs='+', default=[1000, 10000, 100000], help='Chain lengths')
+    snapshot.add_argument('--tail', type=int, default=50, help='Blocks added after the snapshot was written')
+    snapshot.set_defaults(run=bench_snapshot)
+
+    merkle_proofs = subparsers.add_parser('merkle', help='Confirming one transaction from the whole block against a Merkle proof')
+    merkle_proofs.add_argument('--transactions', type=int, nargs='+', default=[5, 20, 100, 1000], help='Transactions per block')
+    merkle_proofs.add_argument('--rounds', type=int, default=200, help='Confirmations timed per block size')
+    merkle_proofs.set_defaults(run=bench_merkle)
+
+    validate = subparsers.add_parser('validate', help='Validating a received chain in full against resuming from the verified prefix')
+    validate.add_argument('--blocks', type=int, nargs='+', default=[1000, 10000, 100000], help='Chain lengths')
+    validate.add_argument('--tail', type=int, default=10, help='Blocks the received chain has beyond the local one')
+    validate.add_argument('--transactions', type=int, default=5, help='Transactions per block')
+    validate.set_defaults(run=bench_validate)
+
+    index = subparsers.add_parser('index', help='Transaction lookups by id and address history, chain scan against the index')
+    index.add_argument('--blocks', type=int, nargs='+', default=[1000, 10000, 100000], help='Chain lengths')
+    index.add_argument('--lookups', type=int, default=200, help='Random transaction ids looked up')
+    index.add_argument('--page', type=int, default=50, help='Page size of the history query')
+    index.set_defaults(run=bench_index)
+
+    memory = subparsers.add_parser('memory', help='Resident memory of a decoded chain, transaction dicts against compact transactions')
+    memory.add_argument('--transactions', type=int, default=100000, help='Transactions in the chain')
+    memory.add_argument('--capacity', type=int, default=5, help='Transactions per block')
+    memory.add_argument('--nodes', type=int, default=10, help='Distinct addresses')
+    memory.set_defaults(run=bench_memory)
+
+    forks = subparsers.add_parser('forks', help='Out of order block delivery, reject-or-append against the block tree, and a branch switch')
+    forks.add_argument('--blocks', type=int, default=1000, help='Blocks delivered')
+    forks.add_argument('--window', type=int, nargs='+', default=[1, 2, 4, 8], help='Positions a block may arrive early or late by')
+    forks.add_argument('--depth', type=int, default=5, help='Blocks of the main chain the competing branch replaces')
+    forks.add_argument('--transactions', type=int, default=5, help='Transactions per block')
+    forks.set_defaults(run=bench_forks)
+
+    profile = subparsers.add_parser('profiling', help='Overhead per call of the profiling timers, off and on')
+    profile.add_argument('--calls', type=int, default=1000000, help='Calls timed per variant')
+    profile.set_defaults(run=bench_profiling)
+
+    args = parser.parse_args()
+    args.run(args)
@@ -1,52 +1,147 @@
 import time
 import hashlib
 import json
+from collections import OrderedDict
+from threading import Lock
+
+from merkle import merkle_root, merkle_proof
+from transaction import CompactTransaction, intern_address
+
+
+# Bytes of JSON kept by the blocks encoded here, those encoded longest ago drop theirs first.
+# Blocks read from a block store keep the bytes they were decoded from, the store's cache bounds those
+JSON_CACHE_BYTES = 64 * 2 ** 20
+_json_cached = OrderedDict()  # id(block) -> block, the reference keeps the id from being reused
+_json_cached_lock = Lock()
+_json_cached_bytes = 0
+
+
+def _cache_json(block, encoded):
+    global _json_cached_bytes
+    with _json_cached_lock:
+        if id(block) in _json_cached:
+            return
+        block._json = encoded
+        _json_cached[id(block)] = block
+        _json_cached_bytes += len(encoded)
+        while _json_cached_bytes > JSON_CACHE_BYTES and len(_json_cached) > 1:
+            _, evicted = _json_cached.popitem(last=False)
+            _json_cached_bytes -= len(evicted._json)
+            evicted._json = None
+
 
 class Block:
-    def __init__(self, index, transactions, validator, previous_hash, capacity=5, timestamp=None, current_hash=None):
+    """
+    A block is sealed once its hash is set: its fields can no longer be
+    reassigned, so the Merkle root, the hash and the JSON bytes are computed
+    once and reused. The JSON bytes of the blocks encoded here are kept up
+    to JSON_CACHE_BYTES in all, so serving the chain again costs no
+    encoding while it fits. Transactions are held as CompactTransactions;
+    the dict form is built when it is asked for, not kept, so a chain in
+    memory holds each transaction once, compactly.
+
+    The hash covers a header holding the Merkle root of the transactions
+    instead of the transactions themselves, so a single transaction can be
+    shown to be in the block with a proof of O(log n) hashes.
+    """
+
+    __slots__ = ('index', 'timestamp', 'transactions', 'validator', 'previous_hash', 'capacity',
+                 'current_hash', '_merkle_root', '_calculated_hash', '_json', '_sealed')
+
+    def __init__(self, index, transactions, validator, previous_hash, capacity=5, timestamp=None, current_hash=None, merkle_root=None):
+        # merkle_root is accepted so the dict form round trips, it is always recomputed from the transactions
         self.index = index
-        self.start_time = time.time()  # Record when block creation starts
         self.timestamp = round(timestamp if timestamp is not None else time.time(), 4)
-        self.transactions = transactions[:capacity]  # Limit transactions to capacity
-        self.validator = validator
+        self.transactions = tuple(CompactTransaction.from_dict(tx) for tx in transactions[:capacity])  # Limit transactions to capacity
+        self.validator = intern_address(validator)
         self.previous_hash = previous_hash
         self.capacity = capacity
+        self._merkle_root = None
+        self._calculated_hash = None
+        self._json = None
         self.current_hash = current_hash if current_hash is not None else self.calculate_hash()
-        self.end_time = time.time()  # Record when block creation ends
-
-    def block_creation_time(self):
-        return self.end_time - self.start_time
-    
-    def serialize_for_hash(self):
-        # Serialize block data in a consistent order
-        block_data = {
+        self._sealed = True
+
+    def __setattr__(self, name, value):
+        if getattr(self, '_sealed', False) and not name.startswith('_'):
+            raise AttributeError(f"Block {self.index} is sealed, '{name}' cannot be changed")
+        object.__setattr__(self, name, value)
+
+    @classmethod
+    def from_json(cls, raw):
+        """
+        Rebuild a block from the bytes produced by to_json(), keeping them as its cached encoding.
+        """
+        block = cls(**json.loads(raw))
+        block._json = bytes(raw)
+        return block
+
+    def transaction_dicts(self):
+        return [tx.to_dict() for tx in self.transactions]
+
+    def merkle_root(self):
+        if self._merkle_root is None:
+            self._merkle_root = merkle_root(self.transaction_dicts())
+        return self._merkle_root
+
+    def merkle_proof(self, position):
+        """
+        Inclusion proof for the transaction at `position`, see merkle.merkle_proof.
+        """
+        return merkle_proof(self.transaction_dicts(), position)
+
+    def header(self):
+        """
+        The fields the hash covers, and the hash. Enough for a light client to
+        check a Merkle proof against the chain without the transactions.
+        """
+        return {
             'index': self.index,
-            'transactions': [tx.to_dict() if hasattr(tx, 'to_dict') else tx for tx in self.transactions],            
+            'merkle_root': self.merkle_root(),
             'validator': self.validator,
-            'previous_hash': self.previous_hash
+            'previous_hash': self.previous_hash,
+            'current_hash': self.current_hash,
+        }
+
+    @staticmethod
+    def hash_header(index, merkle_root, validator, previous_hash):
+        # Serialize the header in a consistent order
+        header = {
+            'index': index,
+            'merkle_root': merkle_root,
+            'validator': validator,
+            'previous_hash': previous_hash
         }
-        return json.dumps(block_data, sort_keys=True)
-    
+        return hashlib.sha256(json.dumps(header, sort_keys=True).encode()).hexdigest()
+
     def calculate_hash(self):
-        # Use serialized block data for hash calculation
-        block_string = self.serialize_for_hash()
-        return hashlib.sha256(block_string.encode()).hexdigest()
-    
-    def to_dict(self):
-         
-        transactions_dict_list = [tx.to_dict() if hasattr(tx, 'to_dict') else tx for tx in self.transactions]
+        if self._calculated_hash is None:
+            self._calculated_hash = self.hash_header(self.index, self.merkle_root(), self.validator, self.previous_hash)
+        return self._calculated_hash
 
+    def to_dict(self):
+        # A new dict on every call, callers may add or replace keys on it
         return {
             'index': self.index,
             'timestamp': self.timestamp,
-            'transactions': transactions_dict_list,
+            'transactions': self.transaction_dicts(),
             'validator': self.validator,
             'previous_hash': self.previous_hash,
+            'merkle_root': self.merkle_root(),
             'current_hash': self.current_hash,
             'capacity': self.capacity
         }
 
+    def to_json(self):
+        """
+        The dict form encoded as compact JSON bytes, ready to be spliced into a response.
+        """
+        encoded = self._json
+        if encoded is None:
+            encoded = json.dumps(self.to_dict(), separators=(',', ':')).encode()
+            _cache_json(self, encoded)
+        return encoded
+
 
     def __repr__(self):
         return f"Block(Index: {self.index}, Hash: {self.current_hash}, Prev Hash: {self.previous_hash}, Transactions: {len(self.transactions)})"
-
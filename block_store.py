@@ -0,0 +1,297 @@
+import json
+import mmap
+import os
+import struct
+from collections import OrderedDict
+from collections.abc import Sequence
+from threading import Lock
+
+from block import Block
+
+
+INDEX_MAGIC = b'BCIDX001'
+INDEX_HEADER = struct.Struct('>8sQ')  # magic, index of the first stored block
+OFFSET = struct.Struct('>Q')
+RECORD_LENGTH = struct.Struct('>I')
+
+DEFAULT_CACHE_SIZE = 1024
+# Blocks between account state checkpoints, at most this many are replayed on restart
+STATE_CHECKPOINT_INTERVAL = 100
+
+
+class BlockStore:
+    """
+    Append-only on-disk block storage.
+
+    `blocks.dat` is a segment of length-prefixed records, each holding one
+    block as JSON. `blocks.idx` starts with a small header and then maps
+    every block index to the offset of its record in the segment, as fixed
+    width integers. Opening the store only maps both files into memory, so
+    it costs the same for any chain length; blocks are decoded on access.
+
+    Appends are hash-chained: a block is only written if it follows the
+    stored tip. The record is written before its index entry, and a torn
+    tail left by a crash is dropped when the store is opened.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.segment_path = os.path.join(directory, 'blocks.dat')
+        self.index_path = os.path.join(directory, 'blocks.idx')
+        self.state_path = os.path.join(directory, 'state.json')
+        self.segment = open(self.segment_path, 'a+b')
+        self.index = open(self.index_path, 'a+b')
+        self.segment_map = None
+        self.index_map = None
+        self.base_index = 0
+        self.count = 0
+        self.segment_size = 0
+        self.tip_hash = None
+        self.open()
+
+    def open(self):
+        index_size = os.path.getsize(self.index_path)
+        if index_size < INDEX_HEADER.size:
+            self.index.truncate(0)
+            self.index.write(INDEX_HEADER.pack(INDEX_MAGIC, 0))
+            self.index.flush()
+            index_size = INDEX_HEADER.size
+
+        self.remap()
+        magic, self.base_index = INDEX_HEADER.unpack_from(self.index_map, 0)
+        if magic != INDEX_MAGIC:
+            raise Exception(f"{self.index_path} is not a block index")
+
+        self.count = (index_size - INDEX_HEADER.size) // OFFSET.size
+        self.segment_size = os.path.getsize(self.segment_path)
+
+        # Drop index entries whose record did not make it to disk
+        while self.count and self.record_end(self.count - 1) > self.segment_size:
+            self.count -= 1
+        end = self.record_end(self.count - 1) if self.count else 0
+        if end != self.segment_size or index_size != INDEX_HEADER.size + self.count * OFFSET.size:
+            self.truncate_files(end)
+
+        self.tip_hash = self.read(self.count - 1).current_hash if self.count else None
+
+    def close_maps(self):
+        for mapped in (self.segment_map, self.index_map):
+            if mapped is not None:
+                mapped.close()
+        self.segment_map = self.index_map = None
+
+    def remap(self):
+        self.close_maps()
+        self.index_map = mmap.mmap(self.index.fileno(), 0, access=mmap.ACCESS_READ)
+        if os.path.getsize(self.segment_path):
+            self.segment_map = mmap.mmap(self.segment.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.segment_map = None
+        self.mapped_count = (len(self.index_map) - INDEX_HEADER.size) // OFFSET.size
+
+    def truncate_files(self, segment_end):
+        self.close_maps()
+        self.segment.truncate(segment_end)
+        self.index.truncate(INDEX_HEADER.size + self.count * OFFSET.size)
+        self.segment_size = segment_end
+        self.remap()
+
+    def offset(self, position):
+        if position >= self.mapped_count:
+            self.remap()
+        return OFFSET.unpack_from(self.index_map, INDEX_HEADER.size + position * OFFSET.size)[0]
+
+    def record_end(self, position):
+        offset = self.offset(position)
+        if offset + RECORD_LENGTH.size > self.segment_size:
+            return self.segment_size + 1
+        if self.segment_map is None or offset + RECORD_LENGTH.size > len(self.segment_map):
+            self.remap()
+        (length,) = RECORD_LENGTH.unpack_from(self.segment_map, offset)
+        return offset + RECORD_LENGTH.size + length
+
+    def read(self, position):
+        """
+        Decode the block stored at `position` (counted from the first stored block).
+        """
+        offset = self.offset(position)
+        if self.segment_map is None or offset + RECORD_LENGTH.size > len(self.segment_map):
+            self.remap()
+        (length,) = RECORD_LENGTH.unpack_from(self.segment_map, offset)
+        start = offset + RECORD_LENGTH.size
+        if start + length > len(self.segment_map):
+            self.remap()
+        return Block.from_json(self.segment_map[start:start + length])
+
+    def append(self, block):
+        if block.index != self.base_index + self.count:
+            raise Exception(f"Block {block.index} does not follow the stored chain of {self.count} blocks")
+        if self.tip_hash is not None and block.previous_hash != self.tip_hash:
+            raise Exception("The new block's previous hash must match the stored tip hash")
+
+        record = block.to_json()
+        offset = self.segment_size
+        self.segment.write(RECORD_LENGTH.pack(len(record)) + record)
+        self.segment.flush()
+        self.index.write(OFFSET.pack(offset))
+        self.index.flush()
+
+        self.segment_size += RECORD_LENGTH.size + len(record)
+        self.count += 1
+        self.tip_hash = block.current_hash
+
+    def truncate(self, count):
+        """
+        Drop the stored blocks from position `count` onwards, as a branch switch does.
+        """
+        if count >= self.count:
+            return
+        segment_end = self.offset(count)
+        self.count = count
+        self.truncate_files(segment_end)
+        self.tip_hash = self.read(count - 1).current_hash if count else None
+
+    def reset(self, base_index=0):
+        """
+        Empty the store, e.g. before writing a replacement chain.
+        """
+        self.close_maps()
+        self.segment.truncate(0)
+        self.index.truncate(0)
+        self.index.write(INDEX_HEADER.pack(INDEX_MAGIC, base_index))
+        self.index.flush()
+        self.base_index = base_index
+        self.count = 0
+        self.segment_size = 0
+        self.tip_hash = None
+        self.remap()
+
+    def save_state(self, state):
+        """
+        Checkpoint the confirmed account state at the current tip, so a
+        restart does not have to replay the chain to rebuild it.
+        """
+        checkpoint = {
+            'height': self.base_index + self.count,
+            'tip_hash': self.tip_hash,
+            'accounts': state.confirmed_to_dict(),
+        }
+        temporary_path = self.state_path + '.tmp'
+        with open(temporary_path, 'w') as file:
+            json.dump(checkpoint, file)
+        os.replace(temporary_path, self.state_path)
+
+    def load_state(self):
+        """
+        The last state checkpoint, or None if there is none.
+        """
+        try:
+            with open(self.state_path) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def close(self):
+        self.close_maps()
+        self.segment.close()
+        self.index.close()
+
+
+class StoredChain(Sequence):
+    """
+    List-like view of the blocks in a BlockStore, decoding blocks lazily and
+    keeping the most recently used ones in memory.
+
+    Readers share the cache and the store's memory maps, which are remapped
+    as the files grow, so each lookup holds `lock`.
+    """
+
+    def __init__(self, store, cache_size=DEFAULT_CACHE_SIZE):
+        self.store = store
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = Lock()
+
+    @property
+    def base_index(self):
+        return self.store.base_index
+
+    def __len__(self):
+        return self.store.base_index + self.store.count
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self[i] for i in range(*key.indices(len(self)))]
+        if key < 0:
+            key += len(self)
+        if key < self.store.base_index or key >= len(self):
+            raise IndexError('block index out of range')
+
+        with self.lock:
+            block = self.cache.get(key)
+            if block is None:
+                block = self.store.read(key - self.store.base_index)
+                self.remember(key, block)
+            else:
+                self.cache.move_to_end(key)
+            return block
+
+    def remember(self, key, block):
+        self.cache[key] = block
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def __iter__(self):
+        for i in range(self.store.base_index, len(self)):
+            yield self[i]
+
+    def append(self, block):
+        with self.lock:
+            self.store.append(block)
+            self.remember(block.index, block)
+
+    def truncate(self, length):
+        """
+        Cut the chain back to its first `length` blocks.
+        """
+        with self.lock:
+            self.store.truncate(length - self.store.base_index)
+            for key in [key for key in self.cache if key >= length]:
+                del self.cache[key]
+
+    def __repr__(self):
+        return f"StoredChain({len(self)} blocks in {self.store.directory})"
+
+
+class PrunedChain(Sequence):
+    """
+    In-memory chain that starts at `base_index` instead of the genesis
+    block, for a node bootstrapped from a snapshot. Indexes and length are
+    those of the whole chain, the blocks before `base_index` are not held.
+    """
+
+    def __init__(self, blocks):
+        self.base_index = blocks[0].index
+        self.blocks = list(blocks)
+
+    def __len__(self):
+        return self.base_index + len(self.blocks)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self[i] for i in range(*key.indices(len(self)))]
+        if key < 0:
+            key += len(self)
+        if key < self.base_index or key >= len(self):
+            raise IndexError('block index out of range')
+        return self.blocks[key - self.base_index]
+
+    def __iter__(self):
+        return iter(self.blocks)
+
+    def append(self, block):
+        self.blocks.append(block)
+
+    def __repr__(self):
+        return f"PrunedChain({len(self.blocks)} blocks from {self.base_index})"
@@ -0,0 +1,87 @@
+from collections import OrderedDict
+
+
+# Orphans kept while waiting for their parent, the oldest are dropped first
+MAX_ORPHANS = 256
+# Side branch blocks this far below the tip are dropped, they can no longer win
+MAX_FORK_DEPTH = 100
+
+
+class BlockTree:
+    """
+    Received blocks that are not on the main chain.
+
+    `side` holds blocks of side branches, whose parent is on the main chain
+    or in another side branch; `orphans` holds blocks whose parent has not
+    arrived yet, so blocks delivered out of order are connected once the
+    gap is filled instead of being lost. Both are keyed by block hash.
+
+    Not thread safe: the Node serializes the blocks it receives.
+    """
+
+    def __init__(self, max_orphans=MAX_ORPHANS, max_depth=MAX_FORK_DEPTH):
+        self.max_orphans = max_orphans
+        self.max_depth = max_depth
+        self.side = {}
+        self.orphans = OrderedDict()
+        self.orphans_by_parent = {}  # previous_hash -> hashes of the orphans waiting for it
+
+    def __contains__(self, block_hash):
+        return block_hash in self.side or block_hash in self.orphans
+
+    def add_side(self, block):
+        self.side[block.current_hash] = block
+
+    def add_orphan(self, block):
+        if block.current_hash in self.orphans:
+            return
+        self.orphans[block.current_hash] = block
+        self.orphans_by_parent.setdefault(block.previous_hash, []).append(block.current_hash)
+        while len(self.orphans) > self.max_orphans:
+            _, oldest = self.orphans.popitem(last=False)
+            self._unlink_orphan(oldest)
+
+    def _unlink_orphan(self, block):
+        waiting = self.orphans_by_parent.get(block.previous_hash, [])
+        if block.current_hash in waiting:
+            waiting.remove(block.current_hash)
+        if not waiting:
+            self.orphans_by_parent.pop(block.previous_hash, None)
+
+    def take_children(self, parent_hash):
+        """
+        Remove and return the orphans waiting for the block `parent_hash`.
+        """
+        return [self.orphans.pop(block_hash) for block_hash in self.orphans_by_parent.pop(parent_hash, []) if block_hash in self.orphans]
+
+    def branch(self, tip_hash):
+        """
+        The side blocks from the one after the fork point up to `tip_hash`, oldest first.
+        """
+        branch = []
+        block = self.side.get(tip_hash)
+        while block is not None:
+            branch.append(block)
+            block = self.side.get(block.previous_hash)
+        branch.reverse()
+        return branch
+
+    def best_tip(self):
+        """
+        The highest side block, the tip of the longest side branch, or None.
+        """
+        return max(self.side.values(), key=lambda block: block.index, default=None)
+
+    def remove(self, blocks):
+        for block in blocks:
+            self.side.pop(block.current_hash, None)
+
+    def prune(self, height):
+        """
+        Drop side blocks and orphans too far below a main chain of `height` blocks.
+        """
+        floor = height - self.max_depth
+        for block_hash in [block_hash for block_hash, block in self.side.items() if block.index < floor]:
+            del self.side[block_hash]
+        for block_hash in [block_hash for block_hash, block in self.orphans.items() if block.index < floor]:
+            self._unlink_orphan(self.orphans.pop(block_hash))
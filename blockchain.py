@@ -1,34 +1,355 @@
-import random
+from threading import Lock, RLock
 
-from flask.json import jsonify
 from block import Block
+from block_tree import BlockTree, MAX_FORK_DEPTH
+from account_state import AccountState
+from block_store import StoredChain, PrunedChain, STATE_CHECKPOINT_INTERVAL
+from mempool import Mempool, DEFAULT_MAX_SIZE
+from profiling import timed
+from rwlock import ReadWriteLock
+from sealing import SealingPolicy
+from snapshot import SnapshotWriter
+from transaction_index import TransactionIndex
+
+
+# Blocks between the verified heights kept for resuming chain validation
+VERIFIED_CHECKPOINT_INTERVAL = 1000
 
-import time
-import hashlib
 
 class Blockchain:
-    def __init__(self, block_capacity=5):
-        self.chain = []
-        self.transaction_pool = []
+    """
+    The chain, the transaction pool and the account state derived from both.
+
+    `lock` is a reader/writer lock for the chain: blocks are appended and
+    chains replaced under its write side, readers that need a consistent
+    view take its read side. `pool_lock` guards the transaction pool and the
+    pending account state. When both are needed, `lock` is taken first.
+    Neither is held while talking to peers, so minting and broadcasting a
+    block never blocks readers of the chain.
+
+    Every block of the local chain has been verified. `checkpoints` maps
+    heights, every VERIFIED_CHECKPOINT_INTERVAL blocks, to the hash of the
+    block at that height, and the tip is always a checkpoint too. A received
+    chain that holds the same hash at a checkpoint shares the verified
+    prefix up to it. Only its headers are checked below that height, and the
+    local blocks are kept for it instead of the received ones.
+
+    Blocks received one at a time go through `receive_block`, serialized by
+    `receive_lock`. Those that do not extend the tip are kept in
+    `block_tree`, as side branches or as orphans waiting for their parent.
+    """
+
+    def __init__(self, block_capacity=5, store=None, mempool_size=DEFAULT_MAX_SIZE, sealing=None):
+        self.lock = ReadWriteLock()
+        self.pool_lock = RLock()
+        # With a BlockStore the chain is persisted and read back lazily
+        self.store = store
+        self.chain = StoredChain(store) if store is not None else []
+        self.mempool_size = mempool_size
+        self.transaction_pool = Mempool(max_size=mempool_size)
         self.stakes = {} 
         self.block_capacity = block_capacity
+        # When blocks are sealed and how large they are, by default exactly block_capacity transactions
+        self.sealing = sealing or SealingPolicy(block_capacity)
+        # Blocks a branch switch abandons are rolled back, down to the deepest fork the block tree keeps
+        self.state = AccountState(undo_depth=MAX_FORK_DEPTH)
+        # SnapshotWriter checkpointing the chain for new nodes, if enabled
+        self.snapshots = None
+        self.checkpoints = {}
+        self.transaction_index = TransactionIndex()
+        # Called with every block that joins the main chain, under the write lock
+        self.block_listeners = []
+        self.receive_lock = Lock()
+        self.block_tree = BlockTree()
+        if store is not None and len(self.chain):
+            # The stored blocks are indexed on the first lookup
+            self.transaction_index.reset(self.base_index())
+            self.load_state()
+            # Blocks in the store were verified before they were written
+            self.checkpoints = self.checkpoints_of(self.chain)
+
+    def load_state(self):
+        """
+        Restore the account state of a stored chain from its last checkpoint,
+        replaying only the blocks added after it.
+        """
+        checkpoint = self.store.load_state()
+        height = checkpoint['height'] if checkpoint else 0
+        if not checkpoint or height > len(self.chain) or height < self.base_index() or (height and self.chain[height - 1].current_hash != checkpoint['tip_hash']):
+            if self.base_index():
+                raise Exception(f"The stored chain starts at block {self.base_index()} and has no usable state checkpoint")
+            print("No usable state checkpoint, replaying the stored chain")
+            self.state.rebuild(self.chain, self.transaction_pool)
+            return
+
+        self.state.load_confirmed(checkpoint['accounts'], self.transaction_pool)
+        for index in range(height, len(self.chain)):
+            self.state.apply_block(self.chain[index])
+        print(f"Loaded {len(self.chain)} stored blocks, account state checkpointed at height {height}")
     
+    def enable_snapshots(self, directory, interval):
+        """
+        Write a snapshot for new nodes every `interval` blocks.
+        """
+        self.snapshots = SnapshotWriter(self, directory, interval)
+
+    def base_index(self):
+        """
+        Index of the first block held, 0 unless the chain was bootstrapped from a snapshot.
+        """
+        return getattr(self.chain, 'base_index', 0)
+
+    def tip(self):
+        """
+        The last block of the chain, or None if it is empty.
+        """
+        with self.lock.read():
+            return self.chain[-1] if len(self.chain) else None
+
+    def holds_block(self, index, block_hash):
+        """
+        Whether the main chain holds the block `block_hash` at `index`.
+        """
+        with self.lock.read():
+            return self._holds_block(index, block_hash)
+
+    def _holds_block(self, index, block_hash):
+        return self.base_index() <= index < len(self.chain) and self.chain[index].current_hash == block_hash
+
+    def blocks(self, start=0):
+        """
+        A list of the blocks from index `start` onwards, copied under the read lock.
+        Starts at the first block held if the chain was bootstrapped from a snapshot.
+        """
+        with self.lock.read():
+            return list(self.chain[max(start, self.base_index()):])
+
+    def find_transaction(self, transaction_id):
+        """
+        (block, position) of a committed transaction, or None if no block held here contains it.
+        """
+        with self.lock.read():
+            self.transaction_index.catch_up(self.chain, self.base_index())
+            location = self.transaction_index.locate(transaction_id)
+            if location is None:
+                return None
+            index, position = location
+            return self.chain[index], position
+
+    def address_history(self, address, offset, limit):
+        """
+        (total, [(block, position)]) for a page of the committed transactions
+        sent or received by `address`, newest first.
+        """
+        with self.lock.read():
+            self.transaction_index.catch_up(self.chain, self.base_index())
+            total, locations = self.transaction_index.history(address, offset, limit)
+            return total, [(self.chain[index], position) for index, position in locations]
+
+    def knows_transaction(self, transaction_id):
+        """
+        Whether a transaction is in the pool or in a block of the chain.
+        """
+        return self.pending_transaction(transaction_id) is not None or self.find_transaction(transaction_id) is not None
+
+    def pending_transaction(self, transaction_id):
+        with self.pool_lock:
+            return self.transaction_pool.get(transaction_id)
+
+    def pending_transactions(self):
+        with self.pool_lock:
+            return self.transaction_pool.to_list()
+
     def add_transaction_to_pool(self, transaction):
-        self.transaction_pool.append(transaction)
-        print('Transaction added to pool')
-        return
+        with self.pool_lock:
+            admitted, evicted = self.transaction_pool.add(transaction)
+            if evicted:
+                # The pending state was folded over the evicted transactions too
+                self.state.reset_pending(self.transaction_pool)
+            elif admitted:
+                self.state.apply_pending(transaction)
+
+        if admitted:
+            print('Transaction added to pool')
+        else:
+            print('Transaction already in pool or evicted')
+        return admitted
+
+    def set_transaction_pool(self, transaction_pool):
+        """
+        Replace the transaction pool with a list of transaction dicts and
+        recompute the pending account state.
+        """
+        with self.pool_lock:
+            self.transaction_pool = Mempool(transaction_pool, max_size=self.mempool_size)
+            self.state.reset_pending(self.transaction_pool)
+
+    def batch_to_seal(self, allow_partial=True):
+        """
+        (size, wait): the number of pooled transactions the sealing policy
+        would put in a block now, 0 if none, and the seconds until a partial
+        block is due, None if no partial block will be.
+        """
+        with self.pool_lock:
+            pending = len(self.transaction_pool)
+            oldest_arrival = self.transaction_pool.oldest_arrival()
+        size = self.sealing.seal(pending, oldest_arrival, allow_partial)
+        wait = self.sealing.wait_left(oldest_arrival) if allow_partial and not size else None
+        return size, wait
+
+    def next_transactions(self, count):
+        """
+        The next `count` transactions of the pool for a new block.
+
+        They stay in the pool, and keep counting towards pending balances,
+        until the block holding them is added. Taking them out earlier would
+        let a sender spend the same funds again while the block is in flight.
+        """
+        with self.pool_lock:
+            return self.transaction_pool.peek(count)
+
+    def checkpoints_of(self, chain):
+        """
+        The verified checkpoints of a chain held locally.
+        """
+        first = self.base_index() + 1 if chain is self.chain else 1
+        start = max(VERIFIED_CHECKPOINT_INTERVAL, -(-first // VERIFIED_CHECKPOINT_INTERVAL) * VERIFIED_CHECKPOINT_INTERVAL)
+        return {height: chain[height - 1].current_hash for height in range(start, len(chain) + 1, VERIFIED_CHECKPOINT_INTERVAL)}
+
+    def verified_prefix(self, chain):
+        """
+        Length of the verified local prefix `chain` shares, taken from the
+        highest checkpoint whose hash it holds. Call with `lock` held.
+        """
+        if not len(chain) or not len(self.chain):
+            return 0
+        offset = chain[0].index
+        checkpoints = dict(self.checkpoints)
+        checkpoints[len(self.chain)] = self.chain[-1].current_hash
+        for height in sorted(checkpoints, reverse=True):
+            position = height - 1 - offset
+            if 0 <= position < len(chain) and chain[position].current_hash == checkpoints[height]:
+                return height
+        return 0
+
+    def replace_chain(self, chain):
+        """
+        Install an already validated chain and rebuild the account state from it.
+        """
+        with self.lock.write():
+            self._replace_chain(chain)
+
+    def _replace_chain(self, chain):
+        if self.store is not None:
+            self.store.reset()
+            for block in chain:
+                self.store.append(block)
+            self.chain = StoredChain(self.store)
+        else:
+            self.chain = chain
+        # Indexed again on the next lookup
+        self.transaction_index.reset()
+        with self.pool_lock:
+            self.state.rebuild(self.chain, self.transaction_pool)
+        if self.store is not None:
+            self.store.save_state(self.state)
+        self.checkpoints = self.checkpoints_of(chain)
+
+    def _truncate_chain(self, height, dropped):
+        """
+        Cut the chain back to `height` blocks, undoing what the `dropped`
+        blocks after it did to the account state and the transaction index,
+        instead of rebuilding them from the genesis block.
+        """
+        with self.pool_lock:
+            rolled_back = self.state.rollback(height)
+        if self.store is not None:
+            self.chain.truncate(height)
+        else:
+            del self.chain[height:]
+        self.transaction_index.remove_blocks(dropped)
+        self.checkpoints = {checkpoint: block_hash for checkpoint, block_hash in self.checkpoints.items() if checkpoint <= height}
+        with self.pool_lock:
+            if not rolled_back:
+                # Deeper than the undo log reaches, as after a restart
+                self.state.rebuild(self.chain, self.transaction_pool)
+            else:
+                self.state.reset_pending(self.transaction_pool)
+
+    def install_snapshot(self, tip, accounts):
+        """
+        Start the chain at a snapshot's verified tip block, with the confirmed
+        account state the snapshot holds for it. Blocks after the tip are
+        appended as usual.
+        """
+        with self.lock.write():
+            if self.store is not None:
+                self.store.reset(base_index=tip.index)
+                self.store.append(tip)
+                self.chain = StoredChain(self.store)
+            else:
+                self.chain = PrunedChain([tip])
+            self.transaction_index.reset(tip.index)
+            with self.pool_lock:
+                self.state.load_confirmed(accounts, self.transaction_pool)
+            if self.store is not None:
+                self.store.save_state(self.state)
+            self.checkpoints = {}
+        print(f"Blockchain initialized from a snapshot at height {len(self.chain)}.")
+
+    def adopt_chain(self, chain):
+        """
+        Replace the current chain with `chain` if it is valid and longer.
+
+        The candidate is validated on its own, the current chain stays in
+        place for readers until it is replaced. Returns True if it was.
+        """
+        if not self.validate_chain(chain):
+            print("Received chain is invalid.")
+            return False
+        return self.replace_if_longer(chain)
+
+    def replace_if_longer(self, chain):
+        """
+        Install an already validated chain if it is longer than the current one.
+
+        A chain that extends the local tip only has its new blocks appended.
+        Otherwise the verified prefix it shares keeps the local blocks and
+        the rest replaces the chain. The blocks after the prefix are checked
+        again, since the chain may have changed since `chain` was validated;
+        their hashes are cached, so this costs little.
+        """
+        with self.lock.write():
+            if len(chain) <= len(self.chain):
+                print("Received chain is not longer than the current chain.")
+                return False
+            shared = self.verified_prefix(chain)
+            if shared and self.base_index() and shared != len(self.chain):
+                # The pruned chain cannot be cut back, the received chain has to stand on its own
+                shared = 0
+            if not self.check_chain(chain, shared):
+                print("Received chain is invalid.")
+                return False
+            if shared == len(self.chain):
+                for block in chain[shared - chain[0].index:]:
+                    self._add_block(block)
+            else:
+                self._replace_chain(list(self.chain[:shared]) + list(chain[shared:]))
+        print(f"Blockchain updated with a longer chain of length {len(chain)}.")
+        return True
     
     def mint_bootstrap_block(self, validator):
-        # Only create a new block if there are transactions in the pool
-        if len(self.transaction_pool) == self.block_capacity:
-            previous_block = self.chain[-1]
-            new_block = Block(index=len(self.chain), transactions=self.transaction_pool, validator=validator, previous_hash=previous_block.current_hash)
-            new_block.current_hash = new_block.calculate_hash()
-            self.add_block(new_block)
-            self.transaction_pool = []
-            print("Block added to the chain")
-        else:
-            print("Transaction pool not full")
+        with self.lock.write():
+            # Only full blocks while the network forms, the nodes registering later get them in the chain they are sent
+            size, _ = self.batch_to_seal(allow_partial=False)
+            if size:
+                previous_block = self.chain[-1]
+                transactions = self.next_transactions(size)
+                new_block = Block(index=len(self.chain), transactions=transactions, validator=validator, previous_hash=previous_block.current_hash, capacity=size)
+                self._add_block(new_block)
+                print("Block added to the chain")
+            else:
+                print("Transaction pool not full")
 
 
 
@@ -38,6 +359,10 @@ class Blockchain:
         
         :param block: The block to be added.
         """
+        with self.lock.write():
+            return self._add_block(block)
+
+    def _add_block(self, block):
         # If it's the first block and the chain is empty, it's considered the Genesis block
         if not self.chain:
             if block.index != 0:
@@ -48,23 +373,190 @@ class Blockchain:
                 raise Exception("The new block's previous hash must match the last block's hash")
 
         self.chain.append(block)
-        print("New block added, current blockchain state:", self.chain)
+        self.transaction_index.add_block(block)
+        with self.pool_lock:
+            self.state.apply_block(block)
+            # Committed transactions leave the pool, wherever they were minted
+            self.transaction_pool.remove(transaction['transaction_id'] for transaction in block.transactions)
+            self.state.reset_pending(self.transaction_pool)
+        if self.store is not None and len(self.chain) % STATE_CHECKPOINT_INTERVAL == 0:
+            self.store.save_state(self.state)
+        if self.snapshots is not None:
+            self.snapshots.block_added(len(self.chain))
+        if len(self.chain) % VERIFIED_CHECKPOINT_INTERVAL == 0:
+            self.checkpoints[len(self.chain)] = block.current_hash
+        for listener in self.block_listeners:
+            listener(block)
+        print(f"New block added, chain length {len(self.chain)}:", block)
         return "New block added", 200
         
-    def validate_chain(self):
+    def append_blocks(self, blocks):
+        """
+        Validate a run of blocks that extends the current tip and append them.
+
+        Only the new blocks are checked: each one must follow the previous one
+        and its hash must match its contents. Nothing is appended if any block
+        is invalid.
+        """
+        with self.lock.write():
+            previous_hash = self.chain[-1].current_hash if len(self.chain) else None
+            index = len(self.chain)
+            for block in blocks:
+                if block.index != index or (previous_hash is not None and block.previous_hash != previous_hash):
+                    print("Received block does not extend the chain at Block", block.index)
+                    return False
+                if block.calculate_hash() != block.current_hash:
+                    print("Block hash calculation mismatch at Block", block.index)
+                    return False
+                previous_hash = block.current_hash
+                index += 1
+
+            for block in blocks:
+                self._add_block(block)
+            return True
+
+    def receive_block(self, block, validate):
+        """
+        Place a block received from a peer wherever it fits.
+
+        A block that extends the tip is appended. One whose parent is on the
+        main chain or in a side branch joins the block tree, and its branch
+        becomes the main chain once it is the longer one. One whose parent is
+        unknown waits as an orphan, and is connected when the parent arrives.
+        `validate` checks the validator of a block, returning (is_valid, message).
+
+        Returns (status, message), status being 'added' when the main chain
+        changed, or one of 'side', 'orphan', 'known' and 'invalid'.
+        """
+        with self.receive_lock:
+            if self.holds_block(block.index, block.current_hash) or block.current_hash in self.block_tree:
+                return 'known', f"Block {block.index} already received"
+            is_valid, message = validate(block)
+            if not is_valid:
+                return 'invalid', message
+            if block.previous_hash not in self.block_tree.side and not self.holds_block(block.index - 1, block.previous_hash):
+                self.block_tree.add_orphan(block)
+                print(f"Block {block.index} buffered until its parent arrives")
+                return 'orphan', f"Block {block.index} buffered until its parent arrives"
+
+            added = self._connect(block, validate)
+            if self._choose_fork():
+                added = True
+            self.block_tree.prune(len(self.chain))
+        if added:
+            return 'added', f"Block {block.index} added"
+        return 'side', f"Block {block.index} added to a side branch"
+
+    def _connect(self, block, validate):
+        """
+        Add a block whose parent is known, then the orphans waiting for it.
+        Returns True if any of them extended the main chain.
+        """
+        extended = False
+        connected = [block]
+        while connected:
+            block = connected.pop()
+            if self._extend(block):
+                extended = True
+            else:
+                self.block_tree.add_side(block)
+            for child in self.block_tree.take_children(block.current_hash):
+                # Checked again, the stakes may have changed while it waited
+                if validate(child)[0]:
+                    connected.append(child)
+        return extended
+
+    def _extend(self, block):
+        with self.lock.write():
+            if not len(self.chain) or block.index != len(self.chain) or block.previous_hash != self.chain[-1].current_hash:
+                return False
+            self._add_block(block)
+            return True
+
+    def _choose_fork(self):
+        """
+        Switch to the longest side branch if it is longer than the main chain.
+        """
+        best = self.block_tree.best_tip()
+        if best is None or best.index < len(self.chain):
+            return False
+        branch = self.block_tree.branch(best.current_hash)
+        dropped = self.switch_to_branch(branch)
+        if dropped is None:
+            return False
+        self.block_tree.remove(branch)
+        for block in dropped:
+            self.block_tree.add_side(block)
+        return True
+
+    def switch_to_branch(self, branch):
+        """
+        Make a side branch the main chain if it is longer than the current one.
+
+        `branch` holds the blocks from the one after the fork point up to the
+        branch tip. The main chain blocks it replaces are returned, or None
+        if the branch was not adopted; their transactions the branch does not
+        hold go back to the pool.
+        """
+        with self.lock.write():
+            fork = branch[0].index
+            if fork + len(branch) <= len(self.chain) or not self._holds_block(fork - 1, branch[0].previous_hash):
+                return None
+            if self.base_index():
+                # The account state of a pruned chain cannot be rolled back
+                print(f"Cannot switch to a branch forking at block {fork} from a chain bootstrapped from a snapshot.")
+                return None
+            if not self.check_chain([self.chain[fork - 1]] + branch, fork):
+                return None
+            dropped = list(self.chain[fork:])
+            committed = {transaction['transaction_id'] for block in branch for transaction in block.transactions}
+            with self.pool_lock:
+                self.transaction_pool.remove(committed)
+                for block in dropped:
+                    for transaction in block.transactions:
+                        if transaction['transaction_id'] not in committed:
+                            self.transaction_pool.add(transaction)
+            self._truncate_chain(fork, dropped)
+            for block in branch:
+                self._add_block(block)
+            if self.store is not None:
+                # The last state checkpoint may be on the abandoned blocks
+                self.store.save_state(self.state)
+        print(f"Switched to a branch forking at block {fork}, chain length {len(self.chain)}.")
+        return dropped
+
+    @timed
+    def validate_chain(self, chain=None, full=False):
+        """
+        Validate a chain to ensure integrity, the current one by default.
+
+        Validation resumes from the verified prefix the chain shares with the
+        local one: below it only the headers are checked, that each block
+        follows the previous one. With full=True every block is rehashed.
+        """
+        if chain is None:
+            chain = self.blocks()
+        if full:
+            verified = 0
+        else:
+            with self.lock.read():
+                verified = self.verified_prefix(chain)
+        return self.check_chain(chain, verified)
+
+    def check_chain(self, chain, verified):
         """
-        Validate the current blockchain to ensure integrity.
+        Check that every block follows the previous one, and that the blocks
+        from height `verified` onwards hash to their hash.
         """
-        for i in range(1, len(self.chain)):
-            current_block = self.chain[i]
-            previous_block = self.chain[i-1]
+        for i in range(1, len(chain)):
+            current_block = chain[i]
+            previous_block = chain[i-1]
 
-            if current_block.previous_hash != previous_block.current_hash:
+            if current_block.previous_hash != previous_block.current_hash or current_block.index != previous_block.index + 1:
                 print("Blockchain integrity compromised at Block", current_block.index)
                 return False
             
-            recalculated_hash = hashlib.sha256(current_block.serialize_for_hash().encode()).hexdigest()
-            if recalculated_hash != current_block.current_hash:
+            if current_block.index >= verified and current_block.calculate_hash() != current_block.current_hash:
                 print("Block hash calculation mismatch at Block", current_block.index)
                 return False
 
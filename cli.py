@@ -1,5 +1,7 @@
 import os
 
+import profiling
+
 
 def run_cli(node_instance, shutdown_event):
     print("\nWelcome! Use help to see the available commands.")
@@ -82,6 +84,25 @@ def run_cli(node_instance, shutdown_event):
             else:
                 print("Invalid command format. Expected: 'stake <amount>'")
 
+        elif action.startswith('profile'):
+            parts = action.split()
+            if len(parts) == 2 and parts[1] in ('on', 'off'):
+                profiling.timers.enabled = parts[1] == 'on'
+                print(f"Function timers turned {parts[1]}.")
+            elif len(parts) >= 2 and parts[1] == 'sample':
+                try:
+                    seconds = float(parts[2]) if len(parts) > 2 else profiling.DEFAULT_SAMPLE_SECONDS
+                except ValueError:
+                    print("Invalid duration. Expected: 'profile sample <seconds>'")
+                    continue
+                print(profiling.sample_threads(seconds))
+            elif len(parts) == 1:
+                print(f"Function timers are {'on' if profiling.timers.enabled else 'off'}.")
+                for name, stats in profiling.timers.snapshot().items():
+                    print(f"{name:<40} {stats['calls']:>8} calls {stats['total_seconds']:>10.3f} s total {stats['mean_seconds'] * 1000:>9.3f} ms mean {stats['max_seconds'] * 1000:>9.3f} ms max")
+            else:
+                print("Invalid command format. Expected: 'profile', 'profile on', 'profile off' or 'profile sample <seconds>'")
+
         elif action == 'exit':
             print('Exiting...')
             break  # Break out of the loop to exit the CLI
@@ -102,7 +123,9 @@ Available commands:\n
 \t--Stake a certain amount in the blockchain network.\n
 5. start_test <transactions_folder>\n
 \t--Start transaction test: process transactions from the specified folder (e.g., '5_nodes').\n
-6. help\n
+6. profile [on | off | sample <seconds>]\n
+\t--Show the hot-path function timers, turn them on or off, or sample where every thread of the node spends its time.\n
+7. help\n
 '''
             print(help_str)
 
@@ -0,0 +1,235 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition
+
+from transaction import Transaction
+
+
+DEFAULT_BATCH_SIZE = 10
+DEFAULT_CONCURRENCY = 4
+# Seconds without a commit after which the transactions still waiting are given up on
+DEFAULT_COMMIT_TIMEOUT = 10
+
+MODES = ('open', 'closed')
+
+
+def read_transaction_file(filepath):
+    """
+    (recipient node id, message) for every line of a trans{id}.txt file.
+    """
+    entries = []
+    with open(filepath, 'r') as file:
+        for line in file:
+            parts = line.strip().split(' ', 1)
+            if len(parts) != 2:
+                print("Invalid transaction format in file:", line)
+                continue
+            node_id_part, message = parts
+            recipient_id = ''.join(filter(str.isdigit, node_id_part))
+            if not recipient_id:
+                print(f"Could not extract recipient ID from: {node_id_part}")
+                continue
+            entries.append((recipient_id, message))
+    return entries
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+class LoadGenerator:
+    """
+    Submits message transactions from a node's wallet and records how long
+    each one takes from submission until a block holding it is added to the
+    node's chain.
+
+    Transactions are signed and broadcast in batches of `batch_size`, one
+    /transactions/batch request per peer and batch.
+
+    In the open loop, batches are sent at `rate` transactions per second
+    (0 sends them as fast as they can be signed) on up to `concurrency`
+    threads, whether or not earlier transactions were committed. In the
+    closed loop, at most `concurrency` transactions are waiting to be
+    committed at any time, the next batch waits for room; batches are
+    split to at most `concurrency` transactions so they fit the window.
+
+    Transactions the node rejects, on arrival or after queueing them for
+    verification, or whose broadcast fails, are not waited for; failures
+    are counted and their errors returned with the results. Those still
+    waiting when no block has committed any for `commit_timeout` seconds
+    are given up on and counted too.
+    """
+
+    def __init__(self, node, mode='open', rate=0, concurrency=DEFAULT_CONCURRENCY, batch_size=DEFAULT_BATCH_SIZE, commit_timeout=DEFAULT_COMMIT_TIMEOUT):
+        if mode not in MODES:
+            raise ValueError(f"Unknown load generator mode '{mode}'")
+        self.node = node
+        self.mode = mode
+        self.rate = rate
+        self.concurrency = max(1, concurrency)
+        self.batch_size = max(1, batch_size)
+        self.commit_timeout = commit_timeout
+        self.condition = Condition()
+        self.outstanding = {}  # transaction_id -> submit time
+        self.latencies = []
+        self.submitted = 0
+        self.rejected = 0
+        # Transactions whose broadcast raised, and the errors
+        self.failed = 0
+        self.errors = []
+        # Found committed only when given up on, their latency is unknown
+        self.committed_late = 0
+        # Given up on and not committed
+        self.gave_up = 0
+        self.last_commit = None
+
+    def block_added(self, block):
+        """
+        Blockchain listener, called with every block added to the chain.
+        """
+        now = time.time()
+        with self.condition:
+            for transaction in block.transactions:
+                submitted_at = self.outstanding.pop(transaction['transaction_id'], None)
+                if submitted_at is not None:
+                    self.latencies.append(now - submitted_at)
+                    self.last_commit = now
+            self.condition.notify_all()
+
+    def transaction_rejected(self, transaction_id):
+        """
+        Node rejection listener, called with transactions the verification stage turned away.
+        """
+        with self.condition:
+            if self.outstanding.pop(transaction_id, None) is not None:
+                self.rejected += 1
+                self.condition.notify_all()
+
+    def run(self, entries):
+        """
+        Submit a transaction for every (recipient node id, message) and wait
+        for them to be committed. Returns the results, see `results`.
+        """
+        recipients = {str(node_id).strip(): node_info['public_key'] for node_id, node_info in self.node.nodes.items()}
+        self.node.blockchain.block_listeners.append(self.block_added)
+        self.node.rejection_listeners.append(self.transaction_rejected)
+        start = time.time()
+        start_height = len(self.node.blockchain.chain)
+        try:
+            batch_size = self.batch_size if self.mode == 'open' else min(self.batch_size, self.concurrency)
+            batches = [entries[i:i + batch_size] for i in range(0, len(entries), batch_size)]
+            futures = []
+            with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='loadgen') as executor:
+                for number, batch in enumerate(batches):
+                    if self.mode == 'open':
+                        if self.rate > 0:
+                            delay = start + number * batch_size / self.rate - time.time()
+                            if delay > 0:
+                                time.sleep(delay)
+                        futures.append(executor.submit(self.submit, self.sign(batch, recipients)))
+                    else:
+                        self.wait_for_room(len(batch))
+                        try:
+                            self.submit(self.sign(batch, recipients))
+                        except Exception as e:
+                            self.errors.append(str(e))
+            for future in futures:
+                if future.exception() is not None:
+                    self.errors.append(str(future.exception()))
+            submit_time = time.time() - start
+            if self.errors:
+                print(f"Failed to submit {self.failed} transactions: {self.errors[0]}")
+            self.wait_for_room(0, drain=True)
+        finally:
+            self.node.blockchain.block_listeners.remove(self.block_added)
+            self.node.rejection_listeners.remove(self.transaction_rejected)
+        return self.results(start, submit_time, len(self.node.blockchain.chain) - start_height)
+
+    def sign(self, batch, recipients):
+        transactions = []
+        for recipient_id, message in batch:
+            recipient_public_key = recipients.get(recipient_id)
+            if recipient_public_key is None:
+                print(f"Recipient node ID {recipient_id} not found in nodes dictionary.")
+                continue
+            transaction = Transaction(self.node.wallet.public_key, recipient_public_key, "message", 0.0, message, self.node.get_next_nonce())
+            transaction.sign_transaction(self.node.wallet.private_key)
+            transactions.append(transaction.to_dict())
+        return transactions
+
+    def submit(self, transactions):
+        # Waited for from before the broadcast, the block may come back before the answers do
+        submitted_at = time.time()
+        with self.condition:
+            for transaction in transactions:
+                self.outstanding[transaction['transaction_id']] = submitted_at
+            self.submitted += len(transactions)
+        try:
+            rejected = self.node.broadcast_transactions(transactions)
+        except Exception:
+            # Not waited for, the caller records the error
+            with self.condition:
+                for transaction in transactions:
+                    self.outstanding.pop(transaction['transaction_id'], None)
+                self.failed += len(transactions)
+                self.condition.notify_all()
+            raise
+        with self.condition:
+            for transaction_id in rejected:
+                if self.outstanding.pop(transaction_id, None) is not None:
+                    self.rejected += 1
+            self.condition.notify_all()
+
+    def wait_for_room(self, count, drain=False):
+        """
+        Wait until `count` more transactions fit in the window, or, with
+        drain=True, until none are left waiting. Gives up on the waiting
+        transactions after `commit_timeout` seconds without a commit.
+        """
+        limit = 0 if drain else self.concurrency - count
+        with self.condition:
+            waited_since = time.time()
+            while len(self.outstanding) > limit:
+                remaining = max(self.last_commit or 0, waited_since) + self.commit_timeout - time.time()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            else:
+                return
+            waiting = list(self.outstanding)
+
+        # Some may be in a block the listener did not see, as after a branch switch.
+        # Looked up without holding the condition, listeners are called under the chain's lock
+        late = sum(1 for transaction_id in waiting if self.node.blockchain.find_transaction(transaction_id) is not None)
+        with self.condition:
+            for transaction_id in waiting:
+                self.outstanding.pop(transaction_id, None)
+            self.committed_late += late
+            self.gave_up += len(waiting) - late
+        print(f"Gave up on {len(waiting) - late} uncommitted transactions")
+
+    def results(self, start, submit_time, blocks):
+        latencies = sorted(self.latencies)
+        elapsed = (self.last_commit or time.time()) - start
+        return {
+            'mode': self.mode,
+            'submitted': self.submitted,
+            'rejected': self.rejected,
+            'failed': self.failed,
+            'gave_up': self.gave_up,
+            'errors': self.errors,
+            'committed': len(latencies) + self.committed_late,
+            # Added to the chain during the run, the blocks from before it are not part of the measurement
+            'blocks': blocks,
+            'submit_time': submit_time,
+            'elapsed': elapsed,
+            'throughput': (len(latencies) + self.committed_late) / elapsed if elapsed > 0 else 0,
+            'latency_mean': sum(latencies) / len(latencies) if latencies else 0,
+            'latency_p50': percentile(latencies, 0.50),
+            'latency_p95': percentile(latencies, 0.95),
+            'latency_p99': percentile(latencies, 0.99),
+            'latency_max': latencies[-1] if latencies else 0,
+            'latencies': latencies,
+        }
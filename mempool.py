@@ -0,0 +1,134 @@
+import bisect
+import itertools
+import time
+from collections import OrderedDict
+
+from transaction import CompactTransaction
+
+
+DEFAULT_MAX_SIZE = 10000
+
+
+class Mempool:
+    """
+    Transactions waiting to be minted, keyed by transaction_id and held as
+    CompactTransactions.
+
+    Entries are kept in arrival order, and each sender's entries are also
+    indexed by nonce. A batch for a block fills its slots in arrival order,
+    but a sender's slots are given to that sender's transactions in nonce
+    order, so a transaction is never minted before a lower nonce from the
+    same sender that is also waiting. When the pool is over `max_size`, the
+    highest nonce of the sender holding the most entries is evicted.
+    """
+
+    def __init__(self, transactions=(), max_size=DEFAULT_MAX_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()  # transaction_id -> transaction dict
+        self.by_sender = {}  # sender_address -> sorted [(nonce, arrival, transaction_id)]
+        self.arrived_at = {}  # transaction_id -> time added
+        self.arrivals = itertools.count()
+        self.evicted_count = 0
+        for transaction in transactions:
+            self.add(transaction)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(list(self.entries.values()))
+
+    def __contains__(self, transaction_id):
+        return transaction_id in self.entries
+
+    def get(self, transaction_id):
+        return self.entries.get(transaction_id)
+
+    def oldest_arrival(self):
+        """
+        When the longest waiting transaction was added, or None if the pool is empty.
+        """
+        for transaction_id in self.entries:
+            return self.arrived_at[transaction_id]
+        return None
+
+    def to_list(self):
+        """
+        The pool as transaction dicts, in arrival order.
+        """
+        return [transaction.to_dict() for transaction in self.entries.values()]
+
+    def add(self, transaction):
+        """
+        Add a transaction dict. Returns (admitted, evicted), where admitted is
+        False for a duplicate or when the transaction itself was evicted, and
+        evicted lists the transactions dropped to stay within max_size.
+        """
+        transaction_id = transaction['transaction_id']
+        if transaction_id in self.entries:
+            return False, []
+        transaction = CompactTransaction.from_dict(transaction)
+
+        self.entries[transaction_id] = transaction
+        self.arrived_at[transaction_id] = time.time()
+        sender_entries = self.by_sender.setdefault(transaction['sender_address'], [])
+        bisect.insort(sender_entries, (transaction['nonce'], next(self.arrivals), transaction_id))
+
+        evicted = []
+        while len(self.entries) > self.max_size:
+            evicted.append(self.evict())
+        self.evicted_count += len(evicted)
+        admitted = all(entry['transaction_id'] != transaction_id for entry in evicted)
+        return admitted, evicted
+
+    def evict(self):
+        sender = max(self.by_sender, key=lambda address: len(self.by_sender[address]))
+        _, _, transaction_id = self.by_sender[sender][-1]
+        transaction = self.entries[transaction_id]
+        self.remove([transaction_id])
+        return transaction
+
+    def remove(self, transaction_ids):
+        """
+        Drop the given transactions, ignoring ids that are not in the pool.
+        Returns the number of transactions removed.
+        """
+        removed = 0
+        for transaction_id in transaction_ids:
+            transaction = self.entries.pop(transaction_id, None)
+            if transaction is None:
+                continue
+            del self.arrived_at[transaction_id]
+            sender = transaction['sender_address']
+            sender_entries = self.by_sender[sender]
+            for position, entry in enumerate(sender_entries):
+                if entry[2] == transaction_id:
+                    del sender_entries[position]
+                    break
+            if not sender_entries:
+                del self.by_sender[sender]
+            removed += 1
+        return removed
+
+    def peek(self, count):
+        """
+        The next `count` transactions in block order, left in the pool.
+        """
+        batch = []
+        taken = {}
+        for transaction in self.entries.values():
+            if len(batch) == count:
+                break
+            sender = transaction['sender_address']
+            position = taken.get(sender, 0)
+            taken[sender] = position + 1
+            batch.append(self.entries[self.by_sender[sender][position][2]])
+        return batch
+
+    def take(self, count):
+        """
+        Remove and return the next `count` transactions in block order.
+        """
+        batch = self.peek(count)
+        self.remove([transaction['transaction_id'] for transaction in batch])
+        return batch
@@ -0,0 +1,75 @@
+import hashlib
+import json
+
+
+# Leaves and inner nodes are hashed with different prefixes, so an inner node
+# can never be passed off as a transaction
+LEAF_PREFIX = b'\x00'
+NODE_PREFIX = b'\x01'
+
+
+def leaf_hash(transaction):
+    """
+    Hash of a transaction in dict form, over its canonical JSON.
+
+    The whole transaction is hashed, not only its id: the id does not cover
+    the type or the signature, and the root is all the block hash commits to.
+    """
+    return hashlib.sha256(LEAF_PREFIX + json.dumps(transaction, sort_keys=True).encode()).digest()
+
+
+def node_hash(left, right):
+    return hashlib.sha256(NODE_PREFIX + left + right).digest()
+
+
+def tree_levels(leaves):
+    """
+    Every level of the tree, from the leaves up to the root. A node without
+    a sibling is carried up to the next level unchanged.
+    """
+    levels = [list(leaves)]
+    while len(levels[-1]) > 1:
+        level = levels[-1]
+        parents = [node_hash(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            parents.append(level[-1])
+        levels.append(parents)
+    return levels
+
+
+def merkle_root(transactions):
+    """
+    Hex root of the tree over a list of transaction dicts.
+    """
+    if not transactions:
+        return hashlib.sha256(b'').hexdigest()
+    return tree_levels(leaf_hash(transaction) for transaction in transactions)[-1][0].hex()
+
+
+def merkle_proof(transactions, position):
+    """
+    Sibling hashes from the leaf at `position` up to the root, as a list of
+    {'hash', 'side'} where side says whether the sibling goes on the left or
+    the right when hashing the pair.
+    """
+    proof = []
+    for level in tree_levels(leaf_hash(transaction) for transaction in transactions)[:-1]:
+        sibling = position ^ 1
+        if sibling < len(level):
+            proof.append({'hash': level[sibling].hex(), 'side': 'left' if sibling < position else 'right'})
+        position //= 2
+    return proof
+
+
+def verify_proof(transaction, proof, root):
+    """
+    Whether `proof` shows that the transaction dict is under the hex `root`.
+    """
+    current = leaf_hash(transaction)
+    try:
+        for step in proof:
+            sibling = bytes.fromhex(step['hash'])
+            current = node_hash(sibling, current) if step['side'] == 'left' else node_hash(current, sibling)
+    except (KeyError, TypeError, ValueError):
+        return False
+    return current.hex() == root
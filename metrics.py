@@ -0,0 +1,165 @@
+import bisect
+import time
+from collections import OrderedDict
+from threading import Lock
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds in seconds, from a block that commits right away to a transaction stuck behind a slow network
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Admission times kept for transactions not committed yet, the oldest are dropped first
+MAX_TRACKED_TRANSACTIONS = 100000
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram in the Prometheus model: a count per upper
+    bound, plus the total count and sum of the observed values.
+    """
+
+    def __init__(self, name, description, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, fraction):
+        """
+        Upper bound of the bucket holding the `fraction` quantile, an estimate as in histogram_quantile().
+        """
+        if not self.count:
+            return 0
+        target = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float('inf')
+
+    def exposition(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {seen}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f"{self.name}_sum {self.sum}")
+        lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+
+def sample(name, kind, description, value):
+    return [f"# HELP {name} {description}", f"# TYPE {name} {kind}", f"{name} {value}"]
+
+
+class NodeMetrics:
+    """
+    Node performance metrics, built from the time of each event as it
+    happens on this node: a transaction admitted to the pool, a block minted
+    here, a block received from a peer and a block committed to the chain.
+
+    A transaction's confirmation latency runs from its admission here to the
+    commit of the block holding it. A block's commit time runs from its
+    arrival to its commit, which includes any wait as an orphan, and its
+    propagation time from the minter's timestamp to the commit here. The
+    block time is the interval between consecutive commits.
+    """
+
+    def __init__(self, max_tracked=MAX_TRACKED_TRANSACTIONS):
+        self.lock = Lock()
+        self.max_tracked = max_tracked
+        self.started = time.time()
+        self.admitted_at = OrderedDict()  # transaction_id -> admission time
+        self.received_at = {}  # block hash -> arrival time
+        self.transactions_admitted = 0
+        self.transactions_committed = 0
+        self.blocks_minted = 0
+        self.blocks_received = 0
+        self.blocks_committed = 0
+        self.first_admission = None
+        self.last_commit = None
+        self.confirmation = Histogram('blockchat_transaction_confirmation_seconds', 'Time from admitting a transaction to committing the block holding it.')
+        self.block_commit = Histogram('blockchat_block_commit_seconds', 'Time from receiving a block to committing it.')
+        self.block_propagation = Histogram('blockchat_block_propagation_seconds', 'Time from minting a block on its validator to committing it here.')
+        self.block_interval = Histogram('blockchat_block_interval_seconds', 'Time between consecutive block commits.')
+
+    def transaction_admitted(self, transaction_id):
+        now = time.time()
+        with self.lock:
+            self.transactions_admitted += 1
+            if self.first_admission is None:
+                self.first_admission = now
+            self.admitted_at[transaction_id] = now
+            while len(self.admitted_at) > self.max_tracked:
+                self.admitted_at.popitem(last=False)
+
+    def block_minted(self):
+        with self.lock:
+            self.blocks_minted += 1
+
+    def block_received(self, block):
+        with self.lock:
+            self.blocks_received += 1
+            self.received_at.setdefault(block.current_hash, time.time())
+
+    def block_committed(self, block):
+        """
+        Blockchain listener, called with every block added to the chain.
+        """
+        now = time.time()
+        with self.lock:
+            self.blocks_committed += 1
+            received_at = self.received_at.pop(block.current_hash, None)
+            if received_at is not None:
+                self.block_commit.observe(now - received_at)
+                self.block_propagation.observe(max(now - block.timestamp, 0))
+            if self.last_commit is not None:
+                self.block_interval.observe(now - self.last_commit)
+            self.last_commit = now
+            for transaction in block.transactions:
+                admitted_at = self.admitted_at.pop(transaction['transaction_id'], None)
+                if admitted_at is not None:
+                    self.transactions_committed += 1
+                    self.confirmation.observe(now - admitted_at)
+            # Blocks received but never committed, such as the losing side of a fork
+            if len(self.received_at) > self.max_tracked:
+                self.received_at.clear()
+
+    def throughput(self):
+        """
+        Transactions committed per second, from the first admission to the last commit.
+        """
+        if self.first_admission is None or self.last_commit is None or self.last_commit <= self.first_admission:
+            return 0
+        return self.transactions_committed / (self.last_commit - self.first_admission)
+
+    def exposition(self, mint_worker=None, pool_size=None):
+        """
+        The metrics in the Prometheus text format.
+        """
+        with self.lock:
+            lines = []
+            lines += sample('blockchat_uptime_seconds', 'gauge', 'Seconds since the node started.', time.time() - self.started)
+            lines += sample('blockchat_transactions_admitted_total', 'counter', 'Transactions admitted to the pool.', self.transactions_admitted)
+            lines += sample('blockchat_transactions_committed_total', 'counter', 'Admitted transactions committed in a block.', self.transactions_committed)
+            lines += sample('blockchat_blocks_minted_total', 'counter', 'Blocks minted by this node.', self.blocks_minted)
+            lines += sample('blockchat_blocks_received_total', 'counter', 'Blocks received from peers.', self.blocks_received)
+            lines += sample('blockchat_blocks_committed_total', 'counter', 'Blocks added to the chain.', self.blocks_committed)
+            lines += sample('blockchat_throughput_transactions_per_second', 'gauge', 'Committed transactions per second, from the first admission to the last commit.', self.throughput())
+            for histogram in (self.confirmation, self.block_commit, self.block_propagation, self.block_interval):
+                lines += histogram.exposition()
+        if pool_size is not None:
+            lines += sample('blockchat_transaction_pool_size', 'gauge', 'Transactions waiting in the pool.', pool_size)
+        if mint_worker is not None:
+            lines += sample('blockchat_mint_queue_depth', 'gauge', 'Mint requests waiting for the mint worker.', mint_worker.queue_depth())
+            lines += sample('blockchat_mint_attempts_total', 'counter', 'Minting attempts by the mint worker.', mint_worker.attempts)
+        return ('\n'.join(lines) + '\n').encode()
@@ -0,0 +1,86 @@
+import queue
+import time
+from threading import Thread
+
+
+# Seconds before minting again after a block this node proposed was not accepted
+RETRY_DELAY = 1.0
+
+
+class MintWorker:
+    """
+    Background thread that mints and broadcasts blocks.
+
+    Request handlers only call `request_mint` after admitting a transaction
+    or adding a block, and return right away. The worker takes the queued
+    requests, collapses the ones that piled up while it was busy into a
+    single attempt (minting looks at the whole pool anyway), and calls
+    `mint`, which returns True when it produced a block. `mint` can ask for
+    a later attempt with `schedule`, when a block will be due by then
+    without any new request.
+    """
+
+    def __init__(self, mint):
+        self.mint = mint
+        self.requests = queue.Queue()
+        self.attempts = 0
+        self.blocks_minted = 0
+        self.total_mint_time = 0
+        self.max_mint_time = 0
+        self.last_mint_time = 0
+        self.total_wait_time = 0
+        # Time of the attempt asked for by `schedule`, if any
+        self.wake_at = None
+        self.thread = Thread(target=self.run, name='mint-worker', daemon=True)
+        self.thread.start()
+
+    def request_mint(self):
+        self.requests.put(time.time())
+
+    def queue_depth(self):
+        return self.requests.qsize()
+
+    def average_mint_time(self):
+        return self.total_mint_time / self.blocks_minted if self.blocks_minted else 0
+
+    def average_wait_time(self):
+        return self.total_wait_time / self.attempts if self.attempts else 0
+
+    def schedule(self, delay):
+        """
+        Make another attempt in `delay` seconds unless a request comes first.
+        Called from `mint`, on the worker thread.
+        """
+        wake_at = time.time() + delay
+        if self.wake_at is None or wake_at < self.wake_at:
+            self.wake_at = wake_at
+
+    def run(self):
+        while True:
+            timeout = None if self.wake_at is None else max(self.wake_at - time.time(), 0)
+            try:
+                requested_at = self.requests.get(timeout=timeout)
+            except queue.Empty:
+                requested_at = self.wake_at
+            self.wake_at = None
+            while True:
+                try:
+                    self.requests.get_nowait()
+                except queue.Empty:
+                    break
+
+            start = time.time()
+            self.attempts += 1
+            self.total_wait_time += start - requested_at
+            try:
+                minted = self.mint()
+            except Exception as e:
+                print(f"Minting failed: {e}")
+                continue
+
+            if minted:
+                elapsed = time.time() - start
+                self.blocks_minted += 1
+                self.total_mint_time += elapsed
+                self.last_mint_time = elapsed
+                self.max_mint_time = max(self.max_mint_time, elapsed)
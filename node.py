@@ -1,3 +1,4 @@
+import bisect
 import hashlib
 import json
 import os
@@ -6,14 +7,20 @@ import requests
 from wallet import Wallet
 from transaction import Transaction
 from block import Block
+from transport import PeerTransport, DEFAULT_TIMEOUT
+from verifier import SignatureVerifier
+from mint_worker import MintWorker, RETRY_DELAY
+from loadgen import LoadGenerator, read_transaction_file
+from metrics import NodeMetrics
+from profiling import timed
+from snapshot import read_snapshot, SnapshotError, CHUNK_SIZE
+import wire
 from threading import Lock
 import random
 import numpy
 
-blockchain_lock = Lock()
-
 class Node:
-    def __init__(self, host, port, blockchain, is_bootstrap=False, nonce = 0, total_nodes=5):
+    def __init__(self, host, port, blockchain, is_bootstrap=False, nonce = 0, total_nodes=5, request_timeout=DEFAULT_TIMEOUT, verify_workers=0, wire_format='json', data_dir=None):
         self.host = host
         self.port = port 
         self.total_nodes = total_nodes
@@ -21,14 +28,34 @@ class Node:
         self.api_url = f'http://{host}:{port}'
         self.blockchain = blockchain
         self.nonce = nonce
+        # Transactions can be created from the CLI and the test runner at once
+        self.nonce_lock = Lock()
+        self.data_dir = data_dir
         self.wallet = self.generate_wallet()
         self.node_id = 0 if is_bootstrap else None
         self.total_transactions = 0
         self.throughput = 0
+        self.block_time = 0
         longest_processing_time = 0
         self.block_count = 0
         self.block_count = 0
         self.nodes = {}
+        # Binary payloads are always accepted when msgpack is installed, wire_format decides what this node sends
+        self.wire = wire.WireCodec(self.node_keys) if wire.available() else None
+        if wire_format == 'msgpack' and self.wire is None:
+            raise Exception("The msgpack wire format needs the msgpack package")
+        self.transport = PeerTransport(timeout=request_timeout, codec=self.wire if wire_format == 'msgpack' else None)
+        # With no workers, signatures are verified inline in the request handler
+        self.verifier = SignatureVerifier(verify_workers, self.admit_verified_transaction, self.reject_transaction) if verify_workers > 0 else None
+        # Called with the id of every transaction turned away after it was answered 202 and queued for verification
+        self.rejection_listeners = []
+        # Event timestamps for /metrics
+        self.metrics = NodeMetrics()
+        self.blockchain.block_listeners.append(self.metrics.block_committed)
+        # Blocks are minted and broadcast off the request path
+        self.mint_worker = MintWorker(self.mint_block)
+        # Hash of the tip this node last proposed a block on
+        self.minted_on = None
         
         
         if is_bootstrap:
@@ -45,7 +72,16 @@ class Node:
             self.nodes[node_id] = node_info
         print("Nodes updated successfully")
 
+    def node_keys(self):
+        """
+        Public keys of the known nodes, the shared key table of the wire format.
+        """
+        return [node_info['public_key'] for node_info in list(self.nodes.values())]
+
     def generate_wallet(self):
+        # With a data directory the key pair is kept next to the chain, a restarted node rejoins as the same node
+        if self.data_dir:
+            return Wallet.load_or_create(os.path.join(self.data_dir, 'wallet.pem'))
         return Wallet()
 
     def initialize_genesis_block(self):
@@ -79,51 +115,69 @@ class Node:
 
     def update_blockchain(self, incoming_chain):
         try:
-            # Temporarily save the current blockchain
-            current_chain_backup = self.blockchain.chain
-
-            # Convert the incoming chain data into Block instances and set it as the current blockchain chain for validation
-            self.blockchain.chain = [Block(**block_data) for block_data in incoming_chain]
-
-            # Validate the temporarily set incoming chain
-            if self.blockchain.validate_chain():
-                current_len = len(current_chain_backup)
-                incoming_len = len(self.blockchain.chain)
-
-                # Check if the incoming chain is longer than the current chain
-                if incoming_len > current_len:
-                    # The incoming chain is valid and longer, keep it as the new chain
-                    print(f"Blockchain updated with a longer chain of length {incoming_len}.")
-                    return True
-                else:
-                    # The incoming chain is valid but not longer, restore the original chain
-                    self.blockchain.chain = current_chain_backup
-                    print("Received chain is not longer than the current chain.")
-            else:
-                # The incoming chain is invalid, restore the original chain
-                self.blockchain.chain = current_chain_backup
-                print("Received chain is invalid.")
+            # Convert the incoming chain data into Block instances
+            incoming_blocks = [Block(**block_data) for block_data in incoming_chain]
 
-            return False
+            # The incoming chain is validated on its own and only replaces the current one if it is valid and longer
+            return self.blockchain.adopt_chain(incoming_blocks)
         except Exception as e:
             print(f"An error occurred during blockchain update: {e}")
-            self.blockchain.chain = current_chain_backup  # Restore the original chain in case of error
             return False
-        
+
+    def sync_with(self, peer_address):
+        """
+        Fetch only the blocks this node is missing from a peer.
+
+        The request advertises the local tip, so the peer answers with the
+        blocks after it. If the peer's chain does not extend that tip, fall
+        back to downloading the whole chain.
+        """
+        tip = self.blockchain.tip()
+        params = {'from': tip.index + 1 if tip else 0}
+        if tip:
+            params['hash'] = tip.current_hash
+        response = self.transport.get(peer_address + '/blocks', params=params)
+
+        if response.status_code == 409:
+            response = self.transport.get(peer_address + '/blocks', params={'from': 0})
+            if response.status_code != 200:
+                return False
+            data = wire.decode_response(response, self.transport.codec)
+            updated = self.update_blockchain(data['blocks'])
+        elif response.status_code == 200:
+            data = wire.decode_response(response, self.transport.codec)
+            updated = self.blockchain.append_blocks([Block(**block_data) for block_data in data['blocks']])
+        else:
+            return False
+
+        self.blockchain.set_transaction_pool(data['transaction_pool'])
+        print(f"Synchronized with {peer_address}, chain length {len(self.blockchain.chain)}.")
+        return updated
 
     def register_with_bootstrap(self, bootstrap_url, public_key):
-        response = requests.post(bootstrap_url + '/register', json={'public_key': public_key, 'node_address': self.api_url})
+        # The response carries the whole chain, ask for it in the binary format if that is enabled.
+        # A node starting without a chain offers to bootstrap from a snapshot instead
+        registration = {'public_key': public_key, 'node_address': self.api_url, 'snapshot': not len(self.blockchain.chain)}
+        response = requests.post(bootstrap_url + '/register', **wire.accept_kwargs({'json': registration}, self.transport.codec))
         if response.status_code == 200:
-            data = response.json()
+            data = wire.decode_response(response, self.transport.codec)
             if 'node_address' in data:
-                self.update_blockchain(data['blockchain'])
-                self.blockchain.transaction_pool = data['transaction_pool']
+                if len(self.blockchain.chain):
+                    # Restarted with a stored chain, only fetch the blocks after it
+                    self.sync_with(bootstrap_url)
+                elif 'snapshot' in data:
+                    self.bootstrap_from_snapshot(bootstrap_url, data['snapshot'])
+                else:
+                    self.update_blockchain(data['blockchain'])
+                self.blockchain.set_transaction_pool(data['transaction_pool'])
                 
                 temptrans = Transaction(self.wallet.public_key, 0, "Initial stake", 10, "", 1)
 
-                temptrans.sign_transaction(self.wallet.private_key)
+                # A node restarted with its stored wallet has staked already, the same transaction is in its chain
+                if self.blockchain.find_transaction(temptrans.transaction_id.hexdigest()) is None:
+                    temptrans.sign_transaction(self.wallet.private_key)
 
-                self.blockchain.add_transaction_to_pool(temptrans.to_dict())
+                    self.blockchain.add_transaction_to_pool(temptrans.to_dict())
 
                 for node_id, node_info in data['nodes'].items():
                     if node_id == "0":
@@ -150,6 +204,24 @@ class Node:
 
 
 
+    def bootstrap_from_snapshot(self, bootstrap_url, snapshot):
+        """
+        Start the chain from the bootstrap node's snapshot, then fetch the blocks after it.
+
+        The snapshot is streamed and checked against the digest and tip hash
+        advertised in the registration response. If it cannot be used, the
+        whole chain is fetched instead.
+        """
+        try:
+            with requests.get(bootstrap_url + '/snapshot', stream=True, timeout=self.transport.timeout) as response:
+                if response.status_code != 200:
+                    raise SnapshotError(f"Snapshot download failed with status {response.status_code}")
+                tip, accounts = read_snapshot(response.iter_content(CHUNK_SIZE), snapshot)
+            self.blockchain.install_snapshot(tip, accounts)
+        except (SnapshotError, requests.RequestException) as e:
+            print(f"Could not bootstrap from the snapshot, fetching the whole chain: {e}")
+        return self.sync_with(bootstrap_url)
+
     def transfer_bcc_to_new_node(self, recipient_public_key, amount):
 
         sender_address = self.wallet.public_key  
@@ -178,75 +250,59 @@ class Node:
     
 
     def get_next_nonce(self):
-        max_nonce = 0
-        for block in self.blockchain.chain:
-            for transaction in block.transactions:
-                if isinstance(transaction, Transaction):
-                    sender_address = transaction.sender_address
-                    if sender_address == self.wallet.address:
-                        max_nonce = max(max_nonce, transaction.nonce)
-                elif isinstance(transaction, dict):
-                    sender_address = transaction['sender_address']
-                    if sender_address == self.wallet.address:
-                        max_nonce = max(max_nonce, transaction['nonce'])
-
-        for transaction in self.blockchain.transaction_pool:
-            if isinstance(transaction, Transaction):
-                sender_address = transaction.sender_address
-                if sender_address == self.wallet.address:
-                    max_nonce = max(max_nonce, transaction.nonce)
-            elif isinstance(transaction, dict):
-                sender_address = transaction['sender_address']
-                if sender_address == self.wallet.address:
-                    max_nonce = max(max_nonce, transaction['nonce'])
-        return max_nonce + 1
+        """
+        One past the highest nonce this wallet has used on the chain, in the pool,
+        or already handed out by this node for a transaction still in flight.
+        """
+        with self.nonce_lock:
+            self.nonce = max(self.nonce, self.blockchain.state.nonce(self.wallet.address)) + 1
+            return self.nonce
 
     def stake(self, amount):
         if amount < 0:
             return False, "Stake amount cannot be negative"
         
-        transaction = {
-            'sender_address': self.wallet.public_key,
-            'receiver_address':0,
-            'amount': amount,
-            'type_of_transaction' : "stake",  
-            'message': "",
-            'nonce': 1,
-            'private_key': self.wallet.private_key
-        }
+        transaction = Transaction(self.wallet.public_key, 0, "stake", amount, "", self.get_next_nonce())
+        transaction.sign_transaction(self.wallet.private_key)
 
-        self.broadcast_transaction(transaction)
+        self.broadcast_transaction(transaction.to_dict())
 
     
+    @timed
     def PoS_Choose_Minter(self,seed):
 
         seed_hash = hashlib.sha256(seed.encode()).hexdigest()
         seed_int = int(seed_hash, 16)
 
-        total_stakes = 0
-        for node_id, node_info in self.nodes.items():
-            total_stakes+= self.calculate_stakes(node_info['public_key'])
+        public_keys = [node_info['public_key'] for node_info in self.nodes.values()]
+        cumulative, monotonic = self.blockchain.state.cumulative_stakes(public_keys)
+        total_stakes = cumulative[-1] if cumulative else 0
         rng = numpy.random.default_rng(seed_int)
         if total_stakes == 0:
             return False 
 
         stake_target = rng.uniform(0, total_stakes)
-        current = 0
 
-        for node_id, node_info in self.nodes.items():
-            current += self.calculate_stakes(node_info['public_key'])
+        # First node whose running stake total reaches the target
+        if monotonic:
+            return public_keys[bisect.bisect_left(cumulative, stake_target)]
+        for public_key, current in zip(public_keys, cumulative):
             if current >= stake_target:
-                validator = node_info['public_key']
-                break
-        return validator
+                return public_key
 
-    def validate_block(self, block):
+    def validate_validator(self, block):
         # Check if the validator matches the stakeholder
         if block.validator != self.PoS_Choose_Minter(block.previous_hash):
             return False, "Block Validator does not match the result of the pseudo-random generator"
+        return True, "Block validator is valid"
+
+    def validate_block(self, block):
+        is_valid, message = self.validate_validator(block)
+        if not is_valid:
+            return is_valid, message
 
         # Retrieve the previous block from the blockchain
-        previous_block = self.blockchain.chain[-1]
+        previous_block = self.blockchain.tip()
 
         # Check if the previous hash in the block matches the hash of the previous block
         if block.previous_hash != previous_block.current_hash:
@@ -255,12 +311,13 @@ class Node:
         return True, "Block validated successfully"
     
 
-    def validate_transaction(self, transaction):
+    @timed
+    def validate_transaction(self, transaction, signature_verified=False):
         sender_address = transaction.sender_address    
         amount = transaction.amount
 
-        # Verify the transaction signature
-        if not transaction.verify_signature():
+        # Verify the transaction signature, unless the verification stage already did
+        if not signature_verified and not transaction.verify_signature():
             return False
 
         if transaction.type_of_transaction == "coin":
@@ -288,19 +345,87 @@ class Node:
             return False
 
 
+    def admit_transaction(self, transaction, signature_verified=False):
+        """
+        Validate a transaction and, if it is valid, add it to the pool and ask the mint worker for a block.
+        Returns False for a transaction already in the pool or the chain.
+        """
+        transaction_id = transaction.transaction_id.hexdigest()
+        # Neither the signature nor the chain depends on the pool, check them before taking the lock
+        if self.blockchain.find_transaction(transaction_id) is not None:
+            return False
+        if not signature_verified and not transaction.verify_signature():
+            return False
+
+        # Check the balance and add under one lock, so concurrent spends from one sender cannot both pass
+        with self.blockchain.pool_lock:
+            if transaction_id in self.blockchain.transaction_pool:
+                return False
+            if not self.validate_transaction(transaction, signature_verified=True):
+                return False
+            # Evicted right away when the pool is full of the sender's own transactions
+            if not self.blockchain.add_transaction_to_pool(transaction.to_dict()):
+                return False
+        self.metrics.transaction_admitted(transaction_id)
+        self.mint_worker.request_mint()
+        return True
+
+    def admit_verified_transaction(self, transaction_data):
+        """
+        Called by the verification stage for every transaction whose signature checked out.
+        """
+        if not self.admit_transaction(Transaction.from_dict(transaction_data), signature_verified=True):
+            self.reject_transaction(transaction_data)
+
+    def reject_transaction(self, transaction_data):
+        """
+        Called for every queued transaction that was not admitted, its sender was only told it was queued.
+        """
+        for listener in self.rejection_listeners:
+            listener(transaction_data['transaction_id'])
+
+    @timed
     def broadcast_transaction(self, transaction):
-        for node_id, node_info in self.nodes.items():
-            node_url = node_info['address'] 
-            requests.post(node_url + '/transactions/new', json=transaction)
+        node_urls = [node_info['address'] + '/transactions/new' for node_info in self.nodes.values()]
+        for node_url, response, error in self.transport.post_all(node_urls, json=transaction):
+            if error is not None:
+                print(f"Failed to send transaction to {node_url}: {error}")
 
+    @timed
+    def broadcast_transactions(self, transactions):
+        """
+        Broadcast a batch of signed transaction dicts in one request per peer.
+        Returns the ids of the transactions this node rejected.
+        """
+        node_urls = [node_info['address'] + '/transactions/batch' for node_info in self.nodes.values()]
+        rejected = []
+        for node_url, response, error in self.transport.post_all(node_urls, json={'transactions': transactions}):
+            if error is not None:
+                print(f"Failed to send transactions to {node_url}: {error}")
+            elif node_url.startswith(self.api_url + '/') and response.status_code == 200:
+                statuses = wire.decode_response(response, self.transport.codec)['statuses']
+                rejected = [transaction['transaction_id'] for transaction, status in zip(transactions, statuses) if status not in (200, 202)]
+        return rejected
+
+    @timed
     def broadcast_block(self, block):
-        for node_id, node_info in self.nodes.items():
-            node_url = node_info['address'] 
-            requests.post(node_url + '/receive_block', json=block)
+        """
+        Send a block to every node, this one included. Returns whether this
+        node accepted it, the block is lost to the validator otherwise.
+        """
+        own_url = self.api_url + '/receive_block'
+        node_urls = [node_info['address'] + '/receive_block' for node_info in self.nodes.values()]
+        accepted = False
+        for node_url, response, error in self.transport.post_all(node_urls, json=block):
+            if error is not None:
+                print(f"Failed to send block to {node_url}: {error}")
+            elif node_url == own_url:
+                accepted = response.status_code == 200
         print('Block broadcasted to the network')
+        return accepted
 
     def validate_chain(self):
-        for block in self.blockchain.chain[1:]:  # Exclude the genesis block
+        for block in self.blockchain.blocks(1):  # Exclude the genesis block
             is_valid, message = self.validate_block(block)
             if not is_valid:
                 return False, f"Blockchain validation failed: {message}"
@@ -308,6 +433,7 @@ class Node:
         return True, "Blockchain validation successful"
 
 
+    @timed
     def broadcast_all(self):
         # Data to be broadcasted: IP address, port, and public keys of all nodes
         data_to_broadcast = {
@@ -327,6 +453,7 @@ class Node:
     def send_data(self, data):
         node_items = list(self.nodes.items())[:-1]
         
+        targets = {}
         for node_id, node_info in node_items:
         
             # Skip sending data if the current node is the node itself
@@ -335,23 +462,23 @@ class Node:
             if node_id == self.total_nodes - 1:
                 continue
             ip_address = node_info['address']
-            url = f"{ip_address}/receive_data"
-
-            try:
-                response = requests.post(url, json=data)
-                if response.status_code == 200:
-                    print(f"Data successfully sent to node {node_id}.")
-                else:
-                    print(f"Failed to send data to node {node_id}. Status code: {response.status_code}")
-            except requests.exceptions.RequestException as e:
-                print(f"Failed to send data to node {node_id}: {e}")
+            targets[f"{ip_address}/receive_data"] = node_id
+
+        for url, response, error in self.transport.post_all(list(targets), json=data):
+            node_id = targets[url]
+            if error is not None:
+                print(f"Failed to send data to node {node_id}: {error}")
+            elif response.status_code == 200:
+                print(f"Data successfully sent to node {node_id}.")
+            else:
+                print(f"Failed to send data to node {node_id}. Status code: {response.status_code}")
 
     def view(self):
         """
         View last transactions: print the transactions contained in the last validated block
         of the BlockChat blockchain.
         """
-        last_block = self.blockchain.chain[-1]
+        last_block = self.blockchain.tip()
         if last_block:
             transactions = last_block.transactions
             val_id = self.get_node_id_by_public_key(last_block.validator)
@@ -387,171 +514,127 @@ class Node:
                 break
 
 
-        transaction = {
-            'sender_address': self.wallet.public_key,
-            'receiver_address': recipient_public_key,
-            'amount': float(amount),
-            'type_of_transaction' : type_of_transaction,  
-            'message': message,
-            'nonce': self.get_next_nonce(),
-            'private_key': self.wallet.private_key
-        }
+        # Sign once here, peers only verify the signature
+        transaction = Transaction(self.wallet.public_key, recipient_public_key, type_of_transaction, float(amount), message, self.get_next_nonce())
+        transaction.sign_transaction(self.wallet.private_key)
 
-        self.broadcast_transaction(transaction)
+        self.broadcast_transaction(transaction.to_dict())
 
         return True
             
 
 
+    @timed
     def mint_block(self):
-            currentValidator = self.PoS_Choose_Minter(self.blockchain.chain[-1].current_hash)
-            if len(self.blockchain.transaction_pool) == self.blockchain.block_capacity:
-                transactions = self.blockchain.transaction_pool
-                self.blockchain.transaction_pool = []
+            previous_block = self.blockchain.tip()
+            currentValidator = self.PoS_Choose_Minter(previous_block.current_hash)
+            # Partial blocks wait until every node has joined, one sealed while a node registers could miss it
+            size, wait = self.blockchain.batch_to_seal(allow_partial=len(self.nodes) >= self.total_nodes)
+            if size:
+                # Only the validator takes a batch, the other nodes keep it queued until its block arrives
                 if self.wallet.public_key == currentValidator:
-                        previous_block = self.blockchain.chain[-1]
+                        # The batch stays pooled until the block comes back, so only propose one block per tip
+                        if previous_block.current_hash == self.minted_on:
+                            return False
+                        transactions = self.blockchain.next_transactions(size)
 
-                        # Handle both dict and Transaction instances in the transaction pool
+                        # The pool holds compact transactions, peers are sent their dict form
                         transactions_data = []
                         for tx in transactions:
-                            if isinstance(tx, Transaction):
-                                transactions_data.append(tx.to_dict())
-                            elif isinstance(tx, dict):
+                            if isinstance(tx, dict):
                                 transactions_data.append(tx)  # tx is already a dict
+                            elif hasattr(tx, 'to_dict'):
+                                transactions_data.append(tx.to_dict())
                             else:
                                 print("Unsupported transaction type in transaction pool")
                                 continue
 
                         new_block_data = {
-                            'index': len(self.blockchain.chain),
+                            'index': previous_block.index + 1,
                             'transactions': transactions_data,
                             'validator': currentValidator,
-                            'previous_hash': previous_block.current_hash
+                            'previous_hash': previous_block.current_hash,
+                            'capacity': len(transactions_data),
+                            # Receivers keep the minting time, so the block's propagation can be measured
+                            'timestamp': time.time()
                         }
 
+                        self.minted_on = previous_block.current_hash
                         try: 
-                            self.broadcast_block(new_block_data)
-                            print("Block broadcasted")
+                            accepted = self.broadcast_block(new_block_data)
                         except Exception as e:
                             print(f"Broadcast block failed: {e}")
+                            accepted = False
+                        if not accepted:
+                            # Nothing will bring the block back, propose on this tip again
+                            self.minted_on = None
+                            self.mint_worker.schedule(RETRY_DELAY)
+                            print("Block not accepted, retrying")
                             return False
+                        self.metrics.block_minted()
+                        print("Block broadcasted")
+                        return True
             else:
+                if wait is not None and self.wallet.public_key == currentValidator:
+                    # Seal what the pool holds once the oldest transaction has waited long enough
+                    self.mint_worker.schedule(wait)
                 print("Transaction pool not full")
+            return False
 
 
 
 
 
 
+    @timed
     def calculate_balance(self, public_key):
-        balance = 0
-
-        for block in self.blockchain.chain:
-            for transaction in block.transactions:
-                if transaction['receiver_address'] == public_key :
-                    balance += transaction['amount']
-                if transaction['sender_address'] == public_key and transaction['receiver_address'] != 0 and balance > 0 :
-                    if transaction['type_of_transaction'] == "Welcome!":
-                        balance -= transaction['amount']
-                    elif transaction['type_of_transaction'] == "coin":
-                        balance -= 1.03*transaction['amount'] 
-                    elif transaction['type_of_transaction'] == "message":    
-                        balance -= len(transaction['message'])
-
-        for transaction in self.blockchain.transaction_pool:
-                if transaction['receiver_address'] == public_key :
-                    balance += transaction['amount']
-                if transaction['sender_address'] == public_key and transaction['receiver_address'] != 0 and balance > 0:
-                    if transaction['type_of_transaction'] == "Welcome!":
-                        balance -= transaction['amount']
-                    elif transaction['type_of_transaction'] == "coin":
-                        balance -= 1.03*transaction['amount'] 
-                    elif transaction['type_of_transaction'] == "message":    
-                        balance -= len(transaction['message'])
-
-        if balance > 0:
-            return balance
-        else:
-            balance = 0 
-            return balance
+        """
+        Balance of an address over the chain and the transaction pool, read from
+        the incrementally maintained account state.
+        """
+        return self.blockchain.state.balance(public_key)
 
+    @timed
     def calculate_stakes(self, public_key):
-        totstake = 10
-
-        for transaction in reversed(self.blockchain.transaction_pool):
-            if transaction['type_of_transaction'] == "stake" and transaction['sender_address'] == public_key:
-                totstake = transaction['amount']
-                break  
-
-        if totstake == 10: 
-            for block in reversed(self.blockchain.chain):  
-                for transaction in reversed(block.transactions):  
-                    if transaction['type_of_transaction'] == "stake" and transaction['sender_address'] == public_key:
-                        totstake = transaction['amount']
-                        return totstake  
-
-        return totstake
-
-    def start_test_all_nodes(self, node_addresses, transactions_folder):
-        for node_address in node_addresses:
-            try:
-                response = requests.post(node_address + '/start_test', json={'transactions_folder': transactions_folder})
-                if response.status_code == 200:
-                    print(f"Transaction test started successfully at {node_address}")
-                else:
-                    print(f"Failed to start transaction test at {node_address}. Status Code: {response.status_code}")
-            except requests.exceptions.RequestException as e:
-                print(f"Error communicating with node at {node_address}: {e}")
+        """
+        Latest stake of an address, preferring the transaction pool over the chain.
+        """
+        return self.blockchain.state.stake(public_key)
+
+    def start_test_all_nodes(self, node_addresses, transactions_folder, **options):
+        # Every node runs its whole test before answering, so start them together and wait without a timeout
+        node_urls = [node_address + '/start_test' for node_address in node_addresses]
+        results = self.transport.post_all(node_urls, timeout=None, json=dict(options, transactions_folder=transactions_folder))
+        for node_address, (node_url, response, error) in zip(node_addresses, results):
+            if error is not None:
+                print(f"Error communicating with node at {node_address}: {error}")
+            elif response.status_code == 200:
+                print(f"Transaction test started successfully at {node_address}")
+            else:
+                print(f"Failed to start transaction test at {node_address}. Status Code: {response.status_code}")
 
 
-    def start_transaction_test(self, transactions_folder, node_id): 
+    def start_transaction_test(self, transactions_folder, node_id, **options):
+        """
+        Run the load generator over this node's trans{node_id}.txt, see
+        loadgen.LoadGenerator for the options. Returns its results.
+        """
         self.node_id = node_id
         transactions_file_path = os.path.join(transactions_folder, f'trans{node_id}.txt')
         if not os.path.exists(transactions_file_path):
             print(f"Transaction file '{transactions_file_path}' does not exist.")
-            return
-        self.load_and_process_transactions(transactions_file_path)
-
-    def load_and_process_transactions(self, filepath):
-        with open(filepath, 'r') as file:
-            start_time = time.time()
-            transaction_count = 0
-            node_transactions = 0
-            for line in file:
-                parts = line.strip().split(' ', 1)
-                if len(parts) != 2:
-                    print("Invalid transaction format in file:", line)
-                    continue
-
-                node_id_part, message = parts
-                recipient_id = ''.join(filter(str.isdigit, node_id_part))
-                if not recipient_id:
-                    print(f"Could not extract recipient ID from: {node_id_part}")
-                    continue
-
-                recipient_id = str(recipient_id) 
-
-                for node_id, node_info in self.nodes.items():
-                    node_id = str(node_id).strip()  
-                    if node_id == recipient_id:
-                        recipient_info = node_info
-                        break
-                else:
-                    print(f"Recipient node ID {recipient_id} not found in nodes dictionary.")
-                    continue
-
-                recipient_address = recipient_info['address']
-
-                self.create_transaction(recipient_address, 0, message, "message")
-
-                transaction_count += 1
+            return None
+        return self.load_and_process_transactions(transactions_file_path, **options)
 
-            end_time = time.time()
-            processing_time = end_time - start_time
-            node_transactions += transaction_count
+    def load_and_process_transactions(self, filepath, **options):
+        results = LoadGenerator(self, **options).run(read_transaction_file(filepath))
+        print(f"Load test: {results['committed']} of {results['submitted']} transactions committed, "
+              f"{results['throughput']:.2f} transactions/second, p50 latency {results['latency_p50']:.3f} s, "
+              f"p99 latency {results['latency_p99']:.3f} s")
 
-            metrics_filepath = f'metrics_{self.total_nodes}_nodes_capacity{self.blockchain.block_capacity}_for_node{self.node_id}.txt'
-            self.save_metrics(metrics_filepath, processing_time, node_transactions)
+        metrics_filepath = f'metrics_{self.total_nodes}_nodes_capacity{self.blockchain.block_capacity}_for_node{self.node_id}.txt'
+        self.save_metrics(metrics_filepath, results['elapsed'], results['committed'], results)
+        return results
 
 
     def count_blocks(self):
@@ -564,7 +647,7 @@ class Node:
             return block_count
 
     
-    def save_metrics(self, metrics_filename, processing_time, node_transactions):
+    def save_metrics(self, metrics_filename, processing_time, node_transactions, results=None):
         if node_transactions == 0:
             print("No transactions to calculate metrics.")
             return
@@ -585,6 +668,20 @@ class Node:
             with open(filepath, 'w') as file:
                 file.write(f"Transactions: {node_transactions}\n")
                 file.write(f"Throughput: {throughput} transactions/second\n")
+                file.write(f"Processing Time: {processing_time} seconds\n")
+                if results is not None:
+                    # Submit to commit, as seen by this node
+                    file.write(f"Submitted: {results['submitted']}\n")
+                    file.write(f"Rejected: {results['rejected']}\n")
+                    file.write(f"Failed: {results['failed']}\n")
+                    file.write(f"Gave Up: {results['gave_up']}\n")
+                    file.write(f"Blocks: {results['blocks']}\n")
+                    file.write(f"Submit Time: {results['submit_time']} seconds\n")
+                    file.write(f"Commit Latency Mean: {results['latency_mean']} seconds\n")
+                    file.write(f"Commit Latency p50: {results['latency_p50']} seconds\n")
+                    file.write(f"Commit Latency p95: {results['latency_p95']} seconds\n")
+                    file.write(f"Commit Latency p99: {results['latency_p99']} seconds\n")
+                    file.write(f"Commit Latency Max: {results['latency_max']} seconds\n")
                 # file.write(f"Block Count: {block_count}\n")
                 # file.write(f"Average Block Time: {block_time} seconds/block\n")
         except Exception as e:
@@ -593,30 +690,49 @@ class Node:
         self.aggregate_metrics(total_nodes = self.total_nodes, folder_path='test_results/', output_filename=f'metrics_{self.total_nodes}_nodes_capacity{self.blockchain.block_capacity}.txt')
 
     def aggregate_metrics(self, total_nodes, folder_path, output_filename):
-    
-        files = [f for f in os.listdir(folder_path) if os.path.isfile(os.path.join(folder_path, f))]
-        
+        """
+        Combine the per-node metrics files of a run into `output_filename`,
+        once every node has written its own.
+        """
+        prefix = os.path.splitext(output_filename)[0] + '_for_node'
+        files = [f for f in os.listdir(folder_path) if f.startswith(prefix) and os.path.isfile(os.path.join(folder_path, f))]
+
         # Check if the number of metric files matches the total number of nodes
         if len(files) == total_nodes:
             longest_processing_time = 0
+            # Blocks added during the run, the most any node saw
+            run_blocks = None
             self.total_transactions=0
             self.throughput=0
             self.block_count=0
             self.block_time=0
             # Iterate through each file and aggregate the metrics
             for file in files:
+                transactions = 0
+                throughput = 0
+                processing_time = None
                 with open(os.path.join(folder_path, file), 'r') as f:
                     for line in f:
-                        if "Transactions" in line:
-                            self.total_transactions += int(line.split(":")[1].strip())
-                        elif "Throughput" in line:
-                            processing_time = float(line.split(":")[1].strip().split()[0])  
-                            longest_processing_time = max(longest_processing_time, processing_time)
-  
-            # Calculate new aggregated metrics
+                        name, _, value = line.partition(":")
+                        if name == "Transactions":
+                            transactions = int(value.strip())
+                        elif name == "Throughput":
+                            throughput = float(value.split()[0])
+                        elif name == "Processing Time":
+                            processing_time = float(value.split()[0])
+                        elif name == "Blocks":
+                            run_blocks = max(run_blocks or 0, int(value.strip()))
+                # Files written before the processing time was recorded only have the throughput
+                if processing_time is None:
+                    processing_time = transactions / throughput if throughput > 0 else 0
+                self.total_transactions += transactions
+                longest_processing_time = max(longest_processing_time, processing_time)
+
+            # The nodes ran concurrently, so the run took as long as the slowest one
             self.throughput = self.total_transactions / longest_processing_time if longest_processing_time > 0 else 0
-            self.block_count = self.count_blocks()  
-            self.block_time = processing_time / self.block_count if self.block_count else 0
+            # Files written before the run's blocks were recorded fall back to the whole chain
+            self.block_count = run_blocks if run_blocks is not None else self.count_blocks()
+            self.block_time = longest_processing_time / self.block_count if self.block_count else 0
 
             output_filepath = os.path.join(folder_path, output_filename)
             with open(output_filepath, 'w') as output_file:
@@ -632,4 +748,15 @@ class Node:
         print(f"Total Throughput: {self.throughput} transactions/second\n")
         print(f"Total Block Count: {self.block_count}\n")
         print(f"Average Block Time: {self.block_time} seconds/block\n")
+        print(f"Mint Queue Depth: {self.mint_worker.queue_depth()}\n")
+        print(f"Blocks Minted: {self.mint_worker.blocks_minted} in {self.mint_worker.attempts} attempts\n")
+        print(f"Average Minting Latency: {self.mint_worker.average_mint_time()} seconds/block\n")
+        print(f"Max Minting Latency: {self.mint_worker.max_mint_time} seconds/block\n")
+        print(f"Average Mint Queue Wait: {self.mint_worker.average_wait_time()} seconds\n")
+        print(f"Committed Throughput: {self.metrics.throughput()} transactions/second\n")
+        print(f"Confirmation Latency p50: {self.metrics.confirmation.quantile(0.5)} seconds or less\n")
+        print(f"Confirmation Latency p99: {self.metrics.confirmation.quantile(0.99)} seconds or less\n")
+        print(f"Block Commit Time p50: {self.metrics.block_commit.quantile(0.5)} seconds or less\n")
+        if self.verifier is not None:
+            print(f"Verification Queue Depth: {self.verifier.queue_depth()}\n")
 
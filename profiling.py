@@ -0,0 +1,129 @@
+import functools
+import sys
+import threading
+import time
+from collections import Counter
+from threading import Lock
+
+
+DEFAULT_SAMPLE_SECONDS = 5
+MAX_SAMPLE_SECONDS = 60
+SAMPLE_INTERVAL = 0.005
+REPORT_LINES = 40
+
+
+class Timers:
+    """
+    Call counts and wall time of the functions decorated with `timed`.
+
+    Disabled by default: a disabled timer costs one attribute check per
+    call. The time is inclusive, a timed function calling another timed
+    function counts the inner call in both.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = Lock()
+        self.stats = {}  # qualified name -> [calls, total seconds, max seconds]
+
+    def record(self, name, elapsed):
+        with self.lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                self.stats[name] = [1, elapsed, elapsed]
+            else:
+                stats[0] += 1
+                stats[1] += elapsed
+                if elapsed > stats[2]:
+                    stats[2] = elapsed
+
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+
+    def snapshot(self):
+        """
+        {name: {'calls', 'total_seconds', 'mean_seconds', 'max_seconds'}}, the most time first.
+        """
+        with self.lock:
+            stats = sorted(self.stats.items(), key=lambda item: item[1][1], reverse=True)
+        return {
+            name: {'calls': calls, 'total_seconds': total, 'mean_seconds': total / calls, 'max_seconds': longest}
+            for name, (calls, total, longest) in stats
+        }
+
+    def exposition(self):
+        """
+        The timers in the Prometheus text format, as lines.
+        """
+        snapshot = self.snapshot()
+        lines = ["# HELP blockchat_function_calls_total Calls of the profiled functions.", "# TYPE blockchat_function_calls_total counter"]
+        lines += [f'blockchat_function_calls_total{{function="{name}"}} {stats["calls"]}' for name, stats in snapshot.items()]
+        lines += ["# HELP blockchat_function_seconds_total Wall time spent in the profiled functions.", "# TYPE blockchat_function_seconds_total counter"]
+        lines += [f'blockchat_function_seconds_total{{function="{name}"}} {stats["total_seconds"]}' for name, stats in snapshot.items()]
+        return lines
+
+
+timers = Timers()
+
+
+def timed(function):
+    """
+    Count the calls and time of `function` while the timers are enabled.
+    """
+    name = function.__qualname__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not timers.enabled:
+            return function(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            timers.record(name, time.perf_counter() - start)
+    return wrapper
+
+
+def sample_threads(seconds=DEFAULT_SAMPLE_SECONDS, interval=SAMPLE_INTERVAL, lines=REPORT_LINES):
+    """
+    Sample the stacks of every other thread for `seconds` and return a text
+    report of the functions seen most, by samples where the function was
+    running (self) and where it was on the stack (total).
+
+    cProfile only follows the thread that enables it, while a node's work
+    is spread over request handler, mint worker and transport threads that
+    are already running, so the whole process is sampled instead. Threads
+    blocked on a socket or a queue show up in the frame they wait in.
+    """
+    seconds = min(max(seconds, 0), MAX_SAMPLE_SECONDS)
+    own = threading.get_ident()
+    running = Counter()
+    on_stack = Counter()
+    samples = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own:
+                continue
+            seen = set()
+            leaf = True
+            while frame is not None:
+                code = frame.f_code
+                key = (code.co_name, code.co_filename, code.co_firstlineno)
+                if leaf:
+                    running[key] += 1
+                    leaf = False
+                if key not in seen:
+                    seen.add(key)
+                    on_stack[key] += 1
+                frame = frame.f_back
+        samples += 1
+        time.sleep(interval)
+
+    report = [f"{samples} samples of every thread over {seconds:g} seconds", f"{'self':>6} {'total':>6}  function"]
+    thread_samples = max(sum(running.values()), 1)
+    for key, count in running.most_common(lines):
+        name, filename, line = key
+        report.append(f"{count / thread_samples:>6.1%} {on_stack[key] / thread_samples:>6.1%}  {name} ({filename}:{line})")
+    return '\n'.join(report) + '\n'
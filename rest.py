@@ -1,17 +1,20 @@
-import json
 import logging
 from threading import Thread, Event
 from flask.logging import default_handler
-from flask import Flask, request, jsonify
-import requests
-from block import Block
+from flask import Flask, request, jsonify, abort, send_file
 from node import Node  # Assuming your Node class is inside a folder named 'network'
 from blockchain import Blockchain
-from transaction import Transaction
+from block_store import BlockStore
+from snapshot import DEFAULT_SNAPSHOT_INTERVAL
+from sealing import SealingPolicy, DEFAULT_MAX_WAIT
 from uuid import uuid4
 import os 
 
+import api
 import cli 
+import metrics
+import profiling
+import wire
 
 
 app = Flask(__name__)
@@ -19,6 +22,8 @@ app = Flask(__name__)
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 logger.addHandler(default_handler)
+api.logger.setLevel(logging.INFO)
+api.logger.addHandler(default_handler)
 
 shutdown_event = Event()
 
@@ -27,200 +32,118 @@ node = None
 node_identifier = str(uuid4()).replace('-', '')
 
 
+def wants_binary():
+    return node.wire is not None and wire.accepts(request.headers.get('Accept'))
+
+def request_payload():
+    """
+    The request body, decoded from JSON or from the binary wire format.
+    """
+    if request.mimetype != wire.CONTENT_TYPE:
+        return request.get_json()
+    if node.wire is None:
+        abort(415)
+    try:
+        return node.wire.decode(request.get_data())
+    except wire.WireError:
+        abort(415)
+
+def respond(result):
+    """
+    Flask response for the (body, status) returned by an api handler.
+    """
+    body, status = result
+    if isinstance(body, bytes):
+        return app.response_class(body, status=status, mimetype='application/json')
+    if wants_binary():
+        return app.response_class(node.wire.encode(body, shared=False), status=status, mimetype=wire.CONTENT_TYPE)
+    return jsonify(body), status
+
 @app.route('/register', methods=['POST'])
 def register():
-    try:
-        values = request.get_json()
-        
-        # Extract the public key and node address from the incoming JSON
-        public_key = values.get('public_key')
-        node_address = values.get('node_address')
-
-        # Validate the incoming data
-        if not public_key or not node_address:
-            return jsonify({'message': 'Missing public key or node address'}), 400
-        
-        
-        assigned_node_id = node.next_node_id
-        print(f"Current node: {assigned_node_id}")
-        
-        # Use public_key as the unique identifier for simplicity
-        if public_key in node.nodes:
-            print(f"Node with public key {public_key} is already registered.")
-            return False, None
-        
-        node.nodes[assigned_node_id] = {'public_key': public_key, 'address': node_address}
-        node.next_node_id += 1
-
-        print(f"Node {assigned_node_id} registered.")
-
-        node.transfer_bcc_to_new_node(public_key, 1000)
-
-        print(f"Total nodes: {node.total_nodes}")
-
-        blockchain_data = []
-        for block in node.blockchain.chain:
-            block_dict = block.to_dict()  # Assuming Block has a to_dict method
-            block_dict['transactions'] = [tx.to_dict() if hasattr(tx, 'to_dict') else tx for tx in block.transactions]
-            blockchain_data.append(block_dict)
-
-
-        broadcast_blockchain()
-
-        if node.next_node_id == node.total_nodes:
-            node.broadcast_all()
-        
-        nodes_data = {
-            node_id: {
-                'address': node_info['address'],
-                'public_key': node_info['public_key']
-            }
-            for node_id, node_info in node.nodes.items()
-        }
-
-        response = {
-            'message': 'New node registered successfully',
-            'node_id': assigned_node_id,  # Include the node ID in the response
-            'node_address': node_address,
-            'total_nodes': [node_info['address'] for node_info in node.nodes.values()],
-            'blockchain': blockchain_data,
-            'transaction_pool': node.blockchain.transaction_pool,
-            'nodes': nodes_data
-        }
-        return jsonify(response), 200
-    except Exception as e:
-        logger.exception("Failed to register node: %s", e)
-        return jsonify({'error': 'Internal server error'}), 500    
+    return respond(api.register(node, request_payload()))
 
 @app.route('/transactions/new', methods=['POST'])
 def new_transaction():
-    values = request.get_json()
-
-    new_transaction = Transaction(
-                sender_address=values['sender_address'],
-                receiver_address=values['receiver_address'],
-                type_of_transaction=values['type_of_transaction'],
-                amount=values['amount'],  
-                message=values['message'],
-                nonce=values['nonce'],
-            )
-    
-    new_transaction.sign_transaction(values['private_key'])
-
-    if node.validate_transaction(new_transaction):
-        node.blockchain.add_transaction_to_pool(new_transaction.to_dict())
-        node.mint_block()
-        return jsonify({'error': 'Transaction broadcasted'}), 200
-    else:
-        return jsonify({'error': 'Invalid transaction'}), 400
-    
+    return respond(api.new_transaction(node, request_payload()))
+
+@app.route('/transactions/batch', methods=['POST'])
+def new_transactions():
+    return respond(api.new_transactions(node, request_payload()))
+
+@app.route('/transactions/<transaction_id>', methods=['GET'])
+def get_transaction(transaction_id):
+    return respond(api.transaction(node, transaction_id))
+
+# Addresses are base64 public keys, which may contain slashes
+@app.route('/address/<path:address>/history', methods=['GET'])
+def address_history(address):
+    return respond(api.address_history(node, address, request.args))
+
+@app.route('/transactions/<transaction_id>/proof', methods=['GET'])
+def transaction_proof(transaction_id):
+    return respond(api.transaction_proof(node, transaction_id))
 
 @app.route('/receive_block', methods=['POST'])
 def new_block():
-    values = request.get_json()
-
-    # Log the received values for debugging purposes
-    print("Received data for new block:", values)
-
-    # Instantiate the Block here
-    new_block = Block(
-        index=values['index'],
-        transactions=values['transactions'],
-        validator=values['validator'],
-        previous_hash=values['previous_hash'],
-        capacity = node.blockchain.block_capacity
-    )
-
-    if node.validate_block(new_block):
-        node.blockchain.add_block(new_block)
-        return jsonify({'message': 'Block added and broadcasted'}), 200
-    else:
-        return jsonify({'error': 'Invalid block'}), 400
-    
-    
+    return respond(api.receive_block(node, request_payload()))
+
 @app.route('/blockchain', methods=['GET'])
 def get_full_chain():
-    chain_data = [block.to_dict() for block in node.blockchain.chain]  # Convert each block to a dictionary
-    response = {
-        'chain': chain_data,
-        'length': len(chain_data),
-    }
-    return jsonify(response), 200
+    return respond(api.full_chain(node))
 
 @app.route('/update_blockchain', methods=['POST'])
 def update_blockchain():
-    try:
-        data = request.get_json()
-        incoming_chain = data['blockchain_data']
-
-        if not incoming_chain:
-            return jsonify({'error': 'Invalid data received'}), 400
-
-        current_chain_backup = node.blockchain.chain
-        node.blockchain.chain = [Block(**block_data) for block_data in incoming_chain]
-        node.blockchain.transaction_pool = data['transaction_pool']
-        if node.blockchain.validate_chain():
-            current_len = len(current_chain_backup)
-            incoming_len = len(node.blockchain.chain)
-
-            if incoming_len > current_len:
-                updated_chain = [block.to_dict() for block in node.blockchain.chain]  
-                return jsonify({'message': 'Blockchain updated successfully', 'new_chain': updated_chain}), 200
-            else:
-                node.blockchain.chain = current_chain_backup
-                return jsonify({'message': 'Received chain is not longer than the current chain'}), 200
-        else:
-            node.blockchain.chain = current_chain_backup
-            return jsonify({'error': 'Received chain is invalid'}), 400
-    except Exception as e:
-        logger.exception("Failed to update blockchain: %s", str(e))
-        return jsonify({'error': 'Internal server error'}), 500
-
+    return respond(api.update_blockchain(node, request_payload()))
 
 @app.route('/receive_data', methods=['POST'])
 def receive_nodes():
-    try:
-        received_data = request.get_json()
-        node.update_nodes(received_data)
-        return jsonify({'message': 'Node updated successfully'}), 200
-    except Exception as e:
-        logger.exception("Failed to receive node: %s", e)
-        return jsonify({'error': 'Internal server error'}), 500
+    return respond(api.receive_data(node, request_payload()))
+
+@app.route('/blocks', methods=['GET'])
+def get_blocks():
+    return respond(api.blocks(node, request.args, wants_binary()))
+
+@app.route('/snapshot', methods=['GET'])
+def get_snapshot():
+    file, headers = api.open_snapshot(node)
+    if file is None:
+        return respond(({'error': 'No snapshot available'}, 404))
+    response = send_file(file, mimetype='application/gzip')
+    response.headers.update(headers)
+    return response
+
+@app.route('/sync', methods=['POST'])
+def sync():
+    return respond(api.sync(node, request_payload()))
 
 @app.route('/broadcast_blockchain', methods=['POST'])
 def broadcast_blockchain():
-    node_addresses = [node_info["address"] for node_id, node_info in node.nodes.items()]
-    
-    # Convert each block to a dictionary, including converting each transaction to a dictionary
-    blockchain_data = []
-    for block in node.blockchain.chain:
-        block_dict = block.to_dict()  # Assuming Block has a to_dict method
-        # Check if each transaction is a dict or needs conversion
-        block_dict['transactions'] = [tx if isinstance(tx, dict) else tx.to_dict() for tx in block.transactions]
-        blockchain_data.append(block_dict)
-
-    for node_address in node_addresses[:-1]:
-        try:
-            # Send the serialized blockchain data
-            response = requests.post(f"{node_address}/update_blockchain", json={'blockchain_data': blockchain_data, 'transaction_pool': node.blockchain.transaction_pool})
-            if response.status_code == 200:
-                print(f"Successfully broadcasted blockchain to {node_address}.")
-            else:
-                print(f"Failed to broadcast blockchain to {node_address}. Status Code: {response.status_code}")
-        except requests.exceptions.RequestException as e:
-            print(f"Error broadcasting blockchain to {node_address}: {e}")
-from flask import request
+    return respond(api.broadcast_blockchain(node))
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return app.response_class(api.metrics(node), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/profile', methods=['GET'])
+def get_profile():
+    return respond(api.profile(node))
+
+@app.route('/profile', methods=['POST'])
+def set_profile():
+    # The body is optional, without one the timers are left as they are
+    return respond(api.set_profile(node, request_payload() if request.get_data() else None))
+
+@app.route('/profile/sample', methods=['GET'])
+def profile_sample():
+    body, status = api.profile_sample(node, request.args)
+    if status != 200:
+        return respond((body, status))
+    return app.response_class(body, content_type='text/plain; charset=utf-8')
 
 @app.route('/start_test', methods=['POST'])
 def start_test():
-    data = request.get_json()
-    transactions_folder = data.get('transactions_folder')
-    node_id = node.get_node_id_by_public_key(node.wallet.public_key)
-    if transactions_folder:
-        node.start_transaction_test(transactions_folder, node_id)
-        return jsonify({'message': f'Transaction tests started for all nodes using folder {transactions_folder}'}), 200
-    else:
-        return jsonify({'error': 'Missing transactions_folder in JSON data'}), 400
+    return respond(api.start_test(node, request_payload()))
 
 
 if __name__ == '__main__':
@@ -232,15 +155,34 @@ if __name__ == '__main__':
     parser.add_argument('--is_bootstrap', action='store_true', help='Flag to set this node as the bootstrap node')
     parser.add_argument('--bootstrap_url', type=str, help='URL of the bootstrap node for registration')
     parser.add_argument('--block_capacity', type=int, default=5, help='Block capacity for the blockchain')
+    parser.add_argument('--max_wait', type=float, default=DEFAULT_MAX_WAIT, help='Seconds the oldest pending transaction waits before a block is sealed below capacity (0 waits for a full block)')
+    parser.add_argument('--adaptive_capacity', action='store_true', help='Grow blocks beyond the block capacity with the backlog of pending transactions')
+    parser.add_argument('--max_block_capacity', type=int, help='Largest adaptive block (defaults to 4 times the block capacity)')
     parser.add_argument('--total_nodes', type=int, default=5, help='Total number of nodes in the network')
+    parser.add_argument('--request_timeout', type=float, default=5, help='Timeout in seconds for requests to other nodes')
+    parser.add_argument('--mempool_size', type=int, default=10000, help='Maximum number of pending transactions kept in the pool')
+    parser.add_argument('--data_dir', type=str, help='Directory for the persistent block store (keeps the chain in memory if not set)')
+    parser.add_argument('--verify_workers', type=int, default=0, help='Worker processes for batch signature verification (0 verifies inline)')
+    parser.add_argument('--server', choices=['flask', 'async'], default='flask', help='HTTP server: the Flask development server, or an aiohttp server with non-blocking peer requests')
+    parser.add_argument('--snapshot_interval', type=int, default=DEFAULT_SNAPSHOT_INTERVAL, help='Blocks between the snapshots the bootstrap node writes for new nodes (0 disables them)')
+    parser.add_argument('--snapshot_dir', type=str, help='Directory for the bootstrap node\'s snapshots (defaults to the data directory, snapshots are off without either)')
+    parser.add_argument('--profile', action='store_true', help='Time the hot-path functions from the start (they can also be turned on with POST /profile or the profile CLI command)')
+    parser.add_argument('--wire', choices=['json', 'msgpack'], default='json', help='Format of payloads sent to peers (msgpack falls back to JSON for peers that cannot decode it)')
 
     args = parser.parse_args()
+    profiling.timers.enabled = args.profile
 
     # Initialize Blockchain with specified block capacity
-    blockchain = Blockchain(block_capacity=args.block_capacity)
+    store = BlockStore(args.data_dir) if args.data_dir else None
+    sealing = SealingPolicy(args.block_capacity, max_wait=args.max_wait, adaptive=args.adaptive_capacity, max_capacity=args.max_block_capacity)
+    blockchain = Blockchain(block_capacity=args.block_capacity, store=store, mempool_size=args.mempool_size, sealing=sealing)
+    # Snapshots are only written where they were asked for, a plain run leaves no files behind
+    snapshot_dir = args.snapshot_dir or args.data_dir
+    if args.is_bootstrap and args.snapshot_interval > 0 and snapshot_dir:
+        blockchain.enable_snapshots(snapshot_dir, args.snapshot_interval)
 
     # Initialize Node with specified total nodes and blockchain instance
-    node = Node(host=args.host, port=args.port, blockchain=blockchain, is_bootstrap=args.is_bootstrap, total_nodes=args.total_nodes)
+    node = Node(host=args.host, port=args.port, blockchain=blockchain, is_bootstrap=args.is_bootstrap, total_nodes=args.total_nodes, request_timeout=args.request_timeout, verify_workers=args.verify_workers, wire_format=args.wire, data_dir=args.data_dir)
 
     
     # Node registration logic
@@ -257,12 +199,17 @@ if __name__ == '__main__':
     cli_thread.start()
 
     try:
-        app.run(host=args.host, port=args.port)
+        if args.server == 'async':
+            # aiohttp is only needed when the async server is selected
+            import async_server
+            async_server.run(node, host=args.host, port=args.port)
+        else:
+            app.run(host=args.host, port=args.port)
     finally:
-        # This is executed when app.run() exits
+        # This is executed when the server exits
         shutdown_event.set()  # Signal CLI thread to shut down
         cli_thread.join()  # Wait for the CLI thread to exit
-        print("Flask app and CLI have shut down.")
+        print("Server and CLI have shut down.")
 
 
 
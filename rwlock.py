@@ -0,0 +1,48 @@
+from contextlib import contextmanager
+from threading import Condition, Lock
+
+
+class ReadWriteLock:
+    """
+    Lock held by any number of readers or by a single writer.
+
+    A waiting writer holds back readers that arrive after it, so a steady
+    stream of reads cannot starve it. Not reentrant: a thread holding the
+    lock must not acquire it again, and should not wait on a peer's answer
+    while holding it, since the peer may need to read from this node.
+    """
+
+    def __init__(self):
+        self.condition = Condition(Lock())
+        self.readers = 0
+        self.writing = False
+        self.waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        with self.condition:
+            while self.writing or self.waiting_writers:
+                self.condition.wait()
+            self.readers += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.readers -= 1
+                if not self.readers:
+                    self.condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self.condition:
+            self.waiting_writers += 1
+            while self.writing or self.readers:
+                self.condition.wait()
+            self.waiting_writers -= 1
+            self.writing = True
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.writing = False
+                self.condition.notify_all()
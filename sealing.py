@@ -0,0 +1,54 @@
+import time
+
+
+# Seconds the oldest pending transaction may wait before a partial block is sealed
+DEFAULT_MAX_WAIT = 2.0
+# An adaptive block grows up to this many times the configured capacity by default
+ADAPTIVE_GROWTH = 4
+# Largest block accepted from a peer, whatever the peer's own policy
+MAX_BLOCK_SIZE = 1000
+
+
+class SealingPolicy:
+    """
+    When a validator seals a block, and how many transactions go into it.
+
+    A block is sealed once the pool holds `capacity` transactions or, with
+    a `max_wait`, once the oldest pending transaction has waited that long,
+    with whatever the pool holds, so transactions do not wait forever at
+    low load. With `adaptive`, the block grows with the backlog: it takes
+    half of the pending transactions, between `capacity` and
+    `max_capacity`, so a burst drains in a few larger blocks instead of
+    many blocks of `capacity`.
+    """
+
+    def __init__(self, capacity, max_wait=0, adaptive=False, max_capacity=None):
+        self.capacity = capacity
+        self.max_wait = max_wait
+        self.adaptive = adaptive
+        self.max_capacity = min(max_capacity or capacity * ADAPTIVE_GROWTH, MAX_BLOCK_SIZE) if adaptive else capacity
+
+    def block_size(self, pending):
+        if not self.adaptive:
+            return self.capacity
+        return min(self.max_capacity, max(self.capacity, pending // 2))
+
+    def seal(self, pending, oldest_arrival, allow_partial=True, now=None):
+        """
+        The number of transactions to seal into a block now, 0 to keep waiting.
+        """
+        if pending >= self.capacity:
+            return self.block_size(pending)
+        if pending and allow_partial and self.wait_left(oldest_arrival, now) == 0:
+            return pending
+        return 0
+
+    def wait_left(self, oldest_arrival, now=None):
+        """
+        Seconds until a transaction that arrived at `oldest_arrival` has
+        waited `max_wait`, or None without a max wait.
+        """
+        if self.max_wait <= 0 or oldest_arrival is None:
+            return None
+        now = time.time() if now is None else now
+        return max(oldest_arrival + self.max_wait - now, 0)
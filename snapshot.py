@@ -0,0 +1,165 @@
+import gzip
+import hashlib
+import json
+import os
+import queue
+import zlib
+from threading import Lock, Thread
+
+from block import Block
+
+
+SNAPSHOT_FILE = 'snapshot.json.gz'
+SNAPSHOT_VERSION = 1
+# Blocks between snapshots written by the bootstrap node
+DEFAULT_SNAPSHOT_INTERVAL = 100
+CHUNK_SIZE = 64 * 1024
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def snapshot_bytes(tip, accounts):
+    """
+    The gzip compressed snapshot of the account state after block `tip`.
+    """
+    snapshot = {
+        'version': SNAPSHOT_VERSION,
+        'height': tip.index + 1,
+        'tip': tip.to_dict(),
+        'accounts': accounts,
+    }
+    # mtime is fixed so the same state always gives the same bytes, and the same digest
+    return gzip.compress(json.dumps(snapshot, separators=(',', ':')).encode(), mtime=0)
+
+
+def describe(data, height, tip_hash):
+    """
+    Metadata advertised for a snapshot, which the receiver checks it against.
+    """
+    return {'height': height, 'tip_hash': tip_hash, 'digest': hashlib.sha256(data).hexdigest(), 'size': len(data)}
+
+
+def read_snapshot(chunks, expected):
+    """
+    Decompress and verify a snapshot received as an iterable of byte chunks.
+
+    `expected` is the metadata the bootstrap node advertised for it: the
+    snapshot must hash to its digest, and hold a tip block whose contents
+    hash to its tip hash at its height. Returns (tip block, accounts).
+    """
+    digest = hashlib.sha256()
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    parts = []
+    try:
+        for chunk in chunks:
+            digest.update(chunk)
+            parts.append(decompressor.decompress(chunk))
+        parts.append(decompressor.flush())
+    except zlib.error as e:
+        raise SnapshotError(f"Corrupt snapshot: {e}")
+    if digest.hexdigest() != expected['digest']:
+        raise SnapshotError("Snapshot does not match the advertised digest")
+
+    try:
+        snapshot = json.loads(b''.join(parts))
+        tip = Block(**snapshot['tip'])
+        height = snapshot['height']
+        accounts = snapshot['accounts']
+    except (KeyError, TypeError, ValueError) as e:
+        raise SnapshotError(f"Malformed snapshot: {e}")
+    if tip.calculate_hash() != tip.current_hash or tip.current_hash != expected['tip_hash']:
+        raise SnapshotError("Snapshot tip does not match the advertised tip hash")
+    if height != tip.index + 1 or height != expected['height']:
+        raise SnapshotError("Snapshot height does not match its tip")
+    return tip, accounts
+
+
+class SnapshotWriter:
+    """
+    Background thread that checkpoints the chain for new nodes.
+
+    Every `interval` blocks the Blockchain calls `block_added`, and the
+    worker writes the confirmed account state together with the tip block
+    to a compressed file. A node registering with the bootstrap node
+    downloads that file instead of receiving the whole chain, and then
+    fetches only the blocks after the tip.
+
+    The file is replaced atomically, and `open` hands out the file together
+    with its metadata under `lock`, so a download never mixes two snapshots.
+    """
+
+    def __init__(self, blockchain, directory, interval=DEFAULT_SNAPSHOT_INTERVAL):
+        self.blockchain = blockchain
+        self.directory = directory
+        self.interval = interval
+        self.path = os.path.join(directory, SNAPSHOT_FILE)
+        os.makedirs(directory, exist_ok=True)
+        self.lock = Lock()
+        self.latest = None
+        self.load_existing()
+        self.requests = queue.Queue()
+        self.thread = Thread(target=self.run, name='snapshot-writer', daemon=True)
+        self.thread.start()
+
+    def load_existing(self):
+        """
+        Pick up the snapshot left by a previous run, if the chain still holds its tip.
+        """
+        try:
+            with open(self.path, 'rb') as file:
+                data = file.read()
+            tip = json.loads(gzip.decompress(data))['tip']
+        except (OSError, ValueError, KeyError, TypeError, EOFError, zlib.error):
+            return
+        chain = self.blockchain.chain
+        if self.blockchain.base_index() <= tip['index'] < len(chain) and chain[tip['index']].current_hash == tip['current_hash']:
+            self.latest = describe(data, tip['index'] + 1, tip['current_hash'])
+
+    def block_added(self, height):
+        if self.interval and height % self.interval == 0:
+            self.requests.put(height)
+
+    def run(self):
+        while True:
+            self.requests.get()
+            # Writes that piled up are collapsed, the snapshot is taken at the current tip anyway
+            while True:
+                try:
+                    self.requests.get_nowait()
+                except queue.Empty:
+                    break
+            try:
+                self.write()
+            except Exception as e:
+                print(f"Writing snapshot failed: {e}")
+
+    def write(self):
+        """
+        Write a snapshot of the current tip now. Returns its metadata.
+        """
+        # Tip and state are read together under the read lock, compressed after releasing it
+        with self.blockchain.lock.read():
+            tip = self.blockchain.chain[-1]
+            accounts = self.blockchain.state.confirmed_to_dict()
+        data = snapshot_bytes(tip, accounts)
+        metadata = describe(data, tip.index + 1, tip.current_hash)
+
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'wb') as file:
+            file.write(data)
+        with self.lock:
+            os.replace(temporary_path, self.path)
+            self.latest = metadata
+        print(f"Snapshot written at height {metadata['height']} ({metadata['size']} bytes)")
+        return metadata
+
+    def open(self):
+        """
+        (open file, metadata) of the latest snapshot, or (None, None) if there is none yet.
+        """
+        with self.lock:
+            if self.latest is None:
+                return None, None
+            return open(self.path, 'rb'), dict(self.latest)
@@ -1,4 +1,5 @@
 import base64
+import functools
 import hashlib
 import json
 import Crypto
@@ -8,7 +9,48 @@ from Crypto.Signature import pkcs1_15
 from Crypto.Signature import PKCS1_v1_5
 from Crypto.Hash import SHA256
 
+from wire import hex_bytes, base64_bytes
+
+
+# Field order of the dict form, as Transaction.to_dict() produces it
+FIELDS = ('sender_address', 'receiver_address', 'type_of_transaction', 'amount', 'message', 'nonce', 'transaction_id', 'signature')
+# Marks a field the dict form did not have, so it is left out again
+MISSING = object()
+
+# Addresses of the confirmed accounts, keyed by themselves: all transactions share one copy of each key.
+# Only committed blocks add to it, a payload that fails validation cannot grow it
+ADDRESS_TABLE = {}
+
+
+def intern_address(address):
+    """
+    The shared copy of a known address, or the address itself.
+    """
+    try:
+        return ADDRESS_TABLE.get(address, address)
+    except TypeError:
+        # Not hashable, keep it as it is
+        return address
+
+
+def register_address(address):
+    """
+    Add the address of an account of the chain to the table, and return its shared copy.
+    """
+    return ADDRESS_TABLE.setdefault(address, address)
+
+
+@functools.lru_cache(maxsize=1024)
+def load_public_key(address):
+    """
+    Parse the RSA public key behind a base64 encoded address, once per address.
+    """
+    return RSA.import_key(base64.b64decode(address))
+
+
 class Transaction:
+    __slots__ = ('sender_address', 'receiver_address', 'type_of_transaction', 'amount', 'message', 'nonce', 'signature', 'transaction_id')
+
     def __init__(self, sender_address, receiver_address, type_of_transaction, amount, message=None, nonce=0, signature = None):
         self.sender_address = sender_address
         self.receiver_address = receiver_address
@@ -16,9 +58,26 @@ class Transaction:
         self.amount = amount
         self.message = message
         self.nonce = nonce
+        self.signature = signature
         # self.transaction_id = self.calculate_transaction_id()
         self.transaction_id = self.hash() 
 
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Rebuild a transaction from its to_dict() form, decoding the signature.
+        """
+        signature = data.get('signature')
+        return cls(
+            sender_address=data['sender_address'],
+            receiver_address=data['receiver_address'],
+            type_of_transaction=data['type_of_transaction'],
+            amount=data['amount'],
+            message=data['message'],
+            nonce=data['nonce'],
+            signature=base64.b64decode(signature) if signature else None,
+        )
+
 
     def hash(self):
 
@@ -69,6 +128,110 @@ class Transaction:
         return self.signature
     
     def verify_signature(self):
-            pk = RSA.import_key(base64.b64decode(self.sender_address))
+            if not self.signature:
+                return False
+            try:
+                pk = load_public_key(self.sender_address)
+            except (ValueError, TypeError):
+                return False
             verifier = PKCS1_v1_5.new(pk)
-            return verifier.verify(self.transaction_id, self.signature)
\ No newline at end of file
+            return verifier.verify(self.transaction_id, self.signature)
+
+
+class CompactTransaction:
+    """
+    Read-only, compact form of a transaction dict, as blocks and the pool hold them.
+
+    Addresses go through the address table, so the public keys each
+    transaction carries twice are stored once per node instead of once per
+    transaction. The transaction id and the signature are kept as raw
+    bytes rather than hex and base64 text. Fields are read like a dict's,
+    giving back the same values, and to_dict() rebuilds the exact dict
+    this was made from. Convert at the API boundary, when encoding.
+    """
+
+    __slots__ = FIELDS + ('extra',)
+
+    def __init__(self, data):
+        for field in FIELDS:
+            value = data.get(field, MISSING)
+            if field in ('sender_address', 'receiver_address'):
+                value = intern_address(value)
+            elif field == 'transaction_id' and isinstance(value, str):
+                raw = hex_bytes(value)
+                value = raw if raw is not None else value
+            elif field == 'signature' and isinstance(value, str):
+                raw = base64_bytes(value)
+                value = raw if raw is not None else value
+            object.__setattr__(self, field, value)
+        # Fields a transaction does not normally have are kept as they are
+        object.__setattr__(self, 'extra', {key: value for key, value in data.items() if key not in FIELDS} or None)
+
+    @classmethod
+    def from_dict(cls, data):
+        if isinstance(data, cls):
+            return data
+        if isinstance(data, Transaction):
+            data = data.to_dict()
+        return cls(data)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("CompactTransaction is read-only")
+
+    def __getitem__(self, key):
+        if key in FIELDS:
+            value = getattr(self, key)
+            if value is MISSING:
+                raise KeyError(key)
+            if isinstance(value, bytes):
+                if key == 'transaction_id':
+                    return value.hex()
+                if key == 'signature':
+                    return base64.b64encode(value).decode()
+            return value
+        if self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return self.get(key, MISSING) is not MISSING
+
+    def id_key(self):
+        """
+        The transaction id as stored, raw bytes for a hex id: a compact key for indexes.
+        """
+        return self.transaction_id
+
+    def to_dict(self):
+        data = {field: self[field] for field in FIELDS if getattr(self, field) is not MISSING}
+        if self.extra is not None:
+            data.update(self.extra)
+        return data
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+
+def id_key(transaction_id):
+    """
+    The index key of a transaction id, see CompactTransaction.id_key.
+    """
+    raw = hex_bytes(transaction_id) if isinstance(transaction_id, str) else None
+    return raw if raw is not None else transaction_id
+
+
+def verify_transaction_dict(data):
+    """
+    Check that a transaction in dict form is signed by its sender and that its
+    transaction_id, if present, matches its contents.
+    """
+    transaction = Transaction.from_dict(data)
+    if data.get('transaction_id') and data['transaction_id'] != transaction.transaction_id.hexdigest():
+        return False
+    return transaction.verify_signature()
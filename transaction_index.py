@@ -0,0 +1,87 @@
+from threading import Lock
+
+from transaction import id_key
+
+
+class TransactionIndex:
+    """
+    Where each committed transaction is, by transaction_id and by address.
+
+    `by_id` maps a transaction_id, as raw bytes, to (block index, position
+    in the block), `by_address` maps a sender or receiver address to the
+    locations of its transactions in chain order, so looking one up is O(1)
+    and a page of an address's history is O(page size).
+
+    The Blockchain adds every block as it is appended, under its write lock.
+    A chain restored from a block store is not read up front: `catch_up`
+    indexes the blocks the index has not seen on the first lookup, with the
+    read lock held, and `lock` keeps concurrent lookups from doing it twice.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.by_id = {}
+        self.by_address = {}
+        # Blocks below this index are indexed
+        self.height = 0
+
+    def reset(self, height=0):
+        with self.lock:
+            self.by_id = {}
+            self.by_address = {}
+            self.height = height
+
+    def add_block(self, block):
+        with self.lock:
+            # Blocks a lookup has not caught up with yet are indexed then, in order
+            if block.index == self.height:
+                self._add_block(block)
+
+    def _add_block(self, block):
+        for position, transaction in enumerate(block.transactions):
+            location = (block.index, position)
+            self.by_id[transaction.id_key()] = location
+            for address in {transaction['sender_address'], transaction['receiver_address']}:
+                self.by_address.setdefault(address, []).append(location)
+        self.height = block.index + 1
+
+    def remove_blocks(self, blocks):
+        """
+        Unindex the blocks cut from the end of the chain, given in chain order.
+        """
+        with self.lock:
+            height = blocks[0].index
+            for block in reversed(blocks):
+                if block.index >= self.height:
+                    continue
+                for position, transaction in enumerate(block.transactions):
+                    key = transaction.id_key()
+                    if self.by_id.get(key) == (block.index, position):
+                        del self.by_id[key]
+                    for address in {transaction['sender_address'], transaction['receiver_address']}:
+                        locations = self.by_address.get(address)
+                        while locations and locations[-1][0] >= block.index:
+                            locations.pop()
+                        if locations is not None and not locations:
+                            del self.by_address[address]
+            self.height = min(self.height, height)
+
+    def catch_up(self, chain, start=0):
+        """
+        Index the blocks of `chain` the index has not seen. Call with the chain's read lock held.
+        """
+        with self.lock:
+            for index in range(max(self.height, start), len(chain)):
+                self._add_block(chain[index])
+
+    def locate(self, transaction_id):
+        return self.by_id.get(id_key(transaction_id))
+
+    def history(self, address, offset, limit):
+        """
+        (total, locations) for a page of an address's transactions, newest first.
+        """
+        locations = self.by_address.get(address, ())
+        total = len(locations)
+        end = max(total - offset, 0)
+        return total, locations[max(end - limit, 0):end][::-1]
@@ -0,0 +1,106 @@
+import multiprocessing
+import queue
+from concurrent.futures import ProcessPoolExecutor
+from threading import Thread
+
+from transaction import verify_transaction_dict
+
+
+DEFAULT_BATCH_SIZE = 64
+
+
+def verify_batch(transactions):
+    """
+    Verify a list of transaction dicts, returning one bool per transaction.
+    Runs inside a worker process.
+    """
+    return [verify_transaction_dict(transaction) for transaction in transactions]
+
+
+class BatchVerifier:
+    """
+    Verifies batches of transaction dicts on a pool of worker processes.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        # Spawned workers do not inherit the locks held by the node's threads
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def verify(self, batch):
+        """
+        Split a batch across the worker processes and collect the results in order.
+        """
+        chunk_size = max(1, -(-len(batch) // self.workers))
+        chunks = [batch[i:i + chunk_size] for i in range(0, len(batch), chunk_size)]
+        results = []
+        for chunk_results in self.executor.map(verify_batch, chunks):
+            results.extend(chunk_results)
+        return results
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+
+class SignatureVerifier:
+    """
+    Verification stage in front of the transaction pool.
+
+    Incoming transactions are queued, and a background thread drains the
+    queue in batches and checks their signatures on a BatchVerifier. Each
+    batch is handed to `on_verified` in arrival order, so only verified
+    transactions reach the pool and senders' transactions are admitted in
+    the order they were received. Those that fail, or whose batch could not
+    be verified, are handed to `on_rejected`.
+    """
+
+    def __init__(self, workers, on_verified, on_rejected=None, batch_size=DEFAULT_BATCH_SIZE):
+        self.on_verified = on_verified
+        self.on_rejected = on_rejected
+        self.batch_size = batch_size
+        self.pending = queue.Queue()
+        self.batch_verifier = BatchVerifier(workers)
+        self.verified_count = 0
+        self.rejected_count = 0
+        self.thread = Thread(target=self.run, name='signature-verifier', daemon=True)
+        self.thread.start()
+
+    def submit(self, transaction):
+        """
+        Queue a transaction dict (with its signature) for verification.
+        """
+        self.pending.put(transaction)
+
+    def queue_depth(self):
+        return self.pending.qsize()
+
+    def next_batch(self):
+        batch = [self.pending.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.pending.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            try:
+                results = self.batch_verifier.verify(batch)
+            except Exception as e:
+                print(f"Signature verification failed for a batch of {len(batch)} transactions: {e}")
+                results = [False] * len(batch)
+
+            for transaction, is_valid in zip(batch, results):
+                if not is_valid:
+                    self.rejected_count += 1
+                    print("Invalid transaction signature")
+                    if self.on_rejected is not None:
+                        self.on_rejected(transaction)
+                    continue
+                self.verified_count += 1
+                try:
+                    self.on_verified(transaction)
+                except Exception as e:
+                    print(f"Failed to admit verified transaction: {e}")
@@ -1,4 +1,5 @@
 import json
+import os
 import Crypto
 from Crypto.PublicKey import RSA
 import base64
@@ -6,14 +7,30 @@ from Crypto.Signature import pkcs1_15
 from Crypto.Hash import SHA256
 
 class Wallet:
-    def __init__(self):
+    def __init__(self, private_key=None):
         key_length = 1024  
-        rsaKeys = RSA.generate(key_length)
+        rsaKeys = RSA.import_key(private_key) if private_key else RSA.generate(key_length)
         self.private_key = rsaKeys.export_key().decode('utf-8') 
         self.public_key = base64.b64encode(rsaKeys.publickey().export_key()).decode('utf-8')  
         self.address = self.public_key  
         self.balance = 0 
 
+    @classmethod
+    def load_or_create(cls, path):
+        """
+        The wallet whose private key is stored at `path`, or a new one saved
+        there, so a node keeps its identity across restarts.
+        """
+        if os.path.exists(path):
+            with open(path) as file:
+                return cls(file.read())
+        wallet = cls()
+        temporary_path = path + '.tmp'
+        with open(os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as file:
+            file.write(wallet.private_key)
+        os.replace(temporary_path, path)
+        return wallet
+
     def sign_transaction(self, transaction):
         """
         Sign a transaction with the wallet's private key.
@@ -0,0 +1,208 @@
+import base64
+import binascii
+import hashlib
+import struct
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+CONTENT_TYPE = 'application/x-blockchat-msgpack'
+
+ADDRESS_FIELDS = ('sender_address', 'receiver_address', 'validator', 'public_key')
+HEX_FIELDS = ('transaction_id', 'current_hash', 'previous_hash', 'merkle_root', 'hash')
+BASE64_FIELDS = ('signature',)
+
+# msgpack extension types
+SHARED_KEY = 1  # index into the table of the network's node keys
+LOCAL_KEY = 2  # index into the key table sent with the payload
+HEX = 3  # lowercase hex string sent as its bytes
+BASE64 = 4  # base64 string sent as its bytes
+
+KEY_INDEX = struct.Struct('>H')
+
+
+class WireError(ValueError):
+    pass
+
+
+def available():
+    return msgpack is not None
+
+
+def accepts(accept_header):
+    """
+    Whether an Accept header explicitly asks for the binary format.
+    """
+    return any(part.split(';')[0].strip() == CONTENT_TYPE for part in (accept_header or '').split(','))
+
+
+def hex_bytes(value):
+    if len(value) % 2:
+        return None
+    try:
+        raw = bytes.fromhex(value)
+    except ValueError:
+        return None
+    return raw if raw.hex() == value else None
+
+
+def base64_bytes(value):
+    try:
+        raw = base64.b64decode(value, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    return raw if base64.b64encode(raw).decode() == value else None
+
+
+class WireCodec:
+    """
+    Compact binary encoding of the JSON payloads exchanged between nodes.
+
+    Payloads are packed with msgpack. Addresses, the base64 encoded public
+    keys that every transaction carries twice, are replaced by a two byte
+    index. Keys of the network's nodes index a table sorted by key, which
+    every node derives from its own node list. A payload only uses that
+    table if the receiver's table has the same digest, otherwise the
+    receiver rejects it and the sender falls back to JSON. Any other key is
+    sent once per payload in a table of its own. Hashes and signatures are
+    sent as raw bytes instead of hex and base64 text.
+
+    Decoding gives back exactly the dict the JSON encoding would give, dict
+    keys included (JSON turns integer node ids into strings, so this does too).
+    """
+
+    def __init__(self, known_keys):
+        # Callable returning the public keys of the nodes this node knows about
+        self.known_keys = known_keys
+        self._table = (None, [], {}, None)
+
+    def shared_table(self):
+        """
+        (table, index by key, digest) of the shared key table, cached until the node list changes.
+        """
+        keys = frozenset(key for key in self.known_keys() if isinstance(key, str))
+        cached_keys, table, index, digest = self._table
+        if cached_keys != keys:
+            table = sorted(keys)
+            index = {key: position for position, key in enumerate(table)}
+            digest = hashlib.sha256('\n'.join(table).encode()).digest()[:8]
+            self._table = (keys, table, index, digest)
+        return table, index, digest
+
+    def encode(self, payload, shared=True):
+        """
+        Pack a JSON-like payload. With shared=False the payload does not
+        depend on the receiver's key table, e.g. for responses.
+        """
+        _, shared_index, digest = self.shared_table() if shared else (None, {}, None)
+        local_table = []
+        local_index = {}
+
+        def address(value):
+            position = shared_index.get(value)
+            if position is not None:
+                return msgpack.ExtType(SHARED_KEY, KEY_INDEX.pack(position))
+            position = local_index.get(value)
+            if position is None:
+                position = local_index[value] = len(local_table)
+                raw = base64_bytes(value)
+                local_table.append(msgpack.ExtType(BASE64, raw) if raw is not None else value)
+            return msgpack.ExtType(LOCAL_KEY, KEY_INDEX.pack(position))
+
+        def text(value, field):
+            if field in HEX_FIELDS:
+                raw = hex_bytes(value)
+                if raw is not None:
+                    return msgpack.ExtType(HEX, raw)
+            elif field in BASE64_FIELDS:
+                raw = base64_bytes(value)
+                if raw is not None:
+                    return msgpack.ExtType(BASE64, raw)
+            return value
+
+        def walk(value, field=None):
+            if isinstance(value, dict):
+                return {key if isinstance(key, str) else str(key): walk(item, key) for key, item in value.items()}
+            if isinstance(value, (list, tuple)):
+                return [walk(item) for item in value]
+            if isinstance(value, str):
+                if field in ADDRESS_FIELDS:
+                    return address(value)
+                return text(value, field)
+            return value
+
+        body = msgpack.packb(walk(payload))
+        return msgpack.packb([digest, local_table, body])
+
+    def decode(self, data):
+        try:
+            digest, local_table, body = msgpack.unpackb(data, ext_hook=self.decode_text, raw=False)
+        except (ValueError, TypeError, msgpack.UnpackException) as e:
+            raise WireError(f"Malformed payload: {e}")
+
+        shared_table = []
+        if digest is not None:
+            shared_table, _, own_digest = self.shared_table()
+            if digest != own_digest:
+                raise WireError("Payload was encoded with a different key table")
+
+        def ext_hook(code, data):
+            if code == SHARED_KEY:
+                return shared_table[KEY_INDEX.unpack(data)[0]]
+            if code == LOCAL_KEY:
+                return local_table[KEY_INDEX.unpack(data)[0]]
+            return self.decode_text(code, data)
+
+        try:
+            return msgpack.unpackb(body, ext_hook=ext_hook, raw=False, strict_map_key=False)
+        except (ValueError, TypeError, IndexError, struct.error, msgpack.UnpackException) as e:
+            raise WireError(f"Malformed payload: {e}")
+
+    @staticmethod
+    def decode_text(code, data):
+        if code == HEX:
+            return data.hex()
+        if code == BASE64:
+            return base64.b64encode(data).decode()
+        return msgpack.ExtType(code, data)
+
+
+def encode_payload(codec, kwargs):
+    """
+    The binary form of the `json` payload of a request, or None if it is
+    to be sent as JSON.
+    """
+    if codec is None or kwargs.get('json') is None:
+        return None
+    return codec.encode(kwargs['json'])
+
+
+def binary_kwargs(kwargs, encoded):
+    """
+    Request keyword arguments (requests or aiohttp) with the `json` payload
+    replaced by its `encoded` binary form.
+    """
+    kwargs = dict(kwargs, data=encoded, headers=dict(kwargs.get('headers') or {}, **{'Content-Type': CONTENT_TYPE}))
+    del kwargs['json']
+    return kwargs
+
+
+def accept_kwargs(kwargs, codec):
+    """
+    Request keyword arguments asking for a binary response if a codec is given.
+    """
+    if codec is None:
+        return kwargs
+    return dict(kwargs, headers=dict(kwargs.get('headers') or {}, Accept=f"{CONTENT_TYPE}, application/json"))
+
+
+def decode_response(response, codec):
+    """
+    The payload of a peer's response, whichever format it was sent in.
+    """
+    if codec is not None and response.headers.get('Content-Type', '').startswith(CONTENT_TYPE):
+        return codec.decode(response.content)
+    return response.json()